@@ -0,0 +1,256 @@
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# ================= 配置文档 =================
+USAGE_EXAMPLES = """
+使用示例 (Examples):
+
+  1. 默认规模 (200 个文件, 1KB~1MB 对数均匀分布, 30% GBK, 一半文件含广告块), 结果打印到终端:
+     python bench_cleaner.py
+
+  2. 指定语料规模与测试矩阵, 结果写入 JSON:
+     python bench_cleaner.py --files 2000 --min-kb 1 --max-kb 4096 --parsers html.parser lxml direct --jobs 1 4 -o bench.json
+
+  3. 包含超大文件 (最大 100MB, 64MB 以上的文件走流式引擎):
+     python bench_cleaner.py --files 20 --max-kb 102400
+
+  4. 与上一版本的结果对比 (吞吐量下降或峰值内存上升超过 10% 时返回非零退出码; 语料参数须与基线一致):
+     python bench_cleaner.py -o new.json --compare old.json --tolerance 0.1
+
+  5. 只生成语料 (不跑基准), 用于手工测试:
+     python bench_cleaner.py --files 500 --generate-only ./corpus
+"""
+# ===========================================
+
+CLEANER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cleaner.py")
+SELECTOR = ".ad-banner"
+
+PAGE_HEAD = """<!DOCTYPE html>
+<html><head><meta charset="{charset}"><title>page {index}</title></head>
+<body><h1>page {index}</h1>
+"""
+PAGE_TAIL = "</body></html>\n"
+PARAGRAPH = "<p>正文内容 lorem ipsum 中文测试文本, 用于清理基准。</p>\n"
+AD_BLOCK = '<div class="ad-banner"><a href="#">广告</a><img src="ad.png"></div>\n'
+ADS_PER_FILE = 3  # 命中文件中的广告块数
+
+def _tree_dirs(root, depth, fanout):
+    """目录树中的全部目录: depth 层、每层 fanout 个子目录"""
+    dirs = [root]
+    frontier = [root]
+    for _ in range(depth - 1):
+        frontier = [os.path.join(d, f"d{i}") for d in frontier for i in range(fanout)]
+        dirs.extend(frontier)
+    for d in dirs:
+        os.makedirs(d, exist_ok=True)
+    return dirs
+
+def _write_page(path, index, size, charset, nesting, ads, rng):
+    """写出约 size 字节的页面: 正文块嵌套在 nesting 层 div 中，ads 个广告块随机插在正文块之间"""
+    head = PAGE_HEAD.format(charset=charset, index=index).encode(charset)
+    block = ('<div class="wrap">' * nesting + PARAGRAPH + "</div>" * nesting + "\n").encode(charset)
+    ad = AD_BLOCK.encode(charset)
+    blocks = max(1, (size - len(head) - len(PAGE_TAIL)) // len(block))
+    positions = sorted(rng.sample(range(blocks), min(ads, blocks)))
+
+    # 按批写出，100MB 的文件也不在内存中拼出整页
+    batch = max(1, (1024 * 1024) // len(block))
+    written = 0
+    with open(path, "wb") as f:
+        f.write(head)
+        for position in positions + [blocks]:
+            while written < position:
+                n = min(batch, position - written)
+                f.write(block * n)
+                written += n
+            if position < blocks:
+                f.write(ad)
+        f.write(PAGE_TAIL.encode(charset))
+        return f.tell()
+
+def generate_corpus(root, files=200, depth=3, fanout=4, min_kb=1, max_kb=1024, nesting=4,
+                    gbk_ratio=0.3, match_rate=0.5, seed=0):
+    """
+    生成合成语料 (同一 seed 结果相同)，返回 {files, bytes, matched, gbk}。
+
+    min_kb / max_kb : 文件大小在此区间内按对数均匀分布 (小文件多、大文件少)
+    nesting         : 正文块外层 div 的嵌套层数
+    gbk_ratio       : GBK 编码文件的比例，其余为 UTF-8
+    match_rate      : 含有广告块 (命中 SELECTOR) 的文件比例
+    """
+    rng = random.Random(seed)
+    dirs = _tree_dirs(root, depth, fanout)
+    gbk = set(rng.sample(range(files), round(files * gbk_ratio)))
+    matched = set(rng.sample(range(files), round(files * match_rate)))
+    low, high = math.log(min_kb * 1024), math.log(max_kb * 1024)
+
+    total = 0
+    for i in range(files):
+        size = int(math.exp(rng.uniform(low, high)))
+        path = os.path.join(dirs[i % len(dirs)], f"page_{i}.html")
+        total += _write_page(path, i, size, "gbk" if i in gbk else "utf-8", nesting,
+                             ADS_PER_FILE if i in matched else 0, rng)
+    return {"files": files, "bytes": total, "matched": len(matched), "gbk": len(gbk)}
+
+def run_cleaner(argv):
+    """在子进程中运行 cleaner.py，返回 (耗时秒数, 峰值内存字节数)；峰值内存在 POSIX 下通过 wait4 获取"""
+    started = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, CLEANER] + argv, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    stderr = proc.stderr.read()
+    peak_rss = None
+    if hasattr(os, "wait4"):
+        _, status, rusage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        # Linux 下 ru_maxrss 单位为 KB，macOS 下为字节；包含已回收的工作进程
+        peak_rss = rusage.ru_maxrss * (1 if platform.system() == "Darwin" else 1024)
+    else:
+        proc.wait()
+    seconds = time.perf_counter() - started
+    proc.stderr.close()
+    if proc.returncode != 0:
+        raise RuntimeError(f"cleaner.py 退出码 {proc.returncode}: {stderr.decode(errors='replace')}")
+    return seconds, peak_rss
+
+def bench_end_to_end(root, out_dir, corpus, parser, jobs, selector=SELECTOR):
+    """端到端: 另存到 out_dir (不改动语料)，各阶段耗时取自 cleaner.py --stats"""
+    shutil.rmtree(out_dir, ignore_errors=True)
+    stats_path = os.path.join(tempfile.gettempdir(), f"bench-cleaner-{os.getpid()}.json")
+    try:
+        seconds, peak_rss = run_cleaner(["-i", root, "-o", out_dir, "-r", "-s", selector, "--parser", parser,
+                                         "-j", str(jobs), "--stats", stats_path])
+        with open(stats_path, encoding="utf-8") as f:
+            summary = json.load(f)["summary"]
+    finally:
+        if os.path.exists(stats_path):
+            os.remove(stats_path)
+    return {"parser": parser, "jobs": jobs, "seconds": seconds, "files_per_sec": corpus["files"] / seconds,
+            "mb_per_sec": corpus["bytes"] / 1024 / 1024 / seconds, "peak_rss": peak_rss,
+            "statuses": summary["statuses"], "timings": summary["timings"]}
+
+# 决定语料内容的参数；parsers / jobs 只决定跑哪些条目，按 (parser, jobs) 对齐共有的条目即可对比
+CORPUS_PARAMS = ("files", "depth", "min_kb", "max_kb", "nesting", "gbk_ratio", "match_rate", "seed")
+
+def differences(current, baseline, section, keys=None):
+    """两次结果中 section (params / environment) 下取值不同的键；keys 限定只比较这些键"""
+    new, old = current.get(section, {}), baseline.get(section, {})
+    keys = set(new) | set(old) if keys is None else keys
+    return sorted(k for k in keys if new.get(k) != old.get(k))
+
+def compare(current, baseline, tolerance=0.1):
+    """
+    对比两次结果: 吞吐量低于基线 (1 - tolerance) 或峰值内存高于基线 (1 + tolerance) 的条目。
+    语料参数不同的两次结果没有可比性，抛出 ValueError；解析器与并发级别不同时只对比两次都有的条目。
+    """
+    mismatched = differences(current, baseline, "params", CORPUS_PARAMS)
+    if mismatched:
+        raise ValueError("基线的语料参数不同, 无法对比: " + ", ".join(
+            f"{k}={baseline.get('params', {}).get(k)!r} -> {current.get('params', {}).get(k)!r}" for k in mismatched))
+    regressions = []
+
+    def check(name, new, old, higher_is_better=True):
+        if not old or new is None:
+            return
+        worse = new < old * (1 - tolerance) if higher_is_better else new > old * (1 + tolerance)
+        if worse:
+            regressions.append({"metric": name, "baseline": old, "current": new, "ratio": new / old})
+
+    old_rows = {(r["parser"], r["jobs"]): r for r in baseline.get("end_to_end", [])}
+    for row in current.get("end_to_end", []):
+        old = old_rows.get((row["parser"], row["jobs"]))
+        if old is None:
+            continue
+        label = f"end_to_end[{row['parser']}, jobs={row['jobs']}]"
+        check(f"{label}.files_per_sec", row["files_per_sec"], old["files_per_sec"])
+        check(f"{label}.mb_per_sec", row["mb_per_sec"], old["mb_per_sec"])
+        check(f"{label}.peak_rss", row.get("peak_rss"), old.get("peak_rss"), higher_is_better=False)
+    return regressions
+
+def run_benchmarks(files=200, depth=3, min_kb=1, max_kb=1024, nesting=4, gbk_ratio=0.3, match_rate=0.5,
+                   parsers=("html.parser", "lxml"), jobs_levels=(1, 4), seed=0):
+    work_dir = tempfile.mkdtemp(prefix="bench-cleaner-")
+    try:
+        root = os.path.join(work_dir, "corpus")
+        started = time.perf_counter()
+        corpus = generate_corpus(root, files, depth, min_kb=min_kb, max_kb=max_kb, nesting=nesting,
+                                 gbk_ratio=gbk_ratio, match_rate=match_rate, seed=seed)
+        corpus["generate_seconds"] = time.perf_counter() - started
+        out_dir = os.path.join(work_dir, "out")
+        return {
+            "params": {"files": files, "depth": depth, "min_kb": min_kb, "max_kb": max_kb, "nesting": nesting,
+                       "gbk_ratio": gbk_ratio, "match_rate": match_rate, "parsers": list(parsers),
+                       "jobs": list(jobs_levels), "seed": seed},
+            "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                            "cpu_count": os.cpu_count()},
+            "corpus": corpus,
+            "end_to_end": [bench_end_to_end(root, out_dir, corpus, p, j) for p in parsers for j in jobs_levels],
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="cleaner 性能基准 (自动生成合成语料, 离线运行)",
+        epilog=USAGE_EXAMPLES,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--files", type=int, default=200, help="合成 HTML 文件数 (默认: 200)")
+    parser.add_argument("--depth", type=int, default=3, help="目录层数 (默认: 3)")
+    parser.add_argument("--min-kb", type=float, default=1, help="最小文件大小 KB (默认: 1)")
+    parser.add_argument("--max-kb", type=float, default=1024, help="最大文件大小 KB, 最大可到 102400 即 100MB (默认: 1024)")
+    parser.add_argument("--nesting", type=int, default=4, help="正文块的 div 嵌套层数 (默认: 4)")
+    parser.add_argument("--gbk-ratio", type=float, default=0.3, help="GBK 编码文件比例 (默认: 0.3)")
+    parser.add_argument("--match-rate", type=float, default=0.5, help="含广告块 (命中选择器) 的文件比例 (默认: 0.5)")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子, 相同种子生成相同语料 (默认: 0)")
+    parser.add_argument("--parsers", nargs="+", default=["html.parser", "lxml"], help="测试的解析器 (默认: html.parser lxml)")
+    parser.add_argument("--jobs", type=int, nargs="+", default=[1, 4], help="测试的并发档位 (默认: 1 4)")
+    parser.add_argument("--generate-only", metavar="DIR", help="只在 DIR 生成语料, 不运行基准")
+    parser.add_argument("-o", "--output", help="结果写入 JSON 文件")
+    parser.add_argument("--compare", help="与基线结果 JSON 对比")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="允许的吞吐量下降 / 内存上升比例 (默认: 0.1)")
+    args = parser.parse_args()
+
+    if args.generate_only:
+        corpus = generate_corpus(args.generate_only, args.files, args.depth, min_kb=args.min_kb, max_kb=args.max_kb,
+                                 nesting=args.nesting, gbk_ratio=args.gbk_ratio, match_rate=args.match_rate,
+                                 seed=args.seed)
+        print(f"📁 已生成 {corpus['files']} 个文件 ({corpus['bytes'] / 1024 / 1024:.1f} MB) -> {args.generate_only}")
+        return
+
+    results = run_benchmarks(args.files, args.depth, args.min_kb, args.max_kb, args.nesting, args.gbk_ratio,
+                             args.match_rate, args.parsers, args.jobs, args.seed)
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+        print(f"📊 结果已写入 {args.output}")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        environment = differences(results, baseline, "environment")
+        if environment:
+            print(f"⚠️  [警告] 运行环境与基线不同 ({', '.join(environment)}), 对比结果仅供参考")
+        try:
+            regressions = compare(results, baseline, args.tolerance)
+        except ValueError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+        for r in regressions:
+            print(f"❌ [退化] {r['metric']}: {r['baseline']:.1f} -> {r['current']:.1f} ({r['ratio']:.0%})")
+        if regressions:
+            sys.exit(1)
+        print("✅ 未发现性能退化")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import stat
+import sys
+import tempfile
+import time
+from unittest.mock import patch
+
+import html2pdf
+
+# ================= 配置文档 =================
+USAGE_EXAMPLES = """
+使用示例 (Examples):
+
+  1. 默认规模 (500 个文件, 3 层目录, 浏览器桩延迟 20ms), 结果打印到终端:
+     python bench_html2pdf.py
+
+  2. 指定规模与并发档位, 结果写入 JSON:
+     python bench_html2pdf.py --files 5000 --depth 4 --jobs 1 4 16 -o bench.json
+
+  3. 与上一版本的结果对比 (吞吐量下降超过 10% 时返回非零退出码; 负载参数须与基线一致):
+     python bench_html2pdf.py -o new.json --compare old.json --tolerance 0.1
+"""
+# ===========================================
+
+# 浏览器桩: 只解析 --print-to-pdf 参数，等待固定延迟后写出一个极小的 PDF
+STUB_TEMPLATE = """#!{python}
+import sys, time
+time.sleep({latency!r})
+for arg in sys.argv[1:]:
+    if arg.startswith("--print-to-pdf="):
+        with open(arg.split("=", 1)[1], "wb") as f:
+            f.write(b"%PDF-1.4\\n%%EOF\\n")
+"""
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>page {index}</title></head>
+<body><h1>page {index}</h1>
+{body}
+</body></html>
+"""
+
+def generate_tree(root, files=500, depth=3, fanout=4, size_kb=4):
+    """生成合成 HTML 目录树：文件均匀分布在 depth 层、每层 fanout 个子目录中"""
+    dirs = [root]
+    frontier = [root]
+    for _ in range(depth - 1):
+        frontier = [os.path.join(d, f"d{i}") for d in frontier for i in range(fanout)]
+        dirs.extend(frontier)
+    for d in dirs:
+        os.makedirs(d, exist_ok=True)
+
+    paragraph = "<p>" + "lorem ipsum " * 8 + "</p>\n"
+    body = paragraph * max(1, size_kb * 1024 // len(paragraph))
+    for i in range(files):
+        with open(os.path.join(dirs[i % len(dirs)], f"page_{i}.html"), "w", encoding="utf-8") as f:
+            f.write(PAGE_TEMPLATE.format(index=i, body=body))
+    return root
+
+def write_stub_browser(directory, latency=0.02):
+    """写出可执行的浏览器桩脚本 (POSIX 通过 shebang 直接执行)"""
+    path = os.path.join(directory, "fake-browser")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(STUB_TEMPLATE.format(python=sys.executable, latency=latency))
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return path
+
+def run_html2pdf(argv):
+    """以命令行方式运行 html2pdf.main，屏蔽其输出，返回耗时 (秒)"""
+    with patch.object(sys, "argv", ["html2pdf.py"] + argv), contextlib.redirect_stdout(io.StringIO()):
+        started = time.perf_counter()
+        html2pdf.main()
+        return time.perf_counter() - started
+
+def bench_discovery(root, repeat=3):
+    """文件发现: 完整遍历目录树的耗时与首个文件的到达时间"""
+    totals, firsts, count = [], [], 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        files = html2pdf.collect_files(root, recursive=True)
+        next(files)
+        firsts.append(time.perf_counter() - started)
+        count = 1 + sum(1 for _ in files)
+        totals.append(time.perf_counter() - started)
+    return {"files": count, "seconds": min(totals), "first_file_seconds": min(firsts),
+            "files_per_sec": count / min(totals)}
+
+def bench_scheduling(root, files, jobs):
+    """调度开销: 渲染替换为空操作，只测量遍历、提交、计数与输出的成本"""
+    with patch("html2pdf.run_conversion", return_value=True):
+        seconds = run_html2pdf([root, "-r", "-f", "-j", str(jobs), "--browser-path", sys.executable])
+    return {"jobs": jobs, "seconds": seconds, "files_per_sec": files / seconds}
+
+def bench_end_to_end(root, out_dir, browser, files, jobs):
+    """端到端吞吐: 使用浏览器桩真实启动子进程"""
+    shutil.rmtree(out_dir, ignore_errors=True)
+    report = os.path.join(tempfile.gettempdir(), f"bench-html2pdf-{os.getpid()}.json")
+    try:
+        seconds = run_html2pdf([root, "-r", "-d", out_dir, "-j", str(jobs), "--browser-path", browser,
+                                "--retries", "0", "--report", report])
+        with open(report, encoding="utf-8") as f:
+            summary = json.load(f)["summary"]
+    finally:
+        if os.path.exists(report):
+            os.remove(report)
+    return {"jobs": jobs, "seconds": seconds, "files_per_sec": files / seconds,
+            "latency": summary["latency"], "queue_wait_p95": summary["queue_wait_p95"]}
+
+# 决定负载的参数: 不同时吞吐量没有可比性。并发档位不在其中，两次结果只对比共有的档位
+WORKLOAD_PARAMS = ("files", "depth", "latency", "size_kb")
+
+def differences(current, baseline, section, keys=None):
+    """两次结果中 section (params / environment) 下取值不同的键；keys 限定只比较这些键"""
+    new, old = current.get(section, {}), baseline.get(section, {})
+    keys = set(new) | set(old) if keys is None else keys
+    return sorted(k for k in keys if new.get(k) != old.get(k))
+
+def compare(current, baseline, tolerance=0.1):
+    """
+    对比两次结果的吞吐量，返回低于基线 (1 - tolerance) 的条目。
+    负载参数 (文件数、层数、延迟、文件大小) 不同的两次结果没有可比性，抛出 ValueError。
+    """
+    mismatched = differences(current, baseline, "params", WORKLOAD_PARAMS)
+    if mismatched:
+        raise ValueError("基线的负载参数不同, 无法对比: " + ", ".join(
+            f"{k}={baseline.get('params', {}).get(k)!r} -> {current.get('params', {}).get(k)!r}" for k in mismatched))
+    regressions = []
+
+    def check(name, new, old):
+        if old and new < old * (1 - tolerance):
+            regressions.append({"metric": name, "baseline": old, "current": new, "ratio": new / old})
+
+    check("discovery.files_per_sec", current["discovery"]["files_per_sec"], baseline["discovery"]["files_per_sec"])
+    for section in ("scheduling", "end_to_end"):
+        old_by_jobs = {r["jobs"]: r for r in baseline.get(section, [])}
+        for row in current.get(section, []):
+            if row["jobs"] in old_by_jobs:
+                check(f"{section}[jobs={row['jobs']}].files_per_sec", row["files_per_sec"],
+                      old_by_jobs[row["jobs"]]["files_per_sec"])
+    return regressions
+
+def run_benchmarks(files=500, depth=3, latency=0.02, jobs_levels=(1, 4, 16), size_kb=4, skip_end_to_end=False):
+    work_dir = tempfile.mkdtemp(prefix="bench-html2pdf-")
+    try:
+        root = generate_tree(os.path.join(work_dir, "tree"), files, depth, size_kb=size_kb)
+        browser = write_stub_browser(work_dir, latency)
+        results = {
+            "params": {"files": files, "depth": depth, "latency": latency, "size_kb": size_kb,
+                       "jobs": list(jobs_levels)},
+            "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                            "cpu_count": os.cpu_count()},
+            "discovery": bench_discovery(root),
+            "scheduling": [bench_scheduling(root, files, j) for j in jobs_levels],
+            "end_to_end": [],
+        }
+        if not skip_end_to_end:
+            out_dir = os.path.join(work_dir, "out")
+            results["end_to_end"] = [bench_end_to_end(root, out_dir, browser, files, j) for j in jobs_levels]
+        return results
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="html2pdf 编排性能基准 (离线运行, 使用浏览器桩代替真实浏览器)",
+        epilog=USAGE_EXAMPLES,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--files", type=int, default=500, help="合成 HTML 文件数 (默认: 500)")
+    parser.add_argument("--depth", type=int, default=3, help="目录层数 (默认: 3)")
+    parser.add_argument("--size-kb", type=int, default=4, help="单个 HTML 大小 KB (默认: 4)")
+    parser.add_argument("--latency", type=float, default=0.02, help="浏览器桩每页延迟秒数 (默认: 0.02)")
+    parser.add_argument("--jobs", type=int, nargs="+", default=[1, 4, 16], help="测试的并发档位 (默认: 1 4 16)")
+    parser.add_argument("--skip-end-to-end", action="store_true", help="只测发现与调度，不启动浏览器桩")
+    parser.add_argument("-o", "--output", help="结果写入 JSON 文件")
+    parser.add_argument("--compare", help="与基线结果 JSON 对比")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="允许的吞吐量下降比例 (默认: 0.1)")
+    args = parser.parse_args()
+
+    if os.name != "posix" and not args.skip_end_to_end:
+        print("⚠️  浏览器桩依赖 shebang，非 POSIX 平台请加 --skip-end-to-end")
+        sys.exit(1)
+
+    results = run_benchmarks(args.files, args.depth, args.latency, args.jobs, args.size_kb, args.skip_end_to_end)
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+        print(f"📊 结果已写入 {args.output}")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        environment = differences(results, baseline, "environment")
+        if environment:
+            print(f"⚠️  [警告] 运行环境与基线不同 ({', '.join(environment)}), 对比结果仅供参考")
+        try:
+            regressions = compare(results, baseline, args.tolerance)
+        except ValueError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+        for r in regressions:
+            print(f"❌ [退化] {r['metric']}: {r['baseline']:.1f} -> {r['current']:.1f} ({r['ratio']:.0%})")
+        if regressions:
+            sys.exit(1)
+        print("✅ 未发现性能退化")
+
+if __name__ == "__main__":
+    main()
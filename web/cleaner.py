@@ -1,8 +1,23 @@
 import os
+import re
+import json
 import argparse
-import glob
+import functools
+import importlib.util
+import hashlib
+import codecs
+import itertools
+import mmap
+import tempfile
+import time
+import heapq
+from html.parser import HTMLParser
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from bs4 import BeautifulSoup
 
+from discovery import iter_files, SYMLINK_POLICIES
+
 # ================= 文档配置 =================
 # 将文档赋值给变量，确保一定能被 argparse 读取到
 USAGE_EXAMPLES = """
@@ -19,6 +34,41 @@ USAGE_EXAMPLES = """
 
   4. 复杂选择器：删除 '.content' 类下的所有 script 标签
      python cleaner.py -s ".content script"
+
+  5. 递归处理子目录 (跳过 node_modules)，输出保持原目录结构
+     python cleaner.py -i ./archive -o ./cleaned -r -x node_modules -s ".ad-banner"
+
+  6. 多进程并行 (解析是纯 Python 的 CPU 密集操作; -j 0 表示使用全部 CPU 核)。
+     默认只输出失败的文件与最终汇总, 加 -v 逐个文件输出处理结果:
+     python cleaner.py -i ./archive -o ./cleaned -r -s ".ad-banner" -j 8
+     python cleaner.py -i ./archive -o ./cleaned -r -s ".ad-banner" -j 8 -v
+
+  7. 一次处理多组选择器 (每个文件只读取、解析、写入一次，结束时按规则汇总命中数):
+     python cleaner.py -i ./archive -r -s ".ad-banner" -s "script"
+     python cleaner.py -i ./archive -r --rules rules.yaml
+     rules.yaml 内容示例 (JSON 同样结构):
+       ads: [".ad-banner", "#js_row_immersive_stream_wrap"]
+       share: ".share-bar"
+       comments: ["#comments", ".comment-widget"]
+
+  8. 超大文件 (导出的数百 MB 页面): 选择器只含标签、id、类、属性与后代/子代组合符时,
+     不小于 --stream-threshold (默认 64MB) 的文件自动改用流式引擎, 内存占用恒定, 未删除的部分按原文写出:
+     python cleaner.py -i ./exports -s "div.comment-list" --stream-threshold 16
+
+  9. 最小差异写回 (受 git 管理的 HTML): 只剪掉命中元素对应的原文，其余字节不变 (匹配按 html.parser 进行);
+     标签、id、类名、属性与后代/子代组合的选择器单遍扫描定位，不建树，比 rewrite 快; 其他选择器需先用 BeautifulSoup 匹配:
+     python cleaner.py -i ./site -r -s ".ad-banner" --write splice
+
+  10. 切换解析器: lxml 比默认的 html.parser 快数倍; direct 绕过 BeautifulSoup 直接用 lxml + cssselect, 最快
+     (未安装 lxml 时自动回退到 html.parser; 各解析器输出的差异见 cleaner.py 中 PARSERS 的说明):
+     python cleaner.py -i ./archive -r -s ".ad-banner" --parser direct
+
+  11. 增量缓存: 反复对同一目录运行时，大小、修改时间 (或内容哈希) 与规则都没变、且上次已确认无需处理的文件
+     只做一次 stat 就跳过; 修改过的文件或更换规则后自动重新处理:
+     python cleaner.py -i ./archive -o ./cleaned -r --rules rules.yaml --cache
+
+  12. 预演与统计: 不写入任何文件，先看会删除多少、时间花在哪个阶段 (读取/解码/解析/选择/序列化/写入) 以及最慢的文件:
+     python cleaner.py -i ./archive -r --rules rules.yaml --dry-run --stats stats.json --slowest 20
 """
 # ===========================================
 
@@ -39,8 +89,16 @@ def parse_args():
     parser.add_argument(
         '-s', '--selector', 
         type=str, 
-        required=True, 
-        help='要移除元素的 CSS 选择器 (必填，如: "#id", ".class")'
+        action='append',
+        default=[],
+        help='要移除元素的 CSS 选择器 (可重复指定，如: "#id", ".class")'
+    )
+
+    parser.add_argument(
+        '--rules',
+        type=str,
+        default=None,
+        help='规则文件 (.yaml/.yml/.json)，格式为 {规则名: 选择器或选择器列表}，可与 -s 同时使用'
     )
 
     parser.add_argument(
@@ -50,6 +108,88 @@ def parse_args():
         help='文件匹配模式 (默认: *.html)'
     )
     
+    parser.add_argument(
+        '-r', '--recursive',
+        action='store_true',
+        help='递归处理子目录'
+    )
+
+    parser.add_argument(
+        '-x', '--exclude',
+        action='append',
+        default=[],
+        help='排除匹配的文件或目录 (可重复指定)'
+    )
+
+    parser.add_argument(
+        '--symlinks',
+        choices=SYMLINK_POLICIES,
+        default='files',
+        help='符号链接策略: skip 忽略; files 仅跟随文件链接; all 同时跟随目录链接 (默认: files)'
+    )
+
+    parser.add_argument(
+        '--parser',
+        choices=PARSERS,
+        default='html.parser',
+        help='解析器: html.parser (默认, 纯 Python) / lxml / html5lib / direct (lxml + cssselect, 不经过 BeautifulSoup)'
+    )
+
+    parser.add_argument(
+        '--write',
+        choices=WRITE_MODES,
+        default='rewrite',
+        help='写回方式: rewrite 重新序列化整个文档 (默认); splice 只剪掉命中的元素，其余字节原样保留 (diff 最小; '
+             '简单选择器单遍扫描定位，不建树)'
+    )
+
+    parser.add_argument(
+        '--stream-threshold',
+        type=float,
+        default=STREAM_THRESHOLD / 1024 / 1024,
+        metavar='MB',
+        help='不小于该大小 (MB) 的文件在选择器允许时使用恒定内存的流式引擎 (默认: 64; 0 表示关闭)'
+    )
+
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=1,
+        help='并行进程数 (默认: 1 即单进程; 0 表示 CPU 核数)'
+    )
+
+    parser.add_argument(
+        '--cache',
+        action='store_true',
+        help=f'启用增量缓存 ({CACHE_NAME}，位于输出目录或原地模式的输入目录): 未变化且已知无需处理的文件直接跳过'
+    )
+
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='预演: 照常解析并统计会删除的元素，但不写入任何文件 (也不更新缓存)'
+    )
+
+    parser.add_argument(
+        '--stats',
+        metavar='FILE',
+        help='把逐文件与汇总统计写入 JSON: 各阶段耗时、输入/输出字节数、各规则命中数与最慢的文件'
+    )
+
+    parser.add_argument(
+        '--slowest',
+        type=int,
+        default=SLOWEST,
+        metavar='N',
+        help=f'--stats 汇总中列出的最慢文件数 (默认: {SLOWEST})'
+    )
+
+    parser.add_argument(
+        '-v', '--verbose',
+        action='store_true',
+        help='逐个文件输出处理结果 (默认只输出失败的文件与最终汇总)'
+    )
+
     parser.add_argument(
         '-i', '--input', 
         type=str, 
@@ -64,93 +204,1248 @@ def parse_args():
         help='输出文件夹路径 (默认: 不指定则覆盖原文件)'
     )
     
-    return parser.parse_args()
+    args = parser.parse_args()
+    if not args.selector and not args.rules:
+        parser.error("至少需要指定一个 -s/--selector 或 --rules")
+    return args
 
-def process_file(file_path, output_dir, selector):
-    # ... (处理逻辑与之前相同，无需变动) ...
-    # 1. 读取文件
-    content = None
-    encoding_used = 'utf-8'
-    
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-    except UnicodeDecodeError:
+# ===========================
+# 解析器
+# ===========================
+# 删除的元素在各解析器下相同，差异只在未改动部分的序列化方式 (仅写回命中选择器的文件):
+#   html.parser : 不补全 <html>/<head>/<body>，片段仍写回为片段；<br> 写成 <br/>
+#   lxml        : 片段补全为 <html><body>…</body></html>；<br> 写成 <br/>
+#   html5lib    : 按浏览器标准补全，额外插入空 <head> 与表格的 <tbody>；最慢
+#   direct      : 与 lxml 相同的解析结果，但以 HTML 方式序列化 (<br>、<img ...> 不带斜杠)；
+#                 片段只输出 body 内的内容，没有 DOCTYPE 的文档不会补上 DOCTYPE
+# 解析失败或选择器语法 cssselect 不支持时，direct 自动改用 BeautifulSoup 处理该文件。
+
+PARSERS = ("html.parser", "lxml", "html5lib", "direct")
+
+def resolve_parser(name):
+    """检查解析器依赖，缺失时回退: direct / lxml 需要 lxml (direct 还需要 cssselect)，html5lib 需要 html5lib"""
+    def installed(*modules):
+        return all(importlib.util.find_spec(m) is not None for m in modules)
+
+    if name == "direct" and not installed("lxml", "cssselect"):
+        name = "lxml"
+    if name == "lxml" and not installed("lxml"):
+        name = "html.parser"
+    if name == "html5lib" and not installed("html5lib"):
+        name = "html.parser"
+    return name
+
+# 文档开头的 DOCTYPE 与注释 (可有空白间隔)
+DOCUMENT_PROLOG = re.compile(r"(?:\s*(?:<!--.*?-->|<!doctype[^>]*>))*", re.I | re.S)
+
+def _clean_direct(content, compiled, timings=None):
+    """lxml + cssselect 直接处理，省去 BeautifulSoup 的树构建与序列化开销"""
+    import lxml.html
+
+    # 先编码为 UTF-8 再解析: lxml 不接受带编码声明的 str，且文件编码已在读取时处理过
+    started = time.perf_counter()
+    doc = lxml.html.document_fromstring(content.encode("utf-8"), parser=lxml.html.HTMLParser(encoding="utf-8"))
+    started = lap(timings, "parse", started)
+    counts = {}
+    for name, matcher in compiled:
+        targets = matcher(doc)
+        for el in targets:
+            el.drop_tree()  # 与 decompose 一致: 删除元素本身，保留其后的文本
+        counts[name] = counts.get(name, 0) + len(targets)
+    started = lap(timings, "select", started)
+    if not any(counts.values()):
+        return content, counts
+
+    if re.search(r"<html[\s>]", content, re.I):
+        root = doc.getroottree() if re.search(r"<!doctype", content, re.I) else doc
+        cleaned = lxml.html.tostring(root, encoding="unicode")
+    else:
+        # 片段: 只输出解析器补全的 head/body 中的内容；开头的 DOCTYPE 与注释在树外，按原文保留 (否则页面进入怪异模式)
+        parts = [DOCUMENT_PROLOG.match(content).group()]
+        for container in doc:
+            parts.append(container.text or "")
+            parts.extend(lxml.html.tostring(child, encoding="unicode") for child in container)
+        cleaned = "".join(parts)
+    lap(timings, "serialize", started)
+    return cleaned, counts
+
+# ===========================
+# 清理规则
+# ===========================
+# 规则为 (名称, 选择器) 序列；-s 指定的选择器以自身命名，规则文件中的一组选择器合并为一个选择器组。
+
+def as_rules(selectors):
+    """
+    规范化为 ((名称, 选择器), ...) 元组；接受单个选择器字符串、选择器列表、(名称, 选择器) 列表，
+    或 {规则名: 选择器或选择器列表} (同一规则的多个选择器合并为一个选择器组)
+    """
+    if isinstance(selectors, str):
+        return ((selectors, selectors),)
+    if isinstance(selectors, dict):
+        rules = []
+        for name, group in selectors.items():
+            if isinstance(group, str):
+                group = [group]
+            if not group or not all(isinstance(sel, str) for sel in group):
+                raise ValueError(f"规则 {name} 的选择器应为字符串或字符串列表")
+            rules.append((str(name), ", ".join(group)))
+        return tuple(rules)
+    return tuple((s, s) if isinstance(s, str) else tuple(s) for s in selectors)
+
+def load_rules(path):
+    """读取规则文件 {规则名: 选择器或选择器列表}；YAML 需要安装 PyYAML"""
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    if path.lower().endswith(('.yaml', '.yml')):
         try:
-            encoding_used = 'gbk'
-            with open(file_path, 'r', encoding='gbk') as f:
-                content = f.read()
-        except Exception as e:
-            print(f"[读取失败] {os.path.basename(file_path)}: {e}")
+            import yaml
+        except ImportError:
+            raise ValueError("读取 YAML 规则文件需要 PyYAML (pip install pyyaml)，或改用 JSON 格式")
+        data = yaml.safe_load(text)
+    else:
+        data = json.loads(text)
+
+    if not isinstance(data, dict) or not data:
+        raise ValueError("规则文件应为非空的 {规则名: 选择器或选择器列表}")
+    return as_rules(data)
+
+@functools.lru_cache(maxsize=16)
+def compile_rules(rules, parser):
+    """编译规则 (每个进程同一组规则只编译一次)；direct 引擎有选择器无法编译时返回 None，改用 BeautifulSoup"""
+    if parser == "direct":
+        try:
+            from lxml.cssselect import CSSSelector
+            return tuple((name, CSSSelector(sel, translator="html")) for name, sel in rules)
+        except Exception:
+            # cssselect 不支持的选择器 (如 :-soup-contains) 或未安装 lxml
+            return None
+    import soupsieve
+    return tuple((name, soupsieve.compile(sel).select) for name, sel in rules)
+
+def apply_rules(content, rules, parser="html.parser", timings=None):
+    """
+    只解析一次，依次应用全部规则；返回 (清理后的 HTML, {规则名: 移除数量})，全部未命中时原样返回内容。
+    传入 timings 字典时累加 parse / select / serialize 各阶段耗时 (秒)。
+    """
+    rules = as_rules(rules)
+    if parser == "direct":
+        compiled = compile_rules(rules, parser)
+        if compiled is not None:
+            try:
+                return _clean_direct(content, compiled, timings)
+            except Exception:
+                pass  # 空文档等 lxml 无法处理的情况交给 BeautifulSoup
+        parser = "lxml"
+
+    started = time.perf_counter()
+    soup = BeautifulSoup(content, parser)
+    started = lap(timings, "parse", started)
+    counts = {}
+    for name, select in compile_rules(rules, parser):
+        targets = select(soup)
+        for el in targets:
+            el.decompose()
+        counts[name] = counts.get(name, 0) + len(targets)
+    started = lap(timings, "select", started)
+    if not any(counts.values()):
+        return content, counts
+    # 保留原有的 <meta charset> 声明 (str(soup) 会改写为 utf-8，而文件按原编码写回)
+    cleaned = soup.decode(eventual_encoding=None)
+    lap(timings, "serialize", started)
+    return cleaned, counts
+
+# ===========================
+# 字节级预筛选
+# ===========================
+# 任何匹配都必须在文档中出现选择器里的标签名、id、类名与属性名。解析前先在原始字节中查找这些字面量，
+# 一个都凑不齐的文件不可能命中，直接跳过解码与解析。无法安全化简的选择器 (转义、命名空间、非 ASCII、
+# 只有 * 或伪类等) 一律退回完整解析。
+
+# 解析器会自动补全的元素，源码中不一定出现，不能作为必需标签
+IMPLIED_TAGS = {"html", "head", "body", "tbody", "tr", "colgroup"}
+MMAP_THRESHOLD = 1024 * 1024  # 超过该大小的文件用 mmap 扫描，不整体读入内存
+
+_IDENT = re.compile(r"-?[A-Za-z_][A-Za-z0-9_-]*")
+
+def _split_top_level(selector, sep):
+    """按顶层的 sep 切分，跳过括号、方括号与引号内部"""
+    parts, depth, quote, start = [], 0, None, 0
+    for i, ch in enumerate(selector):
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch == sep and depth == 0:
+            parts.append(selector[start:i])
+            start = i + 1
+        elif ch in "\"'":
+            quote = ch
+        elif ch in "([":
+            depth += 1
+        elif ch in ")]":
+            depth -= 1
+    parts.append(selector[start:])
+    return parts
+
+def required_tokens(selector):
+    """
+    提取选择器组中每个选择器必需的字面量，返回 [{(种类, 名称), ...}, ...] (每个选择器一组)。
+    种类为 tag / id / class / attr；无法安全化简时返回 None。
+    """
+    if "\\" in selector or "|" in selector.replace("|=", "") or not selector.isascii():
+        return None
+
+    alternatives = []
+    for part in _split_top_level(selector, ","):
+        tokens, i, part = set(), 0, part.strip()
+        at_compound_start = True
+        while i < len(part):
+            ch = part[i]
+            if ch in " \t\n>+~":
+                at_compound_start = True
+                i += 1
+                continue
+            if ch in "#.":
+                m = _IDENT.match(part, i + 1)
+                if not m:
+                    return None
+                tokens.add(("id" if ch == "#" else "class", m.group().lower()))
+                i = m.end()
+            elif ch == "[":
+                m = _IDENT.match(part, i + 1)
+                if not m:
+                    return None
+                tokens.add(("attr", m.group().lower()))
+                # 属性值可能含有实体或引号，只要求属性名
+                i = i + 1 + len(_split_top_level(part[i + 1:], "]")[0]) + 1
+            elif ch == ":":
+                # 伪类只会缩小匹配范围，忽略它 (连同括号中的参数) 不影响必需字面量
+                m = _IDENT.match(part, i + (2 if part.startswith("::", i) else 1))
+                if not m:
+                    return None
+                i = m.end()
+                if i < len(part) and part[i] == "(":
+                    i += len(_split_top_level(part[i + 1:], ")")[0]) + 2
+            elif ch == "*" and at_compound_start:
+                i += 1
+            elif at_compound_start and _IDENT.match(part, i):
+                m = _IDENT.match(part, i)
+                if m.group().lower() not in IMPLIED_TAGS:
+                    tokens.add(("tag", m.group().lower()))
+                i = m.end()
+            else:
+                return None
+            at_compound_start = False
+        if not tokens:
+            return None
+        alternatives.append(tokens)
+    return alternatives
+
+# html5lib 会把这些源码标签改写成另一个元素
+TAG_ALIASES = {"img": "img|image"}
+
+def _token_pattern(kind, name):
+    if kind == "tag":
+        # 多余的结束标签 (如 </p>) 也会让解析器生成元素
+        return re.compile(rb"</?(?:" + TAG_ALIASES.get(name, name).encode() + rb")[\s/>]", re.I)
+    return re.compile(re.escape(name.encode()), re.I)
+
+@functools.lru_cache(maxsize=16)
+def compile_prefilter(rules):
+    """为一组规则生成预筛选条件 [[(名称, 正则), ...], ...]；任一规则无法化简时返回 None"""
+    alternatives = []
+    for _, selector in rules:
+        tokens = required_tokens(selector)
+        if tokens is None:
+            return None
+        alternatives.extend([(name, _token_pattern(kind, name)) for kind, name in sorted(alt)] for alt in tokens)
+    return alternatives
+
+def _may_match(data, alternatives):
+    if data[:4].startswith(WIDE_BOMS):
+        # UTF-16/32 文档中的 ASCII 字面量夹着 NUL 字节，按字节查找不到，只能完整解析
+        return True
+    found = {}
+
+    def present(name, pattern):
+        if pattern not in found:
+            hit = pattern.search(data) is not None
+            if not hit:
+                # 字面量被写成字符引用 (&#...; 或下划线的 &lowbar;) 时字节中看不到，保守地视为存在
+                hit = data.find(b"&#") >= 0 or ("_" in name and re.search(rb"&(lowbar|underbar);", data, re.I))
+            found[pattern] = bool(hit)
+        return found[pattern]
+
+    return any(all(present(name, pattern) for name, pattern in alt) for alt in alternatives)
+
+def may_contain(file_path, rules, data=None):
+    """
+    按原始字节判断文件是否可能命中规则；False 表示一定不会命中，True 表示需要完整解析。
+    已读入内存的字节可通过 data 传入，避免重复读取。
+    """
+    alternatives = compile_prefilter(as_rules(rules))
+    if alternatives is None:
+        return True
+    if data is not None:
+        return _may_match(data, alternatives)
+    with open(file_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < MMAP_THRESHOLD:
+            return _may_match(f.read(), alternatives)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return _may_match(data, alternatives)
+
+# ===========================
+# 流式清理 (超大文件)
+# ===========================
+# 只支持边读边能判定的选择器子集: 标签、id、类、属性、后代 (空格) 与子代 (>) 组合符。
+# 元素栈的维护方式与 BeautifulSoup 的 html.parser 树构建器一致 (结束标签关闭最近的同名元素，
+# 没有对应开始标签的结束标签被忽略)，因此命中结果与默认解析器相同；命中的子树边读边丢弃，
+# 其余内容按原文逐字写出，内存占用只与嵌套深度和单个标签的长度有关。
+
+STREAM_THRESHOLD = 64 * 1024 * 1024  # 超过该大小且选择器可流式处理的文件自动走流式引擎
+STREAM_CHUNK = 64 * 1024
+
+# 与 BeautifulSoup 一致的空元素 (没有结束标签，不入栈)
+VOID_TAGS = {"area", "base", "basefont", "bgsound", "br", "col", "command", "embed", "frame", "hr", "image", "img",
+             "input", "isindex", "keygen", "link", "menuitem", "meta", "nextid", "param", "source", "spacer",
+             "track", "wbr"}
+
+_STREAM_TOKEN = re.compile(r"""
+    (?P<ws>\s+) | (?P<child>>) | (?P<star>\*) |
+    (?P<id>\#-?[A-Za-z_][A-Za-z0-9_-]*) | (?P<cls>\.-?[A-Za-z_][A-Za-z0-9_-]*) | (?P<tag>-?[A-Za-z_][A-Za-z0-9_-]*) |
+    (?P<attr>\[\s*(?P<name>-?[A-Za-z_][A-Za-z0-9_:-]*)\s*
+        (?:(?P<op>[~^$*|!]?=)\s*(?P<value>"[^"\\]*"|'[^'\\]*'|-?[A-Za-z_][A-Za-z0-9_-]*)\s*(?P<flag>[isIS])?\s*)?\])
+""", re.X)
+
+def _attr_matcher(m):
+    """属性条件 -> 判定函数；规则与 soupsieve 相同 (type 属性与 i 标志不区分大小写)"""
+    name = m.group("name").lower()
+    op = m.group("op")
+    if not op:
+        return lambda attrs: name in attrs
+    value = m.group("value")
+    if value[0] in "\"'":
+        value = value[1:-1]
+    flag = (m.group("flag") or "").lower()
+    flags = re.DOTALL | (re.I if flag == "i" or (not flag and name == "type") else 0)
+    escaped = re.escape(value)
+    pattern = {
+        "=": rf"^{escaped}$",
+        "!=": rf"^{escaped}$",
+        "^=": rf"^{escaped}.*",
+        "$=": rf".*?{escaped}$",
+        "*=": rf".*?{escaped}.*",
+        "~=": rf".*?(?:(?<=^)|(?<=[ \t\r\n\f])){escaped}(?=(?:[ \t\r\n\f]|$)).*",
+        "|=": rf"^{escaped}(?:-.*)?$",
+    }[op]
+    if op == "~=" and (not value or any(c.isspace() for c in value)):
+        return lambda attrs: False
+    regex = re.compile(pattern, flags)
+    if op == "!=":
+        return lambda attrs: not regex.match(attrs.get(name, ""))
+    return lambda attrs: name in attrs and regex.match(attrs[name]) is not None
+
+def _parse_stream_selector(selector):
+    """解析为选择器链 [(组合符, 标签, ids, 类名, 属性判定), ...] 的列表；超出子集时返回 None"""
+    chains = []
+    for part in _split_top_level(selector, ","):
+        chain, compound, combinator = [], None, None
+        pos, part = 0, part.strip()
+        while pos < len(part):
+            m = _STREAM_TOKEN.match(part, pos)
+            if not m:
+                return None
+            pos = m.end()
+            kind = next(k for k in ("ws", "child", "star", "id", "cls", "tag", "attr") if m.group(k))
+            if kind in ("ws", "child"):
+                if compound is not None:
+                    chain.append(tuple(compound))
+                    compound, combinator = None, " "
+                if kind == "child":
+                    if not chain or combinator == ">":
+                        return None
+                    combinator = ">"
+                continue
+            if compound is None:
+                compound, combinator = [combinator, None, [], [], []], None
+            elif kind in ("tag", "star"):
+                return None  # 标签只能出现在复合选择器开头
+            if kind in ("tag", "star"):
+                compound[1] = m.group().lower()
+            elif kind == "id":
+                compound[2].append(m.group()[1:])
+            elif kind == "cls":
+                compound[3].append(m.group()[1:])
+            else:
+                compound[4].append(_attr_matcher(m))
+        if compound is None:
+            return None
+        chain.append(tuple(compound))
+        chains.append(chain)
+    return chains
+
+@functools.lru_cache(maxsize=16)
+def compile_stream_rules(rules):
+    """把一组规则编译为流式判定条件；任一规则超出支持的子集时返回 None"""
+    compiled = []
+    for _, selector in rules:
+        chains = _parse_stream_selector(selector)
+        if chains is None:
+            return None
+        compiled.append(chains)
+    return tuple(compiled)
+
+def _compound_matches(compound, element):
+    _, tag, ids, classes, attr_tests = compound
+    el_tag, attrs, el_classes = element[0], element[1], element[2]
+    if tag not in (None, "*") and tag != el_tag:
+        return False
+    if ids and any(attrs.get("id") != i for i in ids):
+        return False
+    if classes and not all(c in el_classes for c in classes):
+        return False
+    return all(test(attrs) for test in attr_tests)
+
+def _chain_matches(chain, idx, stack, pos):
+    if not _compound_matches(chain[idx], stack[pos]):
+        return False
+    if idx == 0:
+        return True
+    if chain[idx][0] == ">":
+        return pos > 0 and _chain_matches(chain, idx - 1, stack, pos - 1)
+    return any(_chain_matches(chain, idx - 1, stack, k) for k in range(pos - 1, -1, -1))
+
+class StreamCleaner(HTMLParser):
+    """
+    增量解析 HTML，按原文写出未命中的部分。
+    用 getpos() 得到每个关键标记在原文中的位置，输出缓冲区只保留尚未确定去留的一小段文本。
+    传入 hits ({元素序号: 规则序号}) 时不再自行匹配，直接按序号删除 (元素按开始标签出现的顺序编号)。
+    传入 drop(起, 止) 时把每段被丢弃的原文区间 (绝对偏移) 通知调用方；write 可为 None，只定位不输出。
+    """
+
+    def __init__(self, rules, compiled, write, hits=None, drop=None):
+        super().__init__(convert_charrefs=True)
+        self.names = [name for name, _ in rules]
+        self.compiled = compiled
+        self.write = write
+        self.hits = hits
+        self.drop = drop
+        self.elements = 0        # 已出现的元素数，与 BeautifulSoup (html.parser) 创建元素的顺序一致
+        self.counts = dict.fromkeys(self.names, 0)
+        self.stack = []          # (标签, 属性, 类名集合, 删除该元素的规则序号)
+        self.drop_depth = None   # 正在丢弃的子树根在栈中的位置
+        self.buf = ""            # 原文中 [buf_start, 已读位置) 的文本
+        self.buf_start = 0
+        self.line = 1            # 已定位的行号及其行首在原文中的偏移
+        self.line_start = 0
+
+    # ---------- 位置换算与输出 ----------
+
+    def _offset(self, pos):
+        """把 HTMLParser 的 (行, 列) 换算为原文中的绝对偏移"""
+        line, col = pos
+        while self.line < line:
+            i = self.buf.index("\n", max(self.line_start - self.buf_start, 0))
+            self.line_start = self.buf_start + i + 1
+            self.line += 1
+        return self.line_start + col
+
+    def _advance(self, offset, keep):
+        """原文推进到 offset，其间的文本按 keep 写出或丢弃"""
+        cut = offset - self.buf_start
+        if cut > 0:
+            if keep and self.write:
+                self.write(self.buf[:cut])
+            elif not keep and self.drop:
+                self.drop(self.buf_start, offset)
+        self.buf = self.buf[cut:]
+        self.buf_start = offset
+
+    def feed(self, data):
+        self.buf += data
+        super().feed(data)
+        # 已被解析器消费的部分可以确定去留，立即写出，保持缓冲区很小
+        self._advance(self._offset(self.getpos()), self.drop_depth is None)
+
+    def close(self):
+        super().close()
+        self._advance(self.buf_start + len(self.buf), self.drop_depth is None)
+
+    # ---------- 元素栈与匹配 ----------
+
+    def _match(self, tag, attrs):
+        attrs = {k: v if v is not None else "" for k, v in attrs}
+        classes = set(attrs.get("class", "").split())
+        if "class" in attrs:
+            attrs["class"] = " ".join(attrs["class"].split())
+        inherited = self.stack[-1][3] if self.stack else None
+        element = (tag, attrs, classes, inherited)
+        if self.hits is not None:
+            hit = self.hits.get(self.elements)
+        else:
+            self.stack.append(element)
+            try:
+                hit = next((k for k, chains in enumerate(self.compiled)
+                            if any(_chain_matches(chain, len(chain) - 1, self.stack, len(self.stack) - 1)
+                                   for chain in chains)), None)
+            finally:
+                self.stack.pop()
+        self.elements += 1
+        # 与 apply_rules 的计数一致: 规则依次执行，元素只计入第一条命中的规则，
+        # 被更早的规则删掉的子树对后续规则不可见
+        if hit is not None and (inherited is None or hit <= inherited):
+            self.counts[self.names[hit]] += 1
+            return (tag, attrs, classes, hit if inherited is None else min(hit, inherited))
+        return element
+
+    def handle_starttag(self, tag, attrs):
+        element = self._match(tag, attrs)
+        start = self._offset(self.getpos())
+        if self.drop_depth is None and element[3] is not None:
+            self._advance(start, True)
+            if tag in VOID_TAGS:
+                self._advance(start + len(self.get_starttag_text()), False)
+                return
+            self.drop_depth = len(self.stack)
+        if tag not in VOID_TAGS:
+            self.stack.append(element)
+
+    def handle_startendtag(self, tag, attrs):
+        element = self._match(tag, attrs)
+        if self.drop_depth is None and element[3] is not None:
+            start = self._offset(self.getpos())
+            self._advance(start, True)
+            self._advance(start + len(self.get_starttag_text()), False)
+
+    def handle_endtag(self, tag):
+        index = next((i for i in range(len(self.stack) - 1, -1, -1) if self.stack[i][0] == tag), None)
+        if index is None:
             return
+        del self.stack[index:]
+        if self.drop_depth is not None and index <= self.drop_depth:
+            start = self._offset(self.getpos())
+            if index == self.drop_depth:
+                # 结束标签属于被删除的元素，一并丢弃
+                end = self.buf.index(">", start - self.buf_start) + 1 + self.buf_start
+            else:
+                # 被删除的元素由上级元素的结束标签隐式关闭，该结束标签保留
+                end = start
+            self._advance(end, False)
+            self.drop_depth = None
 
-    # 2. 解析与处理
-    soup = BeautifulSoup(content, 'html.parser')
-    target_elements = soup.select(selector)
+# 每个非 ASCII 字符的所有字节都不小于 0x80 的编码: 按 latin-1 看待原始字节时，
+# 标记字符 (< > " = 空白等) 的位置与含义不变，字符偏移就是字节偏移。GBK、Big5 等双字节编码的尾字节可能落在 ASCII 区间，不在此列
+BYTE_TRANSPARENT_ENCODINGS = ("utf-8", "utf-8-sig", "ascii", "cp1252", "euc_jp", "euc_kr", "gb2312")
+
+def _byte_transparent(encoding):
+    name = codecs.lookup(encoding).name
+    return name in BYTE_TRANSPARENT_ENCODINGS or name.startswith(("iso8859", "latin"))
 
-    if target_elements:
-        count = len(target_elements)
-        for el in target_elements:
+def _soup_hits(content, rules, timings=None):
+    """任意选择器: 用 BeautifulSoup (html.parser) 匹配，返回 ({元素序号: 规则序号}, 计数, 元素总数)"""
+    started = time.perf_counter()
+    soup = BeautifulSoup(content, 'html.parser')
+    started = lap(timings, "parse", started)
+    order = {id(tag): i for i, tag in enumerate(soup.find_all(True))}
+    hits, counts = {}, {}
+    for k, (name, select) in enumerate(compile_rules(rules, 'html.parser')):
+        targets = select(soup)
+        for el in targets:
+            hits.setdefault(order[id(el)], k)
+        for el in targets:
             el.decompose()
-            
-        # 3. 确定保存路径
-        if output_dir:
-            file_name = os.path.basename(file_path)
-            save_path = os.path.join(output_dir, file_name)
-            action_type = "另存"
+        counts[name] = counts.get(name, 0) + len(targets)
+    lap(timings, "select", started)
+    return hits, counts, len(order)
+
+def splice_ranges(content, rules, timings=None):
+    """
+    定位要删除的原文区间，返回 ([(起, 止), ...], {规则名: 移除数量})；编号对不上时区间为 None。
+    流式子集内的选择器在一遍 HTMLParser 扫描中边匹配边定位，不建树；其他选择器先用 BeautifulSoup 匹配，再扫描一遍定位。
+    """
+    compiled = compile_stream_rules(rules)
+    hits = total = None
+    if compiled is None:
+        hits, counts, total = _soup_hits(content, rules, timings)
+        if not hits:
+            return [], counts
+    started = time.perf_counter()
+    ranges = []
+
+    def drop(begin, end):
+        if ranges and ranges[-1][1] == begin:
+            ranges[-1] = (ranges[-1][0], end)
+        else:
+            ranges.append((begin, end))
+
+    scanner = StreamCleaner(rules, compiled, None, hits, drop)
+    scanner.feed(content)
+    scanner.close()
+    lap(timings, "parse", started)
+    if hits is None:
+        return ranges, scanner.counts
+    return (ranges if scanner.elements == total else None), counts
+
+def _cut(data, ranges):
+    pieces, position = [], 0
+    for begin, end in ranges:
+        pieces.append(data[position:begin])
+        position = end
+    pieces.append(data[position:])
+    return data[:0].join(pieces)
+
+def splice_html(content, rules, timings=None, raw=None, encoding=None):
+    """
+    最小差异删除: 只把命中元素的原文剪掉，其余字符原样保留 (不会像 str(soup) 那样统一引号、补全结束标签)。
+    传入 raw (content 按 encoding 编码前的原始字节) 时直接在原始字节上剪切并返回字节；
+    UTF-8 等编码下直接扫描原始字节 (按 latin-1 看待)，不用 content。返回 (新内容, {规则名: 移除数量})。
+    """
+    rules = as_rules(rules)
+    byte_view = (raw is not None and _byte_transparent(encoding)
+                 and all(selector.isascii() for _, selector in rules))
+    ranges, counts = splice_ranges(raw.decode("latin-1") if byte_view else content, rules, timings)
+    if ranges is None:
+        # 元素编号对不上 (理论上不会发生)，退回完整序列化，保证删除结果正确
+        cleaned, counts = apply_rules(content, rules, 'html.parser', timings)
+        return (cleaned if raw is None else cleaned.encode(encoding, errors="xmlcharrefreplace")), counts
+    if not ranges:
+        return (content if raw is None else raw), counts
+
+    started = time.perf_counter()
+    if raw is None:
+        output = _cut(content, ranges)
+    elif byte_view:
+        output = _cut(raw, ranges)
+    else:
+        # 字符偏移换算为字节偏移: 逐段累加编码后的长度 (增量编码器只在开头输出一次 BOM)
+        encoder = codecs.getincrementalencoder(encoding)()
+        byte_ranges, char_pos, byte_pos = [], 0, 0
+        for begin, end in ranges:
+            byte_pos += len(encoder.encode(content[char_pos:begin]))
+            byte_end = byte_pos + len(encoder.encode(content[begin:end]))
+            byte_ranges.append((byte_pos, byte_end))
+            char_pos, byte_pos = end, byte_end
+        byte_pos += len(encoder.encode(content[char_pos:], final=True))
+        if byte_pos == len(raw):
+            output = _cut(raw, byte_ranges)
         else:
-            save_path = file_path
-            action_type = "覆盖"
+            # 原始字节与重新编码的结果不一致 (如有状态的编码)，按文本剪切后再编码
+            output = _cut(content, ranges).encode(encoding, errors="xmlcharrefreplace")
+    lap(timings, "serialize", started)
+    return output, counts
 
-        # 4. 写入文件
+def stream_clean_file(file_path, save_path, rules, dry_run=False):
+    """
+    流式清理单个文件: 分块读取、边解析边写出到临时文件，有命中时替换 save_path (dry_run 时丢弃输出)。
+    返回 (编码, {规则名: 移除数量})；编码按文件开头的 BOM / <meta> 判断，没有声明时依次尝试 UTF-8、统计识别与 GBK。
+    """
+    rules = as_rules(rules)
+    compiled = compile_stream_rules(rules)
+    directory = os.path.dirname(os.path.abspath(save_path))
+    with open(file_path, 'rb') as f:
+        head = f.read(DETECT_SAMPLE)
+    declared, _ = declared_charset(head)
+    candidates = [declared] if declared else ["utf-8", _guess_charset(head), "gbk"]
+    candidates = list(dict.fromkeys(c for c in candidates + ["latin-1"] if c))
+    for encoding in candidates:
+        if dry_run:
+            fd, tmp_path = os.devnull, None
+        else:
+            fd, tmp_path = tempfile.mkstemp(prefix=".cleaner-", suffix=".html", dir=directory)
         try:
-            with open(save_path, 'w', encoding=encoding_used) as f:
-                f.write(str(soup))
-            print(f"[已{action_type}] 移除 {count} 处 -> {os.path.basename(save_path)}")
-        except Exception as e:
-            print(f"[写入失败] {save_path}: {e}")
+            decoder = codecs.getincrementaldecoder(encoding)()
+            with open(file_path, 'rb') as src, open(fd, 'w', encoding=encoding, newline='') as out:
+                cleaner = StreamCleaner(rules, compiled, out.write)
+                while True:
+                    chunk = src.read(STREAM_CHUNK)
+                    cleaner.feed(decoder.decode(chunk, final=not chunk))
+                    if not chunk:
+                        break
+                cleaner.close()
+        except UnicodeDecodeError:
+            if tmp_path:
+                os.remove(tmp_path)
+            continue
+        except BaseException:
+            if tmp_path:
+                os.remove(tmp_path)
+            raise
+        if tmp_path and any(cleaner.counts.values()):
+            os.replace(tmp_path, save_path)
+        elif tmp_path:
+            os.remove(tmp_path)
+        return encoding, cleaner.counts
+
+# ===========================
+# 文件处理
+# ===========================
+
+# ---------- 编码识别 ----------
+# 文件只读取一次: 依次根据 BOM、<meta charset>、<meta http-equiv="Content-Type"> 判断编码，
+# 都没有时先试 UTF-8，再用可选的 charset_normalizer / chardet 统计识别，最后按 GBK、latin-1 兜底。
+# 写回时使用同一编码，未改动的内容保持原来的字节。
+
+BOMS = ((codecs.BOM_UTF32_LE, "utf-32"), (codecs.BOM_UTF32_BE, "utf-32"), (codecs.BOM_UTF8, "utf-8-sig"),
+        (codecs.BOM_UTF16_LE, "utf-16"), (codecs.BOM_UTF16_BE, "utf-16"))
+WIDE_BOMS = tuple(bom for bom, encoding in BOMS if encoding.startswith(("utf-16", "utf-32")))
+PRESCAN_BYTES = 4096       # 只在文件开头查找 <meta> 声明
+DETECT_SAMPLE = 64 * 1024  # 统计识别的采样大小
+
+_META_CHARSET = re.compile(rb"""<meta\b[^>]*?charset\s*=\s*["']?\s*([A-Za-z0-9_:.+-]+)""", re.I)
+
+# 按 WHATWG 编码标准，把常见标签映射为实际使用的超集编码
+CHARSET_ALIASES = {
+    "gb2312": "gbk", "gb_2312-80": "gbk", "x-gbk": "gbk", "chinese": "gbk",
+    "iso-8859-1": "cp1252", "latin1": "cp1252", "ascii": "cp1252", "us-ascii": "cp1252",
+    "shift_jis": "cp932", "sjis": "cp932", "x-sjis": "cp932", "ms_kanji": "cp932",
+    "euc-kr": "cp949", "big5": "big5hkscs",
+}
+
+def _normalize_charset(label):
+    """规范化声明的编码名；不认识的编码返回 None。声明为 UTF-16 的 <meta> 按标准视为 UTF-8"""
+    label = label.decode("ascii", "ignore").strip().lower() if isinstance(label, bytes) else label.lower()
+    label = CHARSET_ALIASES.get(label, label)
+    try:
+        name = codecs.lookup(label).name
+    except LookupError:
+        return None
+    return "utf-8" if name.startswith("utf-16") else name
+
+def _guess_charset(raw):
+    """可选的统计识别: 优先 charset_normalizer，其次 chardet；都未安装或无法判断时返回 None"""
+    sample = raw[:DETECT_SAMPLE]
+    try:
+        from charset_normalizer import from_bytes
+    except ImportError:
+        pass
     else:
-        print(f"[跳过] 未匹配到选择器: {os.path.basename(file_path)}")
+        best = from_bytes(sample).best()
+        return _normalize_charset(best.encoding) if best else None
+    try:
+        import chardet
+    except ImportError:
+        return None
+    guess = chardet.detect(sample)
+    if guess.get("encoding") and (guess.get("confidence") or 0) >= 0.5:
+        return _normalize_charset(guess["encoding"])
+    return None
+
+def declared_charset(raw):
+    """从 BOM 或文件开头的 <meta> 声明得到编码；返回 (编码, 来源) 或 (None, None)"""
+    for bom, encoding in BOMS:
+        if raw.startswith(bom):
+            return encoding, "bom"
+    head = raw[:PRESCAN_BYTES]
+    for m in _META_CHARSET.finditer(head):
+        encoding = _normalize_charset(m.group(1))
+        if encoding:
+            source = "http-equiv" if b"http-equiv" in m.group(0).lower() else "meta"
+            return encoding, source
+    return None, None
+
+def decode_html(raw):
+    """只解码一次 (声明的编码解码失败时才尝试其他编码)；返回 (文本, 编码, 来源)"""
+    encoding, source = declared_charset(raw)
+    candidates = [(encoding, source)] if encoding else []
+    candidates += [("utf-8", "utf-8"), ("detector", "detector"), ("gbk", "fallback"), ("latin-1", "fallback")]
+
+    for encoding, source in candidates:
+        if source == "detector":
+            # 只有 UTF-8 解码失败时才值得做统计识别
+            encoding = _guess_charset(raw)
+            if not encoding:
+                continue
+        try:
+            return raw.decode(encoding), encoding, source
+        except (UnicodeDecodeError, LookupError):
+            continue
+
+def read_html(file_path):
+    """读取 HTML 文本 (只读一次，不转换换行符)；返回 (内容, 编码)"""
+    with open(file_path, 'rb') as f:
+        raw = f.read()
+    content, encoding, _ = decode_html(raw)
+    return content, encoding
+
+def clean_html(content, selector, parser="html.parser"):
+    """在内存中移除匹配选择器的元素；返回 (清理后的 HTML, 移除数量)，未匹配时原样返回内容"""
+    cleaned, counts = apply_rules(content, selector, parser)
+    return cleaned, sum(counts.values())
+
+WRITE_MODES = ("rewrite", "splice")
+
+def clean_file(file_path, output_dir, rules, parser="html.parser", stream_threshold=STREAM_THRESHOLD,
+               write_mode="rewrite", dry_run=False, stats=None):
+    """
+    处理单个文件 (不打印)；返回 (状态, 提示信息, {规则名: 移除数量})，状态为 cleaned / skipped / failed
+    文件不小于 stream_threshold 字节且选择器可流式处理时，改用恒定内存的流式引擎 (0 表示不使用)。
+    write_mode 为 rewrite 时重新序列化整个文档；splice 时只剪掉命中的元素，其余字节保持不变。
+    dry_run 时照常解析与序列化，但不写入任何文件。
+    传入 stats 字典时记录输入/输出字节数、编码与各阶段耗时 (read / prefilter / decode / parse / select / serialize / write)。
+    """
+    if stats is None:
+        stats = {}
+    timings = stats.setdefault("timings", {})
+
+    # 确定保存路径
+    if output_dir:
+        file_name = os.path.basename(file_path)
+        save_path = os.path.join(output_dir, file_name)
+        action_type = "另存"
+    else:
+        save_path = file_path
+        action_type = "覆盖"
+    done = "[预演]" if dry_run else f"[已{action_type}]"
+
+    # 1. 读取文件 (只读一次；字节中不可能命中的文件不解码、不解析)
+    try:
+        started = time.perf_counter()
+        stats["bytes_in"] = os.path.getsize(file_path)
+        streaming = (stream_threshold and stats["bytes_in"] >= stream_threshold
+                     and compile_stream_rules(as_rules(rules)) is not None)
+        raw = None
+        if not streaming:
+            with open(file_path, 'rb') as f:
+                raw = f.read()
+            started = lap(timings, "read", started)
+        matched = may_contain(file_path, rules, raw)
+        started = lap(timings, "prefilter", started)
+        if not matched:
+            return "skipped", f"[跳过] 未匹配到选择器: {os.path.basename(file_path)}", {}
+        if not streaming:
+            content, encoding_used, _ = decode_html(raw)
+            if write_mode != "splice":
+                del raw  # splice 直接在原始字节上剪切，需要保留
+            lap(timings, "decode", started)
+    except Exception as e:
+        return "failed", f"[读取失败] {os.path.basename(file_path)}: {e}", {}
+
+    if streaming:
+        # 流式引擎边读边解析边写出，各阶段无法分开计时
+        try:
+            encoding_used, counts = stream_clean_file(file_path, save_path, rules, dry_run)
+        except Exception as e:
+            return "failed", f"[流式处理失败] {os.path.basename(file_path)}: {e}", {}
+        finally:
+            lap(timings, "stream", started)
+        stats["encoding"] = encoding_used
+        count = sum(counts.values())
+        if not count:
+            return "skipped", f"[跳过] 未匹配到选择器: {os.path.basename(file_path)} ({encoding_used})", counts
+        if not dry_run:
+            stats["bytes_out"] = os.path.getsize(save_path)
+        return ("cleaned", f"{done} 移除 {count} 处 (流式) -> {os.path.basename(save_path)} ({encoding_used})",
+                counts)
+
+    # 2. 解析与处理
+    stats["encoding"] = encoding_used
+    try:
+        if write_mode == "splice":
+            cleaned, counts = splice_html(content, rules, timings, raw, encoding_used)
+            del raw
+        else:
+            cleaned, counts = apply_rules(content, rules, parser, timings)
+    except Exception as e:
+        # 单个文档解析或匹配出错只记为失败，不中断整批 (多进程时异常会经 result() 传回主进程)
+        return "failed", f"[解析失败] {os.path.basename(file_path)}: {e}", {}
+    count = sum(counts.values())
+    if not count:
+        return "skipped", f"[跳过] 未匹配到选择器: {os.path.basename(file_path)} ({encoding_used})", counts
+
+    # 3. 写入文件 (沿用原编码，不转换换行符)
+    try:
+        started = time.perf_counter()
+        # 解析器把 &nbsp; 等实体还原成了字符，原编码 (如 GBK) 无法表示时写成数字字符引用；splice 已是原始字节
+        data = cleaned if isinstance(cleaned, bytes) else cleaned.encode(encoding_used, errors="xmlcharrefreplace")
+        stats["bytes_out"] = len(data)
+        if not dry_run:
+            with open(save_path, 'wb') as f:
+                f.write(data)
+        lap(timings, "write", started)
+        return "cleaned", f"{done} 移除 {count} 处 -> {os.path.basename(save_path)} ({encoding_used})", counts
+    except Exception as e:
+        return "failed", f"[写入失败] {save_path}: {e}", {}
+
+def process_file(file_path, output_dir, selector, parser="html.parser"):
+    status, message, _ = clean_file(file_path, output_dir, selector, parser)
+    print(message)
+    return status
+
+# ===========================
+# 增量缓存
+# ===========================
+# 记录每个输入文件的大小、修改时间、内容哈希与规则集哈希以及处理结果。夜间重复运行时，
+# 已知对当前规则无需处理的文件只做一次 stat 就跳过；stat 变化但内容哈希相同 (如只被 touch) 时也不重新解析。
+
+CACHE_NAME = ".cleaner-cache.json"
+
+def rules_key(rules, parser, write_mode):
+    """规则集哈希: 规则、解析器或写回方式变化时缓存整体失效"""
+    payload = json.dumps({"rules": [list(r) for r in rules], "parser": parser, "write": write_mode})
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _cache_hit(entry, save_path, output_dir):
+    """记录的结果是否意味着本次无需处理"""
+    if entry["status"] == "skipped":
+        # 对当前规则没有任何命中
+        return True
+    # 另存模式: 输出文件仍是上次写出的那一份
+    output = entry.get("output")
+    if entry["status"] != "cleaned" or not output_dir or not output:
+        return False
+    try:
+        st = os.stat(save_path)
+    except OSError:
+        return False
+    return (st.st_size, st.st_mtime_ns) == (output["size"], output["mtime_ns"])
+
+def clean_cached(file_path, output_dir, rules, parser, stream_threshold, write_mode, entry, key,
+                 dry_run=False, stats=None):
+    """带缓存的 clean_file；返回 (状态, 提示信息, {规则名: 移除数量}, 新的缓存记录)，状态多了 cached"""
+    save_path = os.path.join(output_dir, os.path.basename(file_path)) if output_dir else file_path
+    try:
+        st = os.stat(file_path)
+        if stats is not None:
+            stats["bytes_in"] = st.st_size
+        if entry and entry.get("rules") == key and entry.get("size") == st.st_size:
+            if entry.get("mtime_ns") == st.st_mtime_ns and _cache_hit(entry, save_path, output_dir):
+                return "cached", f"[跳过] 已缓存: {os.path.basename(file_path)}", {}, entry
+            if entry.get("mtime_ns") != st.st_mtime_ns and _hash_file(file_path) == entry.get("sha256") \
+                    and _cache_hit(entry, save_path, output_dir):
+                return "cached", f"[跳过] 已缓存: {os.path.basename(file_path)}", {}, dict(entry, mtime_ns=st.st_mtime_ns)
+    except OSError:
+        pass
+
+    status, message, counts = clean_file(file_path, output_dir, rules, parser, stream_threshold, write_mode,
+                                         dry_run, stats)
+    if status == "failed" or dry_run:
+        return status, message, counts, None
+    try:
+        # 原地覆盖时记录写回后的文件
+        st = os.stat(file_path)
+        new_entry = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": _hash_file(file_path),
+                     "rules": key, "status": status}
+        if status == "cleaned" and output_dir:
+            out = os.stat(save_path)
+            new_entry["output"] = {"size": out.st_size, "mtime_ns": out.st_mtime_ns}
+    except OSError:
+        new_entry = None
+    return status, message, counts, new_entry
+
+class CleanCache:
+    """缓存文件 (JSON)，放在输出目录；原地覆盖时放在输入目录"""
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        self.path = os.path.join(self.directory, CACHE_NAME)
+        self.entries = {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self.entries = json.load(f).get("entries", {})
+        except (OSError, ValueError):
+            pass
+
+    def _key(self, file_path):
+        return os.path.relpath(os.path.abspath(file_path), self.directory).replace("\\", "/")
+
+    def get(self, file_path):
+        return self.entries.get(self._key(file_path))
+
+    def put(self, file_path, entry):
+        key = self._key(file_path)
+        if entry is None:
+            self.entries.pop(key, None)
+        else:
+            self.entries[key] = entry
+
+    def save(self):
+        """写回缓存，顺带清除源文件已不存在的记录"""
+        self.entries = {k: v for k, v in self.entries.items() if os.path.exists(os.path.join(self.directory, k))}
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "entries": self.entries}, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+# ===========================
+# 运行统计
+# ===========================
+# 每个文件一条记录 {file, status, bytes_in, bytes_out, encoding, removed, timings, total}，
+# 汇总后与逐文件记录一起写出 (--stats)，用于判断时间花在读取、解码、解析、选择、序列化还是写入上。
+
+STAGES = ("read", "prefilter", "decode", "parse", "select", "serialize", "write", "stream")
+SLOWEST = 10  # 汇总中列出的最慢文件数
+
+def lap(timings, stage, started):
+    """把 started 至今的耗时累加到 timings[stage]，返回当前时刻 (timings 为 None 时只返回时刻)"""
+    now = time.perf_counter()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0) + now - started
+    return now
+
+def summarize_stats(records, wall_time, rules=(), top=SLOWEST):
+    """汇总状态计数、字节数、吞吐量、各阶段总耗时、各规则命中与最慢的 top 个文件"""
+    statuses, stages = {}, dict.fromkeys(STAGES, 0)
+    removed = {name: {"elements": 0, "files": 0} for name, _ in rules}
+    for record in records:
+        statuses[record["status"]] = statuses.get(record["status"], 0) + 1
+        for stage, seconds in record.get("timings", {}).items():
+            stages[stage] = stages.get(stage, 0) + seconds
+        for name, n in record.get("removed", {}).items():
+            if n:
+                hits = removed.setdefault(name, {"elements": 0, "files": 0})
+                hits["elements"] += n
+                hits["files"] += 1
+    bytes_in = sum(r.get("bytes_in", 0) for r in records)
+    slowest = heapq.nlargest(top, records, key=lambda r: r.get("total", 0))
+    return {
+        "files": len(records),
+        "statuses": statuses,
+        "wall_time": wall_time,
+        "files_per_sec": len(records) / wall_time if wall_time > 0 else None,
+        "bytes_in": bytes_in,
+        "bytes_out": sum(r.get("bytes_out", 0) for r in records),
+        "mb_per_sec": bytes_in / 1024 / 1024 / wall_time if wall_time > 0 else None,
+        "timings": {stage: seconds for stage, seconds in stages.items() if seconds},
+        "removed": removed,
+        "slowest": [{"file": r["file"], "total": r.get("total", 0), "bytes_in": r.get("bytes_in", 0),
+                     "timings": r.get("timings", {})} for r in slowest],
+    }
+
+def write_stats(path, records, summary):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"summary": summary, "files": records}, f, ensure_ascii=False, indent=2)
+
+# ===========================
+# 多进程调度
+# ===========================
+
+CHUNK_SIZE = 32  # 每个任务包含的文件数，摊薄进程间通信的开销
+
+def _clean_task(task, rules, parser, stream_threshold, write_mode, key=None, dry_run=False):
+    """处理一个 (文件, 输出目录, 缓存记录)；在 clean_cached 的结果后附上该文件的统计记录"""
+    file_path, target_dir, entry = task
+    record = {"file": file_path}
+    started = time.perf_counter()
+    result = clean_cached(file_path, target_dir, rules, parser, stream_threshold, write_mode, entry, key,
+                          dry_run, record)
+    record.update(status=result[0], removed=result[2], total=time.perf_counter() - started)
+    return result + (record,)
+
+def _clean_chunk(tasks, rules, parser, stream_threshold, write_mode, key=None, dry_run=False):
+    """工作进程入口：处理一批任务，按顺序返回 _clean_task 的结果"""
+    return [_clean_task(task, rules, parser, stream_threshold, write_mode, key, dry_run) for task in tasks]
+
+def clean_parallel(tasks, rules, jobs, parser="html.parser", stream_threshold=STREAM_THRESHOLD,
+                   write_mode="rewrite", key=None, dry_run=False, chunk_size=CHUNK_SIZE):
+    """多进程处理 (文件, 输出目录, 缓存记录) 序列，按输入顺序逐个产出 _clean_task 的结果"""
+    return map_chunks(_clean_chunk, tasks, jobs, chunk_size, rules, parser, stream_threshold, write_mode, key, dry_run)
+
+def map_chunks(func, items, jobs, chunk_size, *args):
+    """
+    把 items 按 chunk_size 分批交给 func(批次, *args) 在多个进程中执行，按输入顺序逐个产出结果。
+    在途批次不超过 jobs * 2，海量任务时也不会一次性读入全部输入。
+    """
+    items = iter(items)
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending = deque()
+        while True:
+            while len(pending) < jobs * 2:
+                chunk = list(itertools.islice(items, chunk_size))
+                if not chunk:
+                    break
+                pending.append(executor.submit(func, chunk, *args))
+            if not pending:
+                return
+            yield from pending.popleft().result()
+
+# ===========================
+# 编程接口
+# ===========================
+# 在其他进程 (如爬虫) 中直接清理内存中的 HTML: 选择器只在构造时编译一次，不读写磁盘、不启动子进程。
+#
+#     cleaner = Cleaner({"ads": ".ad-banner", "tracking": "script[src*=track]"}, parser="lxml")
+#     result = cleaner.clean(response.content)
+#     result.output, result.counts, result.encoding
+
+# output: 清理后的文档 (与输入同类型: str 或按原编码编码的 bytes); counts: {规则名: 移除数量};
+# encoding: bytes 输入识别出的编码 (str 输入或预筛选直接跳过时为 None)；原编码无法表示的字符写成 &#...;
+CleanResult = namedtuple("CleanResult", ["output", "counts", "encoding"])
+
+def _clean_documents(documents, cleaner):
+    """工作进程入口：按顺序清理一批文档"""
+    return [cleaner.clean(document) for document in documents]
+
+class Cleaner:
+    """预编译一组规则，反复清理内存中的 HTML；rules 接受 as_rules 支持的任意格式 (含 load_rules 的返回值)"""
+
+    def __init__(self, rules, parser="html.parser", write_mode="rewrite"):
+        self.rules = as_rules(rules)
+        if not self.rules:
+            raise ValueError("至少需要一条规则")
+        if write_mode not in WRITE_MODES:
+            raise ValueError(f"未知的写回方式: {write_mode}")
+        self.parser = resolve_parser(parser)
+        self.write_mode = write_mode
+        # 提前编译: 无效的选择器在构造时就报错；编译结果由 compile_rules 缓存，之后每次清理直接复用
+        compile_rules(self.rules, "html.parser" if write_mode == "splice" else self.parser)
+        self.prefilter = compile_prefilter(self.rules)
+
+    def clean(self, html):
+        """清理一个文档 (str 或 bytes)，返回 CleanResult；bytes 按 BOM / <meta> / 统计识别解码，输出沿用同一编码"""
+        is_bytes = isinstance(html, (bytes, bytearray, memoryview))
+        if is_bytes:
+            # 预筛选按字节进行；str 输入为此再编码一份得不偿失，直接解析
+            raw = bytes(html)
+            if self.prefilter is not None and not _may_match(raw, self.prefilter):
+                return CleanResult(html, {name: 0 for name, _ in self.rules}, None)
+            content, encoding, _ = decode_html(raw)
+        else:
+            content, encoding = html, None
+        if self.write_mode == "splice":
+            cleaned, counts = splice_html(content, self.rules, raw=raw if is_bytes else None, encoding=encoding)
+        else:
+            cleaned, counts = apply_rules(content, self.rules, self.parser)
+        if not any(counts.values()):
+            return CleanResult(html, counts, encoding)
+        output = cleaned.encode(encoding, errors="xmlcharrefreplace") if isinstance(cleaned, str) and is_bytes \
+            else cleaned
+        return CleanResult(output, counts, encoding)
+
+    def clean_many(self, documents, jobs=1, chunk_size=CHUNK_SIZE):
+        """
+        批量清理，返回迭代器，按输入顺序逐个产出 CleanResult。
+        jobs > 1 时分批派发到多个进程 (在途批次不超过 jobs * 2)，适合大批量、解析占主要开销的场景。
+        """
+        if jobs <= 1:
+            return map(self.clean, documents)
+        return map_chunks(_clean_documents, documents, jobs, chunk_size, self)
 
 def main():
     args = parse_args()
     
     input_dir = args.input
     output_dir = args.output
-    selector = args.selector
     pattern = args.pattern
 
+    # 所有选择器合并为一组规则，每个文件只解析一次
+    rules = as_rules(args.selector)
+    if args.rules:
+        try:
+            rules += load_rules(args.rules)
+        except Exception as e:
+            print(f"错误: 无法读取规则文件 -> {e}")
+            return
+
     # 检查输入目录
     if not os.path.exists(input_dir):
         print(f"错误: 输入目录不存在 -> {input_dir}")
         return
 
-    # 创建输出目录
-    if output_dir and not os.path.exists(output_dir):
+    # 创建输出目录 (预演模式不创建)
+    if output_dir and not args.dry_run and not os.path.exists(output_dir):
         try:
             os.makedirs(output_dir)
         except Exception as e:
             print(f"错误: 无法创建输出目录 -> {e}")
             return
 
-    # 查找文件
-    search_path = os.path.join(input_dir, pattern)
-    files = glob.glob(search_path)
-    
-    if not files:
-        print(f"在 '{input_dir}' 中未找到匹配 '{pattern}' 的文件。")
-        return
+    parser = resolve_parser(args.parser)
+    if parser != args.parser:
+        print(f"⚠️  解析器 {args.parser} 的依赖未安装，改用 {parser}")
 
     print(f"--- 开始处理 ---")
-    print(f"目标选择器: {selector}")
-    print(f"找到文件: {len(files)} 个")
+    for name, selector in rules:
+        print(f"目标选择器: {selector}" if name == selector else f"规则 {name}: {selector}")
     print("-" * 30)
 
-    for file_path in files:
-        process_file(file_path, output_dir, selector)
-        
+    exclude = list(args.exclude)
+    if output_dir:
+        # 输出目录位于输入目录之内时，不要把已输出的文件再处理一遍
+        rel_output = os.path.relpath(os.path.abspath(output_dir), os.path.abspath(input_dir))
+        if not rel_output.startswith(os.pardir):
+            exclude.append(rel_output)
+
+    cache = CleanCache(output_dir or input_dir) if args.cache else None
+    key = rules_key(rules, parser, args.write) if cache else None
+
+    # 结果按输入顺序返回，这里记下已派发的文件，用于把结果写回对应的缓存记录
+    dispatched = deque()
+
+    def tasks():
+        # 边遍历边处理，不预先收集完整文件列表
+        for file_path in iter_files(input_dir, (pattern,), exclude, args.recursive, args.symlinks):
+            target_dir = output_dir
+            if output_dir:
+                # 递归时在输出目录中保持原有的子目录结构
+                rel_dir = os.path.relpath(os.path.dirname(file_path), input_dir)
+                target_dir = os.path.normpath(os.path.join(output_dir, rel_dir))
+                if not args.dry_run:
+                    os.makedirs(target_dir, exist_ok=True)
+            if cache:
+                dispatched.append(file_path)
+            yield file_path, target_dir, cache.get(file_path) if cache else None
+
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    stream_threshold = int(args.stream_threshold * 1024 * 1024)
+    started = time.perf_counter()
+    if jobs > 1:
+        results = clean_parallel(tasks(), rules, jobs, parser, stream_threshold, args.write, key, args.dry_run)
+    else:
+        results = (_clean_task(task, rules, parser, stream_threshold, args.write, key, args.dry_run)
+                   for task in tasks())
+
+    # 各进程只返回结果，计数、输出与缓存更新统一在主进程按文件顺序完成
+    counts = {"cleaned": 0, "skipped": 0, "cached": 0, "failed": 0}
+    rule_counts = {name: [0, 0] for name, _ in rules}  # 规则名 -> [移除元素数, 涉及文件数]
+    records = []
+    for status, message, removed, entry, record in results:
+        counts[status] += 1
+        if args.verbose or status == "failed":
+            print(message)
+        if cache:
+            cache.put(dispatched.popleft(), entry)
+        if args.stats:
+            records.append(record)
+        for name, n in removed.items():
+            if n:
+                rule_counts[name][0] += n
+                rule_counts[name][1] += 1
+
+    if cache and not args.dry_run:
+        try:
+            cache.save()
+        except OSError as e:
+            print(f"⚠️  缓存写入失败: {e}")
+
+    # 没有任何文件时也写出 (空的) 统计，调用方可以照常读取
+    if args.stats:
+        summary = summarize_stats(records, time.perf_counter() - started, rules, args.slowest)
+        try:
+            write_stats(args.stats, records, summary)
+            print(f"统计已写入 {args.stats}")
+        except OSError as e:
+            print(f"错误: 无法写入统计文件 -> {e}")
+
+    total = sum(counts.values())
+    if not total:
+        print(f"在 '{input_dir}' 中未找到匹配 '{pattern}' 的文件。")
+        return
+
     print("-" * 30)
-    print("处理完成。")
+    print(f"处理完成，共 {total} 个文件: 清理 {counts['cleaned']} 个, 跳过 {counts['skipped']} 个, "
+          f"失败 {counts['failed']} 个。" + (f" (缓存命中 {counts['cached']} 个)" if cache else ""))
+    print("各规则命中:")
+    for name, (elements, files) in rule_counts.items():
+        print(f"  {name}: 移除 {elements} 处, 涉及 {files} 个文件")
+    if args.dry_run:
+        print("预演模式: 未写入任何文件。")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,122 @@
+import os
+import fnmatch
+
+# ===========================
+# 文件发现 (html2pdf / cleaner 共用)
+# ===========================
+# 基于 os.scandir 惰性遍历：边遍历边产出，调用方拿到第一个文件就能开始处理，
+# 不会先把整棵目录树读进内存。
+
+SYMLINK_POLICIES = ("skip", "files", "all")
+
+def _matches(name, rel_path, patterns):
+    """模式同时匹配文件名和相对路径 (大小写不敏感)"""
+    name = name.lower()
+    rel_path = rel_path.replace("\\", "/").lower()
+    return any(fnmatch.fnmatchcase(name, p) or fnmatch.fnmatchcase(rel_path, p) for p in patterns)
+
+def is_excluded(path, root, patterns):
+    """判断 path (或它位于 root 之下的任一上级目录) 是否被排除模式命中"""
+    rel_path = os.path.relpath(path, root)
+    parts = rel_path.replace("\\", "/").split("/")
+    patterns = [p.lower() for p in patterns]
+    return any(_matches(parts[i - 1], "/".join(parts[:i]), patterns) for i in range(1, len(parts) + 1))
+
+def _may_contain(rel_dir, patterns):
+    """非递归模式下，目录 rel_dir 是否可能包含带路径的模式 (如 sub/*.html) 要找的文件: 逐段匹配模式的前几段"""
+    parts = rel_dir.replace("\\", "/").lower().split("/")
+    for pattern in patterns:
+        segments = pattern.split("/")
+        if len(segments) > len(parts) and all(fnmatch.fnmatchcase(p, s) for p, s in zip(parts, segments)):
+            return True
+    return False
+
+def accepts(path, root, include=("*",), exclude=(), recursive=False, symlinks="files", hidden=False):
+    """判断以相同参数调用 iter_files(root, ...) 时是否会产出 path (用于过滤监听到的变化)"""
+    rel_path = os.path.relpath(path, root).replace("\\", "/")
+    parts = rel_path.split("/")
+    if parts[0] == os.pardir:
+        return False
+    if not hidden and any(part.startswith(".") for part in parts):
+        return False
+    if exclude and is_excluded(path, root, exclude):
+        return False
+
+    include = [p.replace("\\", "/").lower() for p in include]
+    if len(parts) > 1 and not recursive and not _may_contain("/".join(parts[:-1]), [p for p in include if "/" in p]):
+        return False
+    # 只有 symlinks=all 时才会进入目录链接；skip 时文件链接也不产出
+    directory = root
+    for part in parts[:-1]:
+        directory = os.path.join(directory, part)
+        if os.path.islink(directory) and symlinks != "all":
+            return False
+    if os.path.islink(path) and symlinks == "skip":
+        return False
+    return os.path.isfile(path) and _matches(parts[-1], rel_path, include)
+
+def iter_files(root, include=("*",), exclude=(), recursive=False, symlinks="files", hidden=False):
+    """
+    惰性遍历 root 下的文件，返回生成器。
+
+    include   : 需要的文件名模式，如 ("*.html", "*.htm")；带路径分隔符的模式 (如 sub/*.html) 匹配相对路径，
+                非递归时也会进入模式指定的子目录 (与 glob 一致)
+    exclude   : 排除的模式，匹配文件或目录 (目录被排除时整棵子树都不进入)
+    recursive : 是否进入子目录
+    symlinks  : 符号链接策略 skip=全部忽略; files=只跟随指向文件的链接; all=目录链接也跟随 (自动防环)
+    hidden    : 是否包含以 . 开头的文件与目录 (默认与 glob 一致，跳过)
+    """
+    if symlinks not in SYMLINK_POLICIES:
+        raise ValueError(f"未知的符号链接策略: {symlinks}")
+
+    include = [p.replace("\\", "/").lower() for p in include]
+    exclude = [p.lower() for p in exclude]
+    path_patterns = [p for p in include if "/" in p]
+
+    visited = set()
+    if symlinks == "all":
+        st = os.stat(root)
+        visited.add((st.st_dev, st.st_ino))
+
+    # 显式栈代替递归，避免深层目录触发递归上限；每层只持有一个 scandir 迭代器
+    stack = [(root, os.scandir(root))]
+    try:
+        while stack:
+            _, entries = stack[-1]
+            entry = next(entries, None)
+            if entry is None:
+                entries.close()
+                stack.pop()
+                continue
+
+            if not hidden and entry.name.startswith("."):
+                continue
+            rel_path = os.path.relpath(entry.path, root)
+            if exclude and _matches(entry.name, rel_path, exclude):
+                continue
+
+            try:
+                is_link = entry.is_symlink()
+                if is_link and symlinks == "skip":
+                    continue
+
+                if entry.is_dir(follow_symlinks=(symlinks == "all")):
+                    if not recursive and not _may_contain(rel_path, path_patterns):
+                        continue
+                    if symlinks == "all":
+                        st = entry.stat()
+                        key = (st.st_dev, st.st_ino)
+                        if key in visited:
+                            continue
+                        visited.add(key)
+                    stack.append((entry.path, os.scandir(entry.path)))
+                    continue
+
+                if entry.is_file(follow_symlinks=True) and _matches(entry.name, rel_path, include):
+                    yield entry.path
+            except OSError:
+                # 权限不足、悬空链接等情况直接跳过
+                continue
+    finally:
+        for _, entries in stack:
+            entries.close()
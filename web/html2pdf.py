@@ -3,7 +3,32 @@ import subprocess
 import sys
 import os
 import platform
-import glob
+import itertools
+import random
+import select
+import signal
+import re
+import threading
+import base64
+import contextlib
+import ctypes
+import ctypes.util
+import functools
+import hashlib
+import io
+import json
+import mimetypes
+import shutil
+import socket
+import struct
+import tempfile
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from html import escape
+
+from discovery import iter_files, accepts, SYMLINK_POLICIES
 
 # ================= 配置文档 =================
 USAGE_EXAMPLES = """
@@ -27,6 +52,47 @@ USAGE_EXAMPLES = """
   6. 指定使用 Edge 浏览器或手动指定浏览器路径:
      python html2pdf.py input.html --edge
      python html2pdf.py input.html --browser-path "C:/Program Files/Google/Chrome/Application/chrome.exe"
+
+  7. 指定并发数 (默认等于 CPU 核数, -j 1 即逐个串行转换):
+     python html2pdf.py ./docs -r -j 4
+
+  8. 常驻浏览器模式 (DevTools 协议, 每个并发只启动一次浏览器, 每 100 页重启一次):
+     python html2pdf.py ./docs -r --engine cdp --recycle-after 100
+
+  9. 排除目录/文件 (可重复指定), 并跟随目录符号链接:
+     python html2pdf.py ./docs -r -x "drafts" -x "*_old.html" --symlinks all
+
+  10. 单页超时 60 秒 (超时杀掉整个浏览器进程组), 失败重试 2 次, 仍失败的页面写入隔离名单, 后续运行直接跳过
+      (默认单页超时 120 秒、失败重试 1 次; 加 --timeout 0 --retries 0 即不限时、不重试):
+     python html2pdf.py ./docs -r --timeout 60 --retries 2 --quarantine quarantine.txt
+
+  11. 合并模式: 把目录下的所有 HTML 按文件名顺序合并成一个 PDF (只启动一次浏览器):
+     python html2pdf.py ./chapters --merge -o book.pdf
+
+  12. 输出运行报告 (每个文件的排队/启动/渲染耗时、输出大小、峰值内存、CPU 时间, 以及吞吐量与 p50/p95/p99 延迟):
+     python html2pdf.py ./docs -r --report run.json
+
+  13. 按内存自适应调整并发 (2~16 之间, 始终为系统保留 2GB 可用内存):
+     python html2pdf.py ./docs -r --adaptive --min-jobs 2 --max-jobs 16 --mem-reserve 2048
+
+  14. 监听模式: 保持浏览器常驻, HTML 或其引用的资源保存后只重新渲染受影响的页面:
+     python html2pdf.py ./docs -r -d ./all_pdfs --watch
+
+  15. 分片: 多台机器各自处理一部分 (按相对路径稳定哈希分配, 加 --shard-by-size 按文件大小均衡), 各写一份报告后合并:
+     python html2pdf.py ./docs -r -d ./pdfs --shard 0/4 --report run-{shard}.json
+     python merge_reports.py run-0.json run-1.json run-2.json run-3.json -o run.json
+
+  16. 离线渲染: 屏蔽所有非 file:// 请求 (跟踪脚本、远程字体等不再拖慢渲染);
+      配合 --asset-cache 时远程地址映射到本地缓存目录 <缓存目录>/<域名>/<路径> (自动使用 cdp 引擎):
+     python html2pdf.py ./wechat -r --offline
+     python html2pdf.py ./wechat -r --asset-cache ./asset_cache
+
+  17. 清理后直接转换: 在内存中删除选择器命中的元素再渲染 (相当于 cleaner.py + html2pdf.py, 不产生中间文件;
+      清理与渲染流水线并行, 相对资源仍按源文件位置解析):
+     python html2pdf.py ./wechat -r -d ./pdfs --clean "#js_row_immersive_stream_wrap" --clean ".ad-banner"
+
+  18. 增量构建 (仅重新渲染 HTML、引用的本地资源或渲染选项有变化的文件，并清理源文件已删除的 PDF):
+     python html2pdf.py ./docs -r -d ./all_pdfs --incremental --prune
 """
 # ===========================================
 
@@ -34,8 +100,23 @@ USAGE_EXAMPLES = """
 # 1. 基础设施层
 # ===========================
 
+# 多线程并发时保证每行输出完整，不被其他线程打断
+_print_lock = threading.Lock()
+
+def log(message):
+    """线程安全的打印"""
+    with _print_lock:
+        print(message, flush=True)
+
 def find_browser_executable(user_path=None, use_edge=False):
-    """查找浏览器路径"""
+    """查找浏览器路径 (命令行入口使用: 找不到时退出程序)"""
+    path = locate_browser(user_path, use_edge)
+    if path: return path
+    print("错误: 未找到浏览器，请使用 --browser-path 指定。")
+    sys.exit(1)
+
+def locate_browser(user_path=None, use_edge=False):
+    """查找浏览器路径；找不到时返回 None"""
     if user_path and os.path.exists(user_path): return user_path
     system = platform.system()
     paths = []
@@ -53,60 +134,610 @@ def find_browser_executable(user_path=None, use_edge=False):
 
     for p in paths:
         if os.path.exists(p): return p
-    print("错误: 未找到浏览器，请使用 --browser-path 指定。")
-    sys.exit(1)
+    return None
+
+def kill_process_tree(proc):
+    """杀掉浏览器及其派生的全部子进程 (渲染进程、GPU 进程等)"""
+    if os.name == "posix":
+        # 进程组号即浏览器主进程号；不调用 proc.kill()，它会先 poll() 抢先回收子进程，导致 wait4 拿不到资源数据
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+    else:
+        subprocess.run(["taskkill", "/F", "/T", "/PID", str(proc.pid)],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            proc.kill()
+        except OSError:
+            pass
+
+def _new_process_group():
+    """让浏览器运行在独立的进程组中，超时时可以整组清理"""
+    if os.name == "posix":
+        return {"start_new_session": True}
+    return {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+
+def run_browser(cmd, timeout=None, stats=None):
+    """
+    运行一次命令行浏览器，接口与 subprocess.run 一致。
+    设置 timeout 时由看门狗线程在超时后杀掉整个进程组，并抛出 subprocess.TimeoutExpired。
+    传入 stats 字典时记录启动耗时、运行耗时，以及 (POSIX 下通过 wait4 获取的) 峰值内存和 CPU 时间。
+    """
+    started = time.perf_counter()
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, **_new_process_group())
+    spawned = time.perf_counter()
+    timed_out = threading.Event()
+
+    def watchdog():
+        timed_out.set()
+        kill_process_tree(proc)
+
+    timer = threading.Timer(timeout, watchdog) if timeout else None
+    if timer:
+        timer.daemon = True
+        timer.start()
+    rusage = None
+    try:
+        stderr = proc.stderr.read()
+        if hasattr(os, "wait4") and proc.returncode is None:
+            try:
+                _, status, rusage = os.wait4(proc.pid, 0)
+                proc.returncode = os.waitstatus_to_exitcode(status)
+            except ChildProcessError:
+                # 已被其他地方回收 (returncode 已由 poll 设置)
+                proc.wait()
+        else:
+            proc.wait()
+    finally:
+        if timer:
+            timer.cancel()
+        proc.stderr.close()
+
+    if stats is not None:
+        stats["spawn_time"] = spawned - started
+        stats["render_time"] = time.perf_counter() - spawned
+        stats["returncode"] = proc.returncode
+        if rusage is not None:
+            # Linux 下 ru_maxrss 单位为 KB，macOS 下为字节
+            scale = 1 if platform.system() == "Darwin" else 1024
+            stats["max_rss"] = rusage.ru_maxrss * scale
+            stats["cpu_user"] = rusage.ru_utime
+            stats["cpu_system"] = rusage.ru_stime
+
+    if timed_out.is_set():
+        raise subprocess.TimeoutExpired(cmd, timeout, stderr=stderr)
+    return subprocess.CompletedProcess(cmd, proc.returncode, None, stderr)
+
+def file_url_for(path):
+    """本地路径转 file:// URL"""
+    prefix = "file:///" if platform.system() == "Windows" else "file://"
+    return prefix + os.path.abspath(path).replace("\\", "/")
+
+# ---------- 离线渲染 ----------
+
+# 命令行引擎的离线参数: 域名解析一律失败，其余 (含 IP 直连与 localhost) 走一个不存在的代理，立即连接失败
+OFFLINE_BROWSER_ARGS = ["--host-resolver-rules=MAP * ~NOTFOUND", "--proxy-server=127.0.0.1:9",
+                        "--proxy-bypass-list=<-loopback>"]
+
+LOCAL_SCHEMES = ("file", "data", "blob", "about")
+
+def asset_cache_path(cache_dir, url):
+    """远程地址映射到本地缓存: <cache_dir>/<host>/<path> (忽略查询串，目录补 index.html)，不存在返回 None"""
+    parsed = urllib.parse.urlparse(url)
+    if not parsed.hostname:
+        return None
+    rel = urllib.parse.unquote(parsed.path).lstrip("/")
+    if not rel or rel.endswith("/"):
+        rel += "index.html"
+    root = os.path.abspath(cache_dir)
+    path = os.path.normpath(os.path.join(root, parsed.hostname, rel))
+    # 防止 ../ 跳出缓存目录
+    if not path.startswith(root + os.sep) or not os.path.isfile(path):
+        return None
+    return path
+
+# ---------- DevTools 协议 (cdp 引擎) ----------
+
+class WebSocketClient:
+    """最小化的 WebSocket 客户端 (仅 ws:// 与文本帧)，足够与 DevTools 通信"""
+
+    GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+    def __init__(self, url, timeout=30):
+        parsed = urllib.parse.urlparse(url)
+        self.sock = socket.create_connection((parsed.hostname, parsed.port or 80), timeout=timeout)
+        self._buffer = bytearray()
+
+        key = base64.b64encode(os.urandom(16)).decode()
+        path = parsed.path + ("?" + parsed.query if parsed.query else "")
+        request = (f"GET {path or '/'} HTTP/1.1\r\n"
+                   f"Host: {parsed.hostname}:{parsed.port or 80}\r\n"
+                   "Upgrade: websocket\r\nConnection: Upgrade\r\n"
+                   f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n")
+        self.sock.sendall(request.encode())
+
+        header = self._read_until(b"\r\n\r\n").decode("latin-1")
+        expected = base64.b64encode(hashlib.sha1((key + self.GUID).encode()).digest()).decode()
+        if " 101 " not in header.split("\r\n", 1)[0] or expected not in header:
+            self.sock.close()
+            raise ConnectionError(f"WebSocket 握手失败: {header.splitlines()[0] if header else '无响应'}")
+
+    def _read_until(self, marker):
+        while marker not in self._buffer:
+            self._fill()
+        end = self._buffer.index(marker)
+        data = bytes(self._buffer[:end])
+        del self._buffer[:end + len(marker)]
+        return data
+
+    def _read_exact(self, n):
+        while len(self._buffer) < n:
+            self._fill()
+        data = bytes(self._buffer[:n])
+        del self._buffer[:n]
+        return data
+
+    def _fill(self):
+        chunk = self.sock.recv(1 << 16)
+        if not chunk:
+            raise ConnectionError("WebSocket 连接已关闭")
+        self._buffer += chunk
+
+    def _send_frame(self, opcode, payload):
+        header = bytes([0x80 | opcode])
+        length = len(payload)
+        if length < 126:
+            header += bytes([0x80 | length])
+        elif length < (1 << 16):
+            header += bytes([0x80 | 126]) + struct.pack("!H", length)
+        else:
+            header += bytes([0x80 | 127]) + struct.pack("!Q", length)
+        # 客户端发出的帧必须加掩码
+        mask = os.urandom(4)
+        masked = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        self.sock.sendall(header + mask + masked)
+
+    def send(self, text):
+        self._send_frame(0x1, text.encode("utf-8"))
+
+    def recv(self):
+        """读取一条完整消息 (自动拼接分片、回应 ping)"""
+        message = b""
+        while True:
+            b1, b2 = self._read_exact(2)
+            fin, opcode = b1 & 0x80, b1 & 0x0F
+            length = b2 & 0x7F
+            if length == 126:
+                length = struct.unpack("!H", self._read_exact(2))[0]
+            elif length == 127:
+                length = struct.unpack("!Q", self._read_exact(8))[0]
+            mask = self._read_exact(4) if b2 & 0x80 else None
+            payload = self._read_exact(length)
+            if mask:
+                payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+            if opcode == 0x8:
+                raise ConnectionError("WebSocket 连接已被对端关闭")
+            if opcode == 0x9:
+                self._send_frame(0xA, payload)
+                continue
+            if opcode == 0xA:
+                continue
+            message += payload
+            if fin:
+                return message.decode("utf-8")
+
+    def close(self):
+        try:
+            self._send_frame(0x8, b"")
+        except OSError:
+            pass
+        self.sock.close()
+
+def launch_devtools_browser(browser, timeout=30):
+    """以远程调试模式启动浏览器，返回 (进程, 浏览器 WebSocket 地址, 临时配置目录)"""
+    profile_dir = tempfile.mkdtemp(prefix="html2pdf-profile-")
+    cmd = [browser, "--headless", "--disable-gpu", "--remote-debugging-port=0",
+           f"--user-data-dir={profile_dir}", "--no-first-run", "--no-default-browser-check", "about:blank"]
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, **_new_process_group())
+
+    # 浏览器就绪后会把端口和地址写入 DevToolsActivePort
+    port_file = os.path.join(profile_dir, "DevToolsActivePort")
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            break
+        try:
+            with open(port_file, encoding="utf-8") as f:
+                lines = f.read().split()
+            if len(lines) >= 2:
+                return proc, f"ws://127.0.0.1:{lines[0]}{lines[1]}", profile_dir
+        except OSError:
+            pass
+        time.sleep(0.05)
+
+    kill_process_tree(proc)
+    proc.wait()
+    shutil.rmtree(profile_dir, ignore_errors=True)
+    raise RuntimeError("浏览器远程调试端口未就绪")
+
+class DevToolsSession:
+    """常驻浏览器会话：浏览器只启动一次，复用同一个标签页逐个打印，每 recycle_after 页重启一次"""
+
+    def __init__(self, browser, recycle_after=100, timeout=60, page_timeout=None, offline=False, asset_cache=None):
+        self.browser = browser
+        self.recycle_after = recycle_after
+        self.timeout = timeout
+        self.page_timeout = page_timeout
+        self.offline = offline or bool(asset_cache)
+        self.asset_cache = asset_cache
+        self.deadline = None
+        self.rendering = False
+        self.proc = None
+        self.profile_dir = None
+        self.ws = None
+        self.session_id = None
+        self.pages = 0
+        self._next_id = 0
+        self._events = []
+
+    def start(self):
+        self.proc, ws_url, self.profile_dir = launch_devtools_browser(self.browser, self.timeout)
+        self.ws = WebSocketClient(ws_url, self.timeout)
+        target_id = self.call("Target.createTarget", {"url": "about:blank"}, session=False)["targetId"]
+        self.session_id = self.call("Target.attachToTarget", {"targetId": target_id, "flatten": True},
+                                    session=False)["sessionId"]
+        self.call("Page.enable")
+        if self.offline:
+            # 拦截全部请求: 本地地址放行，命中缓存的远程地址直接返回缓存内容，其余立即失败
+            self.call("Fetch.enable", {"patterns": [{"urlPattern": "*"}]})
+        self.pages = 0
+
+    def close(self):
+        if self.ws:
+            self.ws.close()
+            self.ws = None
+        if self.proc:
+            # 整组杀掉，避免残留渲染进程
+            kill_process_tree(self.proc)
+            self.proc.wait()
+        self.proc = None
+        if self.profile_dir:
+            shutil.rmtree(self.profile_dir, ignore_errors=True)
+            self.profile_dir = None
+        self.session_id = None
+
+    def send(self, method, params=None, session=True):
+        """发送一条 CDP 指令，不等待结果，返回指令 id"""
+        self._next_id += 1
+        message = {"id": self._next_id, "method": method, "params": params or {}}
+        if session:
+            message["sessionId"] = self.session_id
+        self.ws.send(json.dumps(message))
+        return self._next_id
+
+    def call(self, method, params=None, session=True):
+        """发送一条 CDP 指令并等待结果，期间收到的事件先缓存"""
+        message_id = self.send(method, params, session)
+        while True:
+            reply = self._recv()
+            if reply.get("id") == message_id:
+                if "error" in reply:
+                    raise RuntimeError(f"{method}: {reply['error'].get('message')}")
+                return reply.get("result", {})
+            if "method" in reply:
+                self._on_event(reply)
+
+    def wait_event(self, method):
+        while True:
+            for i, event in enumerate(self._events):
+                if event["method"] == method and event.get("sessionId") == self.session_id:
+                    return self._events.pop(i)
+            message = self._recv()
+            if "method" in message:
+                self._on_event(message)
+
+    def _on_event(self, event):
+        """拦截到的请求需要立即处理，否则页面会一直等待；其他事件缓存起来"""
+        if event["method"] == "Fetch.requestPaused":
+            self._handle_request(event["params"])
+        else:
+            self._events.append(event)
+
+    def _handle_request(self, params):
+        url = params["request"]["url"]
+        request_id = params["requestId"]
+        if urllib.parse.urlparse(url).scheme in LOCAL_SCHEMES:
+            self.send("Fetch.continueRequest", {"requestId": request_id})
+            return
 
-def run_conversion(browser, input_file, output_file, force_overwrite=False):
-    """执行转换指令，包含存在性检查"""
+        cached = asset_cache_path(self.asset_cache, url) if self.asset_cache else None
+        if cached:
+            with open(cached, "rb") as f:
+                body = base64.b64encode(f.read()).decode("ascii")
+            content_type = mimetypes.guess_type(cached)[0] or "application/octet-stream"
+            self.send("Fetch.fulfillRequest", {"requestId": request_id, "responseCode": 200, "body": body,
+                                               "responseHeaders": [{"name": "Content-Type", "value": content_type}]})
+        else:
+            self.send("Fetch.failRequest", {"requestId": request_id, "errorReason": "BlockedByClient"})
+
+    def _recv(self):
+        """
+        读取一条消息；超过单页截止时间则抛出 TimeoutError。
+        套接字超时随阶段而定: 启动与建立会话用 timeout，渲染页面时用剩余的单页时间，不限制单页时间时一直等待。
+        """
+        if self.deadline is not None:
+            remaining = self.deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("页面渲染超时")
+            self.ws.sock.settimeout(remaining)
+        elif self.rendering:
+            self.ws.sock.settimeout(None)
+        else:
+            self.ws.sock.settimeout(self.timeout)
+        try:
+            return json.loads(self.ws.recv())
+        except socket.timeout:
+            raise TimeoutError("页面渲染超时")
+
+    # 等待图片、样式表与字体加载完成 (setDocumentContent 不会触发 load 事件)
+    WAIT_FOR_ASSETS_JS = """new Promise(resolve => {
+        const pending = [...document.images].filter(img => !img.complete)
+            .concat([...document.querySelectorAll('link[rel=stylesheet]')].filter(link => !link.sheet));
+        let left = pending.length;
+        const done = () => document.fonts.ready.then(() => resolve(true));
+        if (!left) return done();
+        pending.forEach(el => ['load', 'error'].forEach(type =>
+            el.addEventListener(type, () => { if (--left === 0) done(); }, {once: true})));
+    })"""
+
+    def _begin(self):
+        """确保浏览器已启动 (必要时重启)，并设置本页的截止时间；返回浏览器启动耗时"""
+        started = time.perf_counter()
+        if self.ws is None:
+            self.start()
+        elif self.pages >= self.recycle_after:
+            # 定期重启浏览器，避免内存无限增长
+            self.close()
+            self.start()
+        self._events.clear()
+        self.rendering = True
+        self.deadline = time.monotonic() + self.page_timeout if self.page_timeout else None
+        return time.perf_counter() - started
+
+    def _end(self):
+        self.rendering = False
+        self.deadline = None
+
+    def _navigate(self, url):
+        result = self.call("Page.navigate", {"url": url})
+        if result.get("errorText"):
+            raise RuntimeError(f"页面加载失败: {result['errorText']}")
+        self.wait_event("Page.loadEventFired")
+        return result.get("frameId")
+
+    def _print_pdf(self, out):
+        """以流的方式读取 PDF 并写入可写文件对象 out，避免整份 PDF 的 base64 常驻内存"""
+        result = self.call("Page.printToPDF", {"displayHeaderFooter": False, "transferMode": "ReturnAsStream"})
+        if not result.get("stream"):
+            out.write(base64.b64decode(result["data"]))
+            return
+        handle = result["stream"]
+        try:
+            while True:
+                chunk = self.call("IO.read", {"handle": handle, "size": 1 << 20})
+                data = chunk.get("data", "")
+                out.write(base64.b64decode(data) if chunk.get("base64Encoded") else data.encode("latin-1"))
+                if chunk.get("eof"):
+                    break
+        finally:
+            self.call("IO.close", {"handle": handle})
+
+    def print_to_pdf(self, file_url, output_file, stats=None):
+        """打印本地文件到 output_file"""
+        spawn_time = self._begin()
+        render_started = time.perf_counter()
+        try:
+            self._navigate(file_url)
+            with open(output_file, "wb") as f:
+                self._print_pdf(f)
+        finally:
+            self._end()
+        self.pages += 1
+        self._record(stats, spawn_time, render_started)
+
+    def _record(self, stats, spawn_time, render_started):
+        if stats is None:
+            return
+        stats["spawn_time"] = spawn_time
+        stats["render_time"] = time.perf_counter() - render_started
+        # 常驻浏览器不会退出，拿不到 wait4 的峰值；以刚打印完时整个浏览器进程组的 RSS 作为本页内存
+        rss = process_tree_rss(self.proc.pid) if self.proc else None
+        if rss:
+            stats["max_rss"] = rss
+
+    def print_html(self, html, base_url=None, out=None, stats=None):
+        """
+        打印内存中的 HTML 字符串，不落地临时文件。
+        base_url 为 file:// 地址时先打开其所在目录，让页面处于该目录的 file 源下，相对资源可以正常加载。
+        传入 out (可写的二进制文件对象) 时流式写出并返回 None，否则返回 PDF 字节。
+        """
+        spawn_time = self._begin()
+        render_started = time.perf_counter()
+        try:
+            if base_url and base_url.startswith("file:"):
+                directory = base_url if base_url.endswith("/") else base_url.rsplit("/", 1)[0] + "/"
+                frame_id = self._navigate(directory)
+            else:
+                frame_id = self._navigate("about:blank")
+            if base_url:
+                html = inject_base(html, base_url)
+            self.call("Page.setDocumentContent", {"frameId": frame_id, "html": html})
+            self.call("Runtime.evaluate", {"expression": self.WAIT_FOR_ASSETS_JS, "awaitPromise": True})
+
+            buffer = out if out is not None else io.BytesIO()
+            self._print_pdf(buffer)
+        finally:
+            self._end()
+        self.pages += 1
+        self._record(stats, spawn_time, render_started)
+        return None if out is not None else buffer.getvalue()
+
+class DevToolsPool:
+    """
+    常驻浏览器会话池: 渲染时借出一个空闲会话 (没有空闲的就新建)，用完归还。
+    配合自适应调度时用 trim 关闭超出当前并发上限的空闲浏览器，内存紧张时真正释放内存。
+    """
+
+    def __init__(self, browser, recycle_after=100, page_timeout=None, offline=False, asset_cache=None):
+        self.browser = browser
+        self.recycle_after = recycle_after
+        self.page_timeout = page_timeout
+        self.offline = offline
+        self.asset_cache = asset_cache
+        self._idle = []
+        self._sessions = []
+        self._lock = threading.Lock()
+
+    def session(self):
+        """借出一个会话，用完后调用 release 归还"""
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+            session = DevToolsSession(self.browser, self.recycle_after, page_timeout=self.page_timeout,
+                                      offline=self.offline, asset_cache=self.asset_cache)
+            self._sessions.append(session)
+            return session
+
+    def release(self, session):
+        with self._lock:
+            if session in self._sessions:
+                self._idle.append(session)
+
+    def trim(self, keep):
+        """关闭空闲会话，直到会话总数不超过 keep；返回关闭的个数"""
+        closed = []
+        with self._lock:
+            while self._idle and len(self._sessions) > keep:
+                session = self._idle.pop(0)
+                self._sessions.remove(session)
+                closed.append(session)
+        for session in closed:
+            session.close()
+        return len(closed)
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions:
+                session.close()
+            self._sessions = []
+            self._idle = []
+
+def run_conversion(browser, input_file, output_file, force_overwrite=False, pool=None, timeout=None, metrics=None,
+                   browser_args=None, html=None):
+    """
+    执行转换指令，包含存在性检查；传入 pool 时走 DevTools 常驻浏览器，timeout 为单页超时秒数。
+    传入 metrics 字典时写入本次渲染的耗时、输出大小、返回码与资源占用；browser_args 为命令行引擎的附加参数。
+    传入 html 时渲染这段内存中的内容 (如清理后的页面) 代替读取 input_file，相对资源仍按 input_file 的位置解析。
+    """
     abs_input = os.path.abspath(input_file)
     abs_output = os.path.abspath(output_file)
     
     # 存在性检查：如果文件存在且不强制覆盖，则跳过
     if os.path.exists(abs_output) and not force_overwrite:
-        print(f"⏭️  [跳过] 文件已存在: {os.path.basename(output_file)}")
+        log(f"⏭️  [跳过] 文件已存在: {os.path.basename(output_file)}")
         return True
 
     os.makedirs(os.path.dirname(abs_output), exist_ok=True)
-    
-    prefix = "file:///" if platform.system() == "Windows" else "file://"
-    file_url = prefix + abs_input.replace("\\", "/")
+    action_text = "覆盖" if os.path.exists(abs_output) and force_overwrite else "生成"
+    file_url = file_url_for(abs_input)
+    # 先写到输出目录中的临时文件，成功后再替换: 超时或中途失败不会留下残缺的 PDF，重试也不会误判为已存在
+    partial = os.path.join(os.path.dirname(abs_output), f".{os.path.basename(abs_output)}.part")
+    try:
+        return _render(browser, input_file, output_file, abs_output, partial, file_url, action_text, pool, timeout,
+                       metrics, browser_args, html)
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(partial)
+
+def _finish(partial, abs_output):
+    """渲染成功: 临时文件替换为正式输出"""
+    if os.path.isfile(partial):
+        os.replace(partial, abs_output)
 
-    cmd = [browser, "--headless", "--disable-gpu", f"--print-to-pdf={abs_output}", "--no-pdf-header-footer", file_url]
+def _render(browser, input_file, output_file, abs_output, partial, file_url, action_text, pool, timeout, metrics,
+            browser_args, html):
+    if pool is not None:
+        session = pool.session()
+        try:
+            if html is None:
+                session.print_to_pdf(file_url, partial, metrics)
+            else:
+                with open(partial, "wb") as out:
+                    session.print_html(html, file_url, out, metrics)
+            _finish(partial, abs_output)
+            if metrics is not None:
+                metrics.update(engine="cdp", output_size=os.path.getsize(abs_output))
+            log(f"✅ [{action_text}] {os.path.basename(input_file)} -> {os.path.basename(output_file)}")
+            return True
+        except TimeoutError:
+            # 超时即本次尝试失败: 不再用命令行模式重跑，否则单页耗时会变成两倍超时
+            session.close()
+            log(f"⏱️  [超时] {os.path.basename(input_file)}: 超过 {timeout} 秒，已终止浏览器进程组")
+            return False
+        except Exception as e:
+            # 会话可能已损坏，关闭后由下一次调用重新启动；本文件退回命令行模式
+            session.close()
+            log(f"⚠️  [回退] DevTools 模式失败 ({e})，改用命令行模式: {os.path.basename(input_file)}")
+        finally:
+            pool.release(session)
+
+    cmd = [browser, "--headless", "--disable-gpu", f"--print-to-pdf={partial}", "--no-pdf-header-footer",
+           *(browser_args or []), file_url]
 
     try:
-        res = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if html is not None:
+            # 命令行引擎只能读文件: 内容写入临时文件，相对资源按源文件的位置解析
+            pdf = _convert_html_cli(browser, html, file_url, timeout, browser_args, metrics)
+            with open(partial, "wb") as out:
+                out.write(pdf)
+            res = subprocess.CompletedProcess(cmd, 0, b"", b"")
+        else:
+            res = run_browser(cmd, timeout, metrics)
+        if metrics is not None:
+            metrics["engine"] = "cli"
         if res.returncode == 0:
-            action_text = "覆盖" if os.path.exists(abs_output) and force_overwrite else "生成"
-            print(f"✅ [{action_text}] {os.path.basename(input_file)} -> {os.path.basename(output_file)}")
+            _finish(partial, abs_output)
+            if metrics is not None and os.path.exists(abs_output):
+                metrics["output_size"] = os.path.getsize(abs_output)
+            log(f"✅ [{action_text}] {os.path.basename(input_file)} -> {os.path.basename(output_file)}")
             return True
         else:
             err = res.stderr.decode('utf-8', errors='replace') or res.stderr.decode(errors='replace')
-            print(f"❌ [失败] {os.path.basename(input_file)}: {err}")
+            log(f"❌ [失败] {os.path.basename(input_file)}: {err}")
             return False
+    except subprocess.TimeoutExpired:
+        log(f"⏱️  [超时] {os.path.basename(input_file)}: 超过 {timeout} 秒，已终止浏览器进程组")
+        return False
     except Exception as e:
-        print(f"❌ [异常] {e}")
+        log(f"❌ [异常] {os.path.basename(input_file)}: {e}")
         return False
 
 # ===========================
 # 2. 逻辑层
 # ===========================
 
-def collect_files(input_path, recursive=False):
-    files = []
+HTML_PATTERNS = ("*.html", "*.htm")
+
+def collect_files(input_path, recursive=False, exclude=(), symlinks="files"):
+    """惰性产出待转换的 HTML 文件 (生成器)，边遍历边转换"""
     if os.path.isfile(input_path):
-        files.append(input_path)
+        yield input_path
     elif os.path.isdir(input_path):
-        if recursive:
-            for root, _, filenames in os.walk(input_path):
-                for f in filenames:
-                    if f.lower().endswith(('.html', '.htm')):
-                        files.append(os.path.join(root, f))
-        else:
-            files.extend(glob.glob(os.path.join(input_path, "*.html")))
-            files.extend(glob.glob(os.path.join(input_path, "*.htm")))
+        yield from iter_files(input_path, HTML_PATTERNS, exclude, recursive, symlinks)
     else:
         print(f"错误: 输入路径不存在: {input_path}")
-    return files
 
 def calculate_output_path(input_file, specific_output_name, output_dir):
     if output_dir:
@@ -118,10 +749,946 @@ def calculate_output_path(input_file, specific_output_name, output_dir):
     base, _ = os.path.splitext(input_file)
     return base + ".pdf"
 
+# ---------- 增量构建清单 ----------
+
+MANIFEST_NAME = ".html2pdf-manifest.json"
+
+# 只收集渲染时真正加载的子资源: 样式表、图片 (含 srcset)、脚本、媒体与内嵌页面，以及 CSS 的 url(...) / @import。
+# <a href> 等链接不算资源，否则导航栏链接的任一页面变化都会让所有页面重新渲染
+SUBRESOURCE_TAG_PATTERN = re.compile(r"<(link|img|source|script|video|audio|track|embed|iframe|input)\b([^>]*)>", re.I)
+TAG_ATTR_PATTERN = re.compile(r"""\b(rel|href|src|srcset|poster)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))""", re.I)
+CSS_REF_PATTERN = re.compile(r"""url\(\s*["']?([^"')]+)["']?\s*\)|@import\s+["']([^"']+)["']""", re.I)
+
+def srcset_urls(value):
+    """srcset 的每个候选项为 "地址 [描述符]"，以逗号分隔"""
+    return [candidate.split()[0] for candidate in value.split(",") if candidate.strip()]
+
+def subresource_refs(text, is_css=False):
+    """页面 (或样式表) 中引用的子资源地址"""
+    refs = [m.group(1) or m.group(2) for m in CSS_REF_PATTERN.finditer(text)]
+    if is_css:
+        return refs
+    for tag in SUBRESOURCE_TAG_PATTERN.finditer(text):
+        attrs = {m.group(1).lower(): m.group(2) or m.group(3) or m.group(4) or ""
+                 for m in TAG_ATTR_PATTERN.finditer(tag.group(2))}
+        if tag.group(1).lower() == "link":
+            if "stylesheet" in attrs.get("rel", "").lower().split() and attrs.get("href"):
+                refs.append(attrs["href"])
+            continue
+        refs.extend(attrs[name] for name in ("src", "poster") if attrs.get(name))
+        if attrs.get("srcset"):
+            refs.extend(srcset_urls(attrs["srcset"]))
+    return refs
+
+def find_local_assets(path, _seen=None):
+    """提取 HTML/CSS 中引用的本地子资源路径 (样式表内引用的资源也一并收集)"""
+    seen = _seen if _seen is not None else set()
+    try:
+        with open(path, "rb") as f:
+            text = f.read().decode("utf-8", errors="replace")
+    except OSError:
+        return seen
+
+    page = os.path.abspath(path)
+    base_dir = os.path.dirname(page)
+    for ref in subresource_refs(text, is_css=page.lower().endswith(".css")):
+        ref = ref.strip()
+        parsed = urllib.parse.urlparse(ref)
+        if parsed.scheme == "file":
+            asset = urllib.parse.unquote(parsed.path)
+        elif parsed.scheme or ref.startswith("//"):
+            # 远程资源、data: 等不参与哈希 (Windows 盘符会被解析成单字母 scheme)
+            if len(parsed.scheme) != 1:
+                continue
+            asset = ref
+        else:
+            asset = os.path.join(base_dir, urllib.parse.unquote(parsed.path))
+        asset = os.path.abspath(asset)
+        if asset == page or asset in seen or not os.path.isfile(asset):
+            continue
+        seen.add(asset)
+        if asset.lower().endswith(".css"):
+            find_local_assets(asset, seen)
+    return seen
+
+def hash_file(path, digest=None):
+    digest = digest or hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest
+
+class BuildManifest:
+    """增量构建清单：记录每个输出对应的输入 HTML、本地资源与渲染选项的哈希"""
+
+    def __init__(self, directory, render_options=None):
+        self.directory = os.path.abspath(directory)
+        self.path = os.path.join(self.directory, MANIFEST_NAME)
+        self.options_key = json.dumps(render_options or {}, sort_keys=True)
+        self.entries = {}
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self.entries = json.load(f).get("entries", {})
+        except (OSError, ValueError):
+            pass
+
+    def _key(self, output_file):
+        return os.path.relpath(os.path.abspath(output_file), self.directory).replace("\\", "/")
+
+    def digest(self, input_file):
+        """输入文件、所引用资源和渲染选项的联合哈希"""
+        digest = hashlib.sha256(self.options_key.encode("utf-8"))
+        hash_file(input_file, digest)
+        for asset in sorted(find_local_assets(input_file)):
+            digest.update(b"\0" + asset.encode("utf-8") + b"\0")
+            hash_file(asset, digest)
+        return digest.hexdigest()
+
+    def is_fresh(self, output_file, digest):
+        entry = self.entries.get(self._key(output_file))
+        return bool(entry) and entry.get("digest") == digest and os.path.exists(output_file)
+
+    def record(self, output_file, input_file, digest):
+        with self._lock:
+            self.entries[self._key(output_file)] = {"input": os.path.abspath(input_file), "digest": digest}
+
+    def prune(self):
+        """删除源 HTML 已不存在的输出文件及其记录，返回被删除的输出路径"""
+        removed = []
+        with self._lock:
+            for key, entry in list(self.entries.items()):
+                if os.path.exists(entry.get("input", "")):
+                    continue
+                output = os.path.join(self.directory, key)
+                if os.path.exists(output):
+                    os.remove(output)
+                removed.append(output)
+                del self.entries[key]
+        return removed
+
+    def save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with self._lock:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": 1, "entries": self.entries}, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+def manifest_directory(input_path, output_dir, first_target):
+    """清单放在输出目录；未指定 -d 时放在输入目录 (单文件则为输出文件所在目录)"""
+    if output_dir:
+        return output_dir
+    if os.path.isdir(input_path):
+        return input_path
+    return os.path.dirname(os.path.abspath(first_target))
+
+# ---------- 超时、重试与隔离 ----------
+
+class RetryPolicy:
+    """单页超时、有界退避重试与隔离名单 (多次失败的页面不再拖慢后续批次)"""
+
+    BACKOFF_BASE = 1.0
+    BACKOFF_MAX = 30.0
+
+    def __init__(self, timeout=None, retries=0, quarantine_file=None):
+        self.timeout = timeout or None
+        self.retries = max(0, retries)
+        self.quarantine_file = quarantine_file
+        self.quarantined = set()
+        self.newly_quarantined = []
+        self._lock = threading.Lock()
+        if quarantine_file and os.path.exists(quarantine_file):
+            with open(quarantine_file, encoding="utf-8") as f:
+                self.quarantined = {line.strip() for line in f if line.strip()}
+
+    def backoff(self, attempt):
+        """第 attempt 次重试前的等待秒数：指数增长、有上限、带随机抖动"""
+        delay = min(self.BACKOFF_BASE * (2 ** (attempt - 1)), self.BACKOFF_MAX)
+        return delay * random.uniform(0.5, 1.0)
+
+    def is_quarantined(self, input_file):
+        return os.path.abspath(input_file) in self.quarantined
+
+    def quarantine(self, input_file):
+        path = os.path.abspath(input_file)
+        with self._lock:
+            if path not in self.quarantined:
+                self.quarantined.add(path)
+                self.newly_quarantined.append(path)
+
+    def save(self):
+        if not self.quarantine_file or not self.newly_quarantined:
+            return
+        with open(self.quarantine_file, "a", encoding="utf-8") as f:
+            for path in self.newly_quarantined:
+                f.write(path + "\n")
+
+def convert_one(browser, input_file, output_file, force_overwrite=False, pool=None, manifest=None, policy=None,
+                metrics=None, limiter=None, browser_args=None, load_html=None):
+    """
+    转换单个文件，返回状态: generated / skipped / failed / quarantined
+    传入 metrics 字典时记录本文件的耗时数据；其中的 submitted_at (提交时刻) 用于计算排队等待时间。
+    传入 limiter (AdaptiveLimiter) 时，每次渲染前按内存情况申请并发名额。
+    传入 load_html 时调用它取得要渲染的内存内容 (返回 None 表示直接渲染源文件)，用于清理流水线。
+    """
+    if metrics is None:
+        return _convert_one(browser, input_file, output_file, force_overwrite, pool, manifest, policy, None, limiter,
+                            browser_args, load_html)
+
+    started = time.perf_counter()
+    metrics["queue_wait"] = started - metrics.pop("submitted_at", started)
+    metrics.update(input=input_file, output=output_file, attempts=0)
+    status = "failed"
+    try:
+        status = _convert_one(browser, input_file, output_file, force_overwrite, pool, manifest, policy, metrics,
+                              limiter, browser_args, load_html)
+        return status
+    finally:
+        metrics["status"] = status
+        metrics["total_time"] = time.perf_counter() - started
+
+def _convert_one(browser, input_file, output_file, force_overwrite, pool, manifest, policy, metrics=None,
+                 limiter=None, browser_args=None, load_html=None):
+    if policy is not None and policy.is_quarantined(input_file):
+        log(f"🚫 [隔离] 多次失败已被隔离: {os.path.basename(input_file)}")
+        return "quarantined"
+
+    if manifest is not None:
+        digest = manifest.digest(input_file)
+        if not force_overwrite and manifest.is_fresh(output_file, digest):
+            log(f"⏭️  [跳过] 内容未变化: {os.path.basename(output_file)}")
+            return "skipped"
+        # 清单判定为已变化 (或没有记录) 时，已有的旧输出需要覆盖
+        force_overwrite = True
+
+    html = None
+    # 输出已存在且不覆盖时 run_conversion 会直接跳过，不必清理
+    if load_html is not None and (force_overwrite or not os.path.exists(os.path.abspath(output_file))):
+        waited = time.perf_counter()
+        try:
+            html = load_html()
+        except Exception as e:
+            log(f"❌ [失败] 清理阶段出错 {os.path.basename(input_file)}: {e}")
+            return "failed"
+        if metrics is not None:
+            # 清理与上一个文件的渲染重叠进行，这里只记录渲染线程实际等待的时间
+            metrics["clean_wait"] = time.perf_counter() - waited
+
+    is_existing = os.path.exists(os.path.abspath(output_file))
+    timeout = policy.timeout if policy else None
+    retries = policy.retries if policy else 0
+
+    def attempt_render(overwrite):
+        if metrics is not None:
+            metrics["attempts"] += 1
+        if limiter is None:
+            return run_conversion(browser, input_file, output_file, overwrite, pool, timeout, metrics,
+                                  browser_args, html)
+
+        # 自适应调度需要实测的 RSS，未开启报告时也要采集
+        stats = metrics if metrics is not None else {}
+        limiter.acquire()
+        try:
+            return run_conversion(browser, input_file, output_file, overwrite, pool, timeout, stats,
+                                  browser_args, html)
+        finally:
+            limiter.release(stats.get("max_rss"))
+            if pool is not None:
+                # 并发上限降低后，多出来的空闲浏览器要关掉才能真正释放内存
+                closed = pool.trim(limiter.limit)
+                if closed:
+                    log(f"📉 [调度] 关闭 {closed} 个空闲的常驻浏览器")
+
+    ok = attempt_render(force_overwrite)
+    for attempt in range(1, retries + 1):
+        if ok:
+            break
+        delay = policy.backoff(attempt)
+        log(f"🔁 [重试 {attempt}/{retries}] {os.path.basename(input_file)} ({delay:.1f} 秒后)")
+        time.sleep(delay)
+        ok = attempt_render(force_overwrite)
+
+    if not ok:
+        if policy is not None and policy.quarantine_file:
+            policy.quarantine(input_file)
+        return "failed"
+    if manifest is not None:
+        manifest.record(output_file, input_file, digest)
+    if is_existing and not force_overwrite:
+        return "skipped"
+    return "generated"
+
+def clean_for_render(input_file, selector):
+    """
+    清理流水线的第一段: 在内存中移除选择器命中的元素 (与 cleaner.py 相同的处理)。
+    没有命中时返回 None，由渲染阶段直接打开源文件，省去一次序列化。
+    """
+    import cleaner  # 只有清理模式需要 BeautifulSoup
+
+    if not cleaner.may_contain(input_file, selector):
+        return None
+    content, _ = cleaner.read_html(input_file)
+    cleaned, count = cleaner.clean_html(content, selector)
+    if not count:
+        return None
+    log(f"🧹 [清理] 移除 {count} 处: {os.path.basename(input_file)}")
+    return cleaned
+
+# ---------- 内存自适应并发 ----------
+
+MB = 1024 * 1024
+
+def available_memory():
+    """系统当前可用内存 (字节)；优先 psutil，其次 /proc/meminfo，都不可用时返回 None"""
+    try:
+        import psutil
+        return psutil.virtual_memory().available
+    except ImportError:
+        pass
+    try:
+        with open("/proc/meminfo", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+def process_tree_rss(pid):
+    """进程及其全部子进程当前的 RSS 之和 (字节)；优先 psutil，其次 /proc，都不可用时返回 None"""
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+    if psutil is not None:
+        try:
+            root = psutil.Process(pid)
+            procs = [root] + root.children(recursive=True)
+        except psutil.Error:
+            return None
+        total = 0
+        for proc in procs:
+            try:
+                total += proc.memory_info().rss
+            except psutil.Error:
+                pass  # 统计期间退出的进程
+        return total
+
+    # /proc: 浏览器运行在独立的进程组中 (组号即主进程号)，统计该组的全部进程
+    try:
+        page_size = os.sysconf("SC_PAGE_SIZE")
+        names = os.listdir("/proc")
+    except (OSError, ValueError, AttributeError):
+        return None
+    total = 0
+    for name in names:
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat", encoding="ascii", errors="replace") as f:
+                # 进程名可能包含空格与括号，从最后一个 ")" 之后开始: 状态, ppid, pgrp, ..., rss (第 24 个字段)
+                fields = f.read().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        if int(fields[2]) == pid or int(name) == pid:
+            total += int(fields[21]) * page_size
+    return total or None
+
+class AdaptiveLimiter:
+    """
+    根据系统可用内存和实测的单页 RSS 动态调整同时进行的渲染数。
+    可用内存扣除保留量后，按单页 RSS 估算还能容纳多少个渲染；
+    内存紧张时立即降低上限，内存充裕时每完成一页最多增加 1 个并发，始终保持在 [floor, ceiling] 之间。
+    """
+
+    def __init__(self, floor=1, ceiling=8, reserve=1024 * MB, initial_rss=300 * MB, memory_probe=available_memory):
+        self.floor = max(1, floor)
+        self.ceiling = max(self.floor, ceiling)
+        self.reserve = reserve
+        self.avg_rss = initial_rss
+        self.memory_probe = memory_probe
+        self.limit = self.floor
+        self.active = 0
+        self._cond = threading.Condition()
+
+    def _memory_target(self):
+        available = self.memory_probe()
+        if available is None:
+            return self.ceiling
+        # 在途渲染占用的内存已经从可用内存中扣除，所以在当前并发基础上计算还能新增多少
+        extra = int((available - self.reserve) // max(self.avg_rss, 1))
+        return max(self.floor, min(self.ceiling, self.active + extra))
+
+    def _update_limit(self, target):
+        if target < self.limit:
+            log(f"📉 [调度] 内存紧张，并发上限 {self.limit} -> {target}")
+        self.limit = target
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                self._update_limit(min(self.limit, self._memory_target()))
+                if self.active < self.limit:
+                    self.active += 1
+                    return
+                # 定期重新探测内存，不只依赖其他渲染结束的通知
+                self._cond.wait(timeout=0.5)
+
+    def release(self, rss=None):
+        with self._cond:
+            self.active -= 1
+            if rss:
+                # 指数滑动平均，兼顾突发的重页面与整体趋势
+                self.avg_rss = 0.7 * self.avg_rss + 0.3 * rss if self.avg_rss else rss
+            target = self._memory_target()
+            self._update_limit(min(self.limit + 1, target))
+            self._cond.notify_all()
+
+# ---------- 监听模式 ----------
+
+class PollingWatcher:
+    """轮询方式的文件监听 (通用后备方案)：定期比较文件的修改时间与大小"""
+
+    def __init__(self, roots, interval=0.5):
+        self.roots = roots  # [(目录, 是否递归), ...]
+        self.interval = interval
+        self.snapshot = self._scan()
+
+    def _scan(self):
+        snapshot = {}
+        for root, recursive in self.roots:
+            try:
+                for path in iter_files(root, recursive=recursive):
+                    try:
+                        st = os.stat(path)
+                        snapshot[path] = (st.st_mtime_ns, st.st_size)
+                    except OSError:
+                        pass
+            except OSError:
+                pass
+        return snapshot
+
+    def add_directory(self, directory):
+        if (directory, False) not in self.roots and (directory, True) not in self.roots:
+            self.roots.append((directory, False))
+            self.snapshot.update(self._scan())
+
+    def changes(self, timeout=None):
+        """返回发生变化 (新增、修改、删除) 的路径；timeout 秒内无变化返回空集合，None 表示一直等待"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait_for = self.interval if deadline is None else max(0, min(self.interval, deadline - time.monotonic()))
+            time.sleep(wait_for)
+            current = self._scan()
+            changed = {p for p in current.keys() | self.snapshot.keys() if current.get(p) != self.snapshot.get(p)}
+            self.snapshot = current
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+    def close(self):
+        pass
+
+class InotifyWatcher:
+    """基于 Linux inotify 的文件监听 (通过 ctypes 调用 libc，无第三方依赖)"""
+
+    IN_MODIFY, IN_ATTRIB, IN_CLOSE_WRITE = 0x002, 0x004, 0x008
+    IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE = 0x040, 0x080, 0x100, 0x200
+    IN_ISDIR = 0x40000000
+    MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    EVENT = struct.Struct("iIII")
+
+    def __init__(self, roots):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | getattr(os, "O_CLOEXEC", 0))
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 失败")
+        self.watches = {}
+        self.recursive_dirs = set()
+        for root, recursive in roots:
+            self._watch_tree(root, recursive)
+
+    def _watch(self, directory):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), self.MASK)
+        if wd >= 0:
+            self.watches[wd] = directory
+
+    def _watch_tree(self, root, recursive):
+        self._watch(root)
+        if recursive:
+            self.recursive_dirs.add(os.path.abspath(root))
+            for dirpath, dirnames, _ in os.walk(root):
+                for d in dirnames:
+                    self._watch(os.path.join(dirpath, d))
+
+    def add_directory(self, directory):
+        if directory not in self.watches.values():
+            self._watch(directory)
+
+    def changes(self, timeout=None):
+        """返回发生变化的路径；timeout 秒内无事件返回空集合，None 表示一直等待"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        changed = set()
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+            name = data[offset + self.EVENT.size: offset + self.EVENT.size + length].rstrip(b"\0")
+            offset += self.EVENT.size + length
+            directory = self.watches.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, os.fsdecode(name))
+            if mask & self.IN_ISDIR:
+                # 递归监听时，新建的子目录也要加入监听
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO) and any(
+                        os.path.abspath(path).startswith(d + os.sep) for d in self.recursive_dirs):
+                    self._watch_tree(path, True)
+                continue
+            changed.add(path)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+def make_watcher(roots, polling=False):
+    """优先使用 inotify，不可用时退回轮询"""
+    if not polling and platform.system() == "Linux":
+        try:
+            return InotifyWatcher(roots)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(roots)
+
+def next_batch(watcher, debounce=0.2):
+    """等待变化，并把 debounce 秒内连续发生的变化合并为一批"""
+    pending = set()
+    while True:
+        changed = watcher.changes(debounce if pending else None)
+        if changed:
+            pending |= changed
+        elif pending:
+            return pending
+
+class DependencyIndex:
+    """记录每个 HTML 引用的本地资源，资源变化时找出需要重新渲染的页面"""
+
+    def __init__(self):
+        self.assets = {}
+        self.dependents = {}
+
+    def update(self, html_file):
+        html_file = os.path.abspath(html_file)
+        self.remove(html_file)
+        assets = find_local_assets(html_file)
+        self.assets[html_file] = assets
+        for asset in assets:
+            self.dependents.setdefault(asset, set()).add(html_file)
+        return assets
+
+    def remove(self, html_file):
+        for asset in self.assets.pop(html_file, ()):
+            self.dependents.get(asset, set()).discard(html_file)
+
+    def affected(self, changed_paths):
+        """变化的 HTML 本身 + 引用了变化资源的 HTML (已删除的 HTML 不再渲染)"""
+        targets = set()
+        for path in map(os.path.abspath, changed_paths):
+            if path.lower().endswith((".html", ".htm")):
+                if os.path.exists(path):
+                    targets.add(path)
+                else:
+                    self.remove(path)
+            targets |= {html for html in self.dependents.get(path, ()) if os.path.exists(html)}
+        return targets
+
+def watch_and_rebuild(executor, root, recursive, exclude, build_one, debounce=0.2, polling=False, symlinks="files"):
+    """
+    监听模式主循环：文件变化后经过去抖合并，只重新渲染受影响的页面。
+    build_one(html_file) 负责渲染单个文件并返回状态；渲染提交到同一个线程池，复用池中的常驻浏览器。
+    只重新渲染输入集合中的页面 (与首次遍历的规则相同)，资源目录里的其他 HTML 不算。
+    """
+    index = DependencyIndex()
+    html_files = [root] if os.path.isfile(root) else list(collect_files(root, recursive, exclude, symlinks))
+    for f in html_files:
+        index.update(f)
+
+    watch_root = os.path.dirname(os.path.abspath(root)) if os.path.isfile(root) else root
+    asset_dirs = {os.path.dirname(a) for assets in index.assets.values() for a in assets}
+    watcher = make_watcher([(watch_root, recursive and os.path.isdir(root))], polling)
+    for d in asset_dirs:
+        watcher.add_directory(d)
+
+    log(f"👀 [监听] {watch_root} ({type(watcher).__name__}), 按 Ctrl+C 退出")
+    try:
+        while True:
+            changed = next_batch(watcher, debounce)
+            targets = index.affected(changed)
+            if os.path.isfile(root):
+                targets &= {os.path.abspath(root)}
+            else:
+                targets = {t for t in targets if accepts(t, root, HTML_PATTERNS, exclude, recursive, symlinks)}
+            if not targets:
+                continue
+
+            started = time.perf_counter()
+            results = list(executor.map(build_one, sorted(targets)))
+            for t in targets:
+                for d in {os.path.dirname(a) for a in index.update(t)} - asset_dirs:
+                    asset_dirs.add(d)
+                    watcher.add_directory(d)
+            log(f"🔄 [重建] {len(targets)} 个文件, 成功 {results.count('generated')} 个, "
+                f"耗时 {time.perf_counter() - started:.2f}s")
+    except KeyboardInterrupt:
+        log("👋 [监听] 已退出")
+    finally:
+        watcher.close()
+
+# ---------- 运行报告 ----------
+
+def percentile(values, pct):
+    """最近秩法计算百分位数"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, int(-(-pct * len(ordered) // 100)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+def summarize_records(records, wall_time):
+    """汇总吞吐量 (页/秒) 与 p50/p95/p99 延迟"""
+    statuses = {}
+    for record in records:
+        statuses[record.get("status", "failed")] = statuses.get(record.get("status", "failed"), 0) + 1
+    rendered = [r["total_time"] for r in records if r.get("status") == "generated"]
+    return {
+        "files": len(records),
+        "statuses": statuses,
+        "wall_time": wall_time,
+        "pages_per_sec": len(rendered) / wall_time if wall_time > 0 else None,
+        "latency": {name: percentile(rendered, pct) for name, pct in (("p50", 50), ("p95", 95), ("p99", 99))},
+        "queue_wait_p95": percentile([r.get("queue_wait", 0) for r in records], 95),
+        "output_bytes": sum(r.get("output_size", 0) for r in records if r.get("status") == "generated"),
+        "peak_rss": max((r["max_rss"] for r in records if r.get("max_rss")), default=None),
+        "cpu_time": sum(r.get("cpu_user", 0) + r.get("cpu_system", 0) for r in records),
+    }
+
+def write_report(path, records, summary):
+    """.jsonl 每行一个文件记录，最后一行为汇总；其他扩展名写出单个 JSON 对象"""
+    with open(path, "w", encoding="utf-8") as f:
+        if path.lower().endswith(".jsonl"):
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.write(json.dumps({"summary": summary}, ensure_ascii=False) + "\n")
+        else:
+            json.dump({"summary": summary, "files": records}, f, ensure_ascii=False, indent=2)
+
+def read_report(path):
+    """读取 write_report 写出的报告，返回 (记录列表, 汇总)"""
+    with open(path, encoding="utf-8") as f:
+        if path.lower().endswith(".jsonl"):
+            lines = [json.loads(line) for line in f if line.strip()]
+            records = [line for line in lines if "summary" not in line]
+            summary = next((line["summary"] for line in lines if "summary" in line), {})
+            return records, summary
+        data = json.load(f)
+    return data.get("files", []), data.get("summary", {})
+
+class RunReport:
+    """收集每个文件的运行数据，结束时写出 JSON 或 JSONL 报告"""
+
+    def __init__(self, shard=None):
+        self.records = []
+        self.shard = shard
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, record):
+        with self._lock:
+            self.records.append(record)
+
+    def summary(self):
+        summary = summarize_records(self.records, time.perf_counter() - self.started)
+        if self.shard:
+            summary["shard"] = {"index": self.shard[0], "count": self.shard[1]}
+        return summary
+
+    def write(self, path):
+        summary = self.summary()
+        write_report(path, self.records, summary)
+        return summary
+
+# ---------- 分片 ----------
+
+def parse_shard(value):
+    """解析 --shard INDEX/COUNT (INDEX 从 0 开始)"""
+    try:
+        index, count = (int(x) for x in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"格式应为 INDEX/COUNT，例如 0/4: {value}")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"需要满足 0 <= INDEX < COUNT: {value}")
+    return index, count
+
+def shard_key(path, root):
+    """分片依据: 相对于输入目录的路径 (统一为 / 分隔)，不同机器上挂载位置不同也能得到相同结果"""
+    base = root if os.path.isdir(root) else os.path.dirname(os.path.abspath(root))
+    return os.path.relpath(os.path.abspath(path), os.path.abspath(base)).replace("\\", "/")
+
+def shard_of(key, count):
+    """相对路径的稳定哈希取模 (不受 PYTHONHASHSEED 影响)"""
+    return int(hashlib.sha1(key.encode("utf-8")).hexdigest()[:16], 16) % count
+
+def shard_files(files, root, index, count, by_size=False):
+    """
+    只产出属于第 index 个分片的文件，各节点独立计算、无需协调。
+    默认按路径哈希流式分配；by_size 时读取完整列表，按文件大小做确定性的贪心装箱 (大文件优先放入当前最轻的分片)。
+    """
+    if not by_size:
+        for f in files:
+            if shard_of(shard_key(f, root), count) == index:
+                yield f
+        return
+
+    items = sorted(((os.path.getsize(f), shard_key(f, root), f) for f in files), key=lambda t: (-t[0], t[1]))
+    loads = [0] * count
+    for size, _, f in items:
+        target = min(range(count), key=lambda i: (loads[i], i))
+        # 空文件也计 1，避免全部落到同一分片
+        loads[target] += max(size, 1)
+        if target == index:
+            yield f
+
+def merge_reports(paths):
+    """合并各分片的报告：记录直接拼接；总耗时取最慢的分片 (各节点并行运行)"""
+    records, shards, wall_time = [], set(), 0.0
+    count = None
+    for path in paths:
+        part_records, summary = read_report(path)
+        records.extend(part_records)
+        wall_time = max(wall_time, summary.get("wall_time") or 0.0)
+        if summary.get("shard"):
+            shards.add(summary["shard"]["index"])
+            count = summary["shard"]["count"]
+
+    summary = summarize_records(records, wall_time)
+    summary["shards_merged"] = len(paths)
+    if count is not None:
+        summary["missing_shards"] = sorted(set(range(count)) - shards)
+    return records, summary
+
+# ---------- 合并模式 ----------
+
+MERGED_NAME = "merged.pdf"
+
+# 可改写的地址: src/href/poster 属性与 CSS url(...)
+URL_ATTR_PATTERN = re.compile(r"""(\b(?:src|href|poster)\s*=\s*)(["'])(.*?)\2""", re.I | re.S)
+CSS_URL_PATTERN = re.compile(r"""(url\(\s*)(["']?)([^"')]*)\2(\s*\))""", re.I)
+SRCSET_ATTR_PATTERN = re.compile(r"""(\bsrcset\s*=\s*)(["'])(.*?)\2""", re.I | re.S)
+CSS_IMPORT_PATTERN = re.compile(r"""(@import\s+)(["'])([^"']*)\2""", re.I)
+HEAD_PATTERN = re.compile(r"<head\b[^>]*>(.*?)</head\s*>", re.I | re.S)
+BODY_PATTERN = re.compile(r"<body\b[^>]*>(.*?)(?:</body\s*>|\Z)", re.I | re.S)
+HEAD_ASSET_PATTERN = re.compile(r"<style\b.*?</style\s*>|<link\b[^>]*>", re.I | re.S)
+DOCUMENT_SHELL_PATTERN = re.compile(r"<!DOCTYPE[^>]*>|</?html\b[^>]*>|<head\b.*?</head\s*>", re.I | re.S)
+
+def natural_key(path):
+    """自然排序: chapter2 排在 chapter10 之前"""
+    return [int(t) if t.isdigit() else t.lower() for t in re.split(r"(\d+)", path)]
+
+def read_html_text(path):
+    with open(path, "rb") as f:
+        return decode_html(f.read())
+
+def decode_html(raw):
+    """字节解码为文本: 与 cleaner.py 相同，依次按 BOM、<meta charset> 声明、UTF-8、统计识别、GBK 尝试"""
+    if isinstance(raw, str):
+        return raw
+    import cleaner  # 编码识别与清理共用一套实现
+    return cleaner.decode_html(raw)[0]
+
+def inject_base(html, base_url):
+    """插入 <base href>，让相对地址按 base_url 解析"""
+    tag = f'<base href="{base_url}">'
+    head = re.search(r"<head\b[^>]*>", html, re.I)
+    if head:
+        return html[:head.end()] + tag + html[head.end():]
+    return tag + html
+
+def absolutize_urls(html, base_url):
+    """把相对地址改写为基于原文件位置的绝对地址，合并后资源仍能正确加载"""
+    def resolve(url):
+        stripped = url.strip()
+        if not stripped or stripped.startswith(("#", "data:", "javascript:", "mailto:")):
+            return url
+        return urllib.parse.urljoin(base_url, stripped)
+
+    def resolve_srcset(value):
+        # 每个候选项为 "地址 [描述符]"，只改写地址部分
+        candidates = []
+        for candidate in value.split(","):
+            parts = candidate.strip().split(None, 1)
+            if parts:
+                candidates.append(" ".join([resolve(parts[0])] + parts[1:]))
+        return ", ".join(candidates)
+
+    def quoted(resolver):
+        return lambda m: m.group(1) + m.group(2) + resolver(m.group(3)) + m.group(2)
+
+    html = URL_ATTR_PATTERN.sub(quoted(resolve), html)
+    html = SRCSET_ATTR_PATTERN.sub(quoted(resolve_srcset), html)
+    html = CSS_IMPORT_PATTERN.sub(quoted(resolve), html)
+    return CSS_URL_PATTERN.sub(lambda m: m.group(1) + m.group(2) + resolve(m.group(3)) + m.group(2) + m.group(4), html)
+
+def build_merged_html(files):
+    """合并多个 HTML：保留各自的样式表，相对地址转为绝对地址，文档之间强制分页"""
+    heads, sections = [], []
+    for i, path in enumerate(files):
+        text = absolutize_urls(read_html_text(path), file_url_for(path))
+
+        head = HEAD_PATTERN.search(text)
+        if head:
+            heads.extend(HEAD_ASSET_PATTERN.findall(head.group(1)))
+        body = BODY_PATTERN.search(text)
+        content = body.group(1) if body else DOCUMENT_SHELL_PATTERN.sub("", text)
+
+        page_break = "" if i == 0 else ' style="break-before: page; page-break-before: always"'
+        sections.append(f'<div class="html2pdf-document" data-source="{escape(os.path.basename(path), quote=True)}"{page_break}>\n'
+                        f"{content}\n</div>")
+
+    return ("<!DOCTYPE html>\n<html>\n<head>\n<meta charset=\"utf-8\">\n" + "\n".join(heads) +
+            "\n</head>\n<body>\n" + "\n".join(sections) + "\n</body>\n</html>\n")
+
+def merge_and_convert(browser, files, output_file, force_overwrite=False, pool=None, timeout=None, browser_args=None,
+                      retries=0, metrics=None):
+    """
+    把所有文件合并为一个临时 HTML，仅渲染一次得到单个 PDF；返回状态 generated / skipped / failed。
+    失败时按 retries 重试；传入 metrics 字典时记录本次渲染的运行数据 (input 为全部源文件)。
+    """
+    files = sorted(files, key=natural_key)
+    if os.path.exists(output_file) and not force_overwrite:
+        log(f"⏭️  [跳过] 文件已存在: {os.path.basename(output_file)}")
+        return "skipped"
+    fd, merged_path = tempfile.mkstemp(prefix="html2pdf-merged-", suffix=".html")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(build_merged_html(files))
+        log(f"📚 [合并] {len(files)} 个文件 -> {os.path.basename(output_file)}")
+        return convert_one(browser, merged_path, output_file, force_overwrite, pool,
+                           policy=RetryPolicy(timeout, retries), metrics=metrics, browser_args=browser_args)
+    finally:
+        os.remove(merged_path)
+        if metrics is not None:
+            metrics["input"] = files
+
 # ===========================
-# 3. 主流程
+# 3. 编程接口
 # ===========================
 
+def _split_document(document, base_url):
+    """文档可以是 str/bytes，或 (html, base_url) / (html, base_url, out) 元组"""
+    if isinstance(document, tuple):
+        html, doc_base, out = (tuple(document) + (None, None))[:3]
+        return decode_html(html), doc_base or base_url, out
+    return decode_html(document), base_url, None
+
+def _convert_html_cli(browser, html, base_url, timeout, browser_args, stats=None):
+    """
+    命令行引擎只能读写文件: HTML 写在系统临时目录，相对资源靠注入的 <base> 按 base_url 解析。
+    不写进源目录，否则会被同时进行的文件遍历当作待转换的输入。
+    """
+    if base_url:
+        html = inject_base(html, base_url)
+    fd, html_path = tempfile.mkstemp(prefix="html2pdf-", suffix=".html")
+    pdf_path = html_path[:-5] + ".pdf"
+    try:
+        # 带 BOM 写出: BOM 的优先级高于页面中保留的 <meta charset="gbk"> 等声明，浏览器按 UTF-8 解码
+        with os.fdopen(fd, "w", encoding="utf-8-sig") as f:
+            f.write(html)
+        cmd = [browser, "--headless", "--disable-gpu", f"--print-to-pdf={pdf_path}", "--no-pdf-header-footer",
+               *(browser_args or []), file_url_for(html_path)]
+        res = run_browser(cmd, timeout, stats)
+        if res.returncode != 0 or not os.path.exists(pdf_path):
+            raise RuntimeError(f"转换失败: {res.stderr.decode('utf-8', errors='replace')}")
+        with open(pdf_path, "rb") as f:
+            return f.read()
+    finally:
+        for path in (html_path, pdf_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+def convert_many(documents, base_url=None, browser=None, engine="cdp", timeout=120, offline=False,
+                 asset_cache=None, recycle_after=100, return_exceptions=False):
+    """
+    把内存中的 HTML 批量转换为 PDF，返回生成器，按输入顺序逐个产出结果。
+
+    documents : 可迭代对象，元素为 str/bytes，或 (html, base_url) / (html, base_url, out) 元组
+    base_url  : 默认的基准地址 (如 file:///data/article/)，用于解析相对资源
+    engine    : cdp 整批共用一个常驻浏览器且不产生临时文件; cli 每个文档启动一次浏览器 (需要临时文件)
+    产出值    : 未指定 out 时为 PDF 字节；指定 out (可写的二进制文件对象) 时流式写入并产出 out 本身
+    出错时    : 默认异常直接抛出，整批随之结束；return_exceptions=True 时在该文档的位置产出异常对象，继续处理后续文档
+    找不到浏览器时抛出 FileNotFoundError。
+    """
+    browser = locate_browser(browser)
+    if not browser:
+        raise FileNotFoundError("未找到浏览器，请通过 browser 参数指定路径")
+    browser_args = OFFLINE_BROWSER_ARGS if offline or asset_cache else None
+
+    if engine != "cdp":
+        for document in documents:
+            html, doc_base, out = _split_document(document, base_url)
+            try:
+                pdf = _convert_html_cli(browser, html, doc_base, timeout, browser_args)
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                yield e
+                continue
+            if out is None:
+                yield pdf
+            else:
+                out.write(pdf)
+                yield out
+        return
+
+    session = DevToolsSession(browser, recycle_after, page_timeout=timeout, offline=offline, asset_cache=asset_cache)
+    try:
+        for document in documents:
+            html, doc_base, out = _split_document(document, base_url)
+            try:
+                pdf = session.print_html(html, doc_base, out)
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                # 会话可能已损坏，关闭后由下一个文档重新启动浏览器
+                session.close()
+                yield e
+                continue
+            yield pdf if out is None else out
+    finally:
+        session.close()
+
+def convert_html(html, base_url=None, out=None, **options):
+    """转换单个 HTML 字符串；指定 out 时流式写入并返回 None，否则返回 PDF 字节。其余参数同 convert_many"""
+    with contextlib.closing(convert_many([(html, base_url, out)], **options)) as results:
+        result = next(results)
+    return None if out is not None else result
+
+# ===========================
+# 4. 主流程
+# ===========================
+
+def render_options(args, browser):
+    """影响 PDF 输出结果的渲染选项，参与增量构建的哈希"""
+    options = {"browser": os.path.basename(browser), "engine": args.engine, "offline": args.offline,
+               "asset_cache": os.path.abspath(args.asset_cache) if args.asset_cache else None}
+    if args.clean:
+        options["clean"] = sorted(args.clean)
+    return options
+
 def main():
     parser = argparse.ArgumentParser(
         description="HTML 转 PDF 工具 (基于浏览器内核)",
@@ -133,46 +1700,236 @@ def main():
     parser.add_argument("-o", "--output", help="指定输出文件名 (仅当输入为单文件时有效)")
     parser.add_argument("-d", "--output-dir", help="指定输出目录 (批量处理时推荐)")
     parser.add_argument("-r", "--recursive", action="store_true", help="递归搜索子目录")
+    parser.add_argument("-x", "--exclude", action="append", default=[], help="排除匹配的文件或目录 (可重复指定)")
+    parser.add_argument("--symlinks", choices=SYMLINK_POLICIES, default="files",
+                        help="符号链接策略: skip 忽略; files 仅跟随文件链接; all 同时跟随目录链接 (默认: files)")
     parser.add_argument("-f", "--force", action="store_true", help="强制覆盖已存在的输出文件")
     parser.add_argument("--browser-path", help="手动指定浏览器可执行文件路径")
     parser.add_argument("--edge", action="store_true", help="优先使用 Microsoft Edge")
+    parser.add_argument("--engine", choices=["cli", "cdp"], default=None,
+                        help="渲染引擎: cli 每个文件启动一次浏览器; cdp 通过 DevTools 协议复用常驻浏览器 (默认: cli; 使用 --watch 或 --asset-cache 时为 cdp)")
+    parser.add_argument("--recycle-after", type=int, default=100, help="cdp 引擎每打印多少页重启一次浏览器 (默认: 100)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="按内容哈希增量构建: 仅重新渲染 HTML、本地资源或渲染选项有变化的文件")
+    parser.add_argument("--prune", action="store_true", help="配合 --incremental: 删除源 HTML 已不存在的旧 PDF")
+    parser.add_argument("--timeout", type=float, default=120, help="单页渲染超时秒数, 超时的页面按失败处理, 0 表示不限制 (默认: 120)")
+    parser.add_argument("--retries", type=int, default=1, help="失败后的重试次数, 采用有界指数退避 (默认: 1)")
+    parser.add_argument("--quarantine", help="隔离名单文件: 重试后仍失败的页面追加到此文件, 之后的运行直接跳过")
+    parser.add_argument("--merge", action="store_true",
+                        help=f"合并模式: 所有 HTML 按文件名自然顺序合并为一个 PDF (-o 指定文件名, 默认 {MERGED_NAME}; "
+                             "不能与 --incremental / --quarantine 同时使用)")
+    parser.add_argument("--report",
+                        help="写出运行报告 (扩展名为 .jsonl 时逐行输出，否则为 JSON; 路径中的 {shard} 替换为分片序号)")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="按可用内存与实测单页内存动态调整并发 (在 --min-jobs 与 --max-jobs 之间, 忽略 -j)")
+    parser.add_argument("--min-jobs", type=int, default=1, help="自适应并发下限 (默认: 1)")
+    parser.add_argument("--max-jobs", type=int, default=os.cpu_count() or 1, help="自适应并发上限 (默认: CPU 核数)")
+    parser.add_argument("--mem-reserve", type=int, default=1024, help="自适应模式为系统保留的可用内存 MB (默认: 1024)")
+    parser.add_argument("--render-rss", type=int, default=300,
+                        help="单页内存的初始估计 MB, 运行中按实测值修正 (默认: 300)")
+    parser.add_argument("--watch", action="store_true",
+                        help="处理完成后持续监听变化, 只重新渲染改动的 HTML 及引用了改动资源的页面 (使用 cdp 常驻浏览器)")
+    parser.add_argument("--debounce", type=float, default=0.2, help="监听模式下合并连续保存的等待秒数 (默认: 0.2)")
+    parser.add_argument("--poll", action="store_true", help="监听模式强制使用轮询 (默认优先 inotify)")
+    parser.add_argument("--shard", type=parse_shard,
+                        help="只处理第 INDEX 个分片, 格式 INDEX/COUNT (INDEX 从 0 开始), 按相对路径稳定哈希分配")
+    parser.add_argument("--shard-by-size", action="store_true",
+                        help="配合 --shard: 按文件大小均衡分配 (需要先遍历完整目录树)")
+    parser.add_argument("--offline", "--block-remote", dest="offline", action="store_true",
+                        help="离线渲染: 屏蔽所有非 file:// 的网络请求")
+    parser.add_argument("--asset-cache",
+                        help="远程资源的本地缓存目录 (<目录>/<域名>/<路径>)，命中则直接返回，未命中则屏蔽 (隐含 --offline, 使用 cdp 引擎)")
+    parser.add_argument("--clean", action="append", default=[], metavar="SELECTOR",
+                        help="渲染前在内存中移除匹配 CSS 选择器的元素 (可重复指定; 不作用于合并模式)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="并发转换数 (默认: CPU 核数)")
 
     args = parser.parse_args()
+    # 监听模式依赖常驻浏览器来保证秒级响应；远程地址映射到本地缓存需要拦截请求，只有 cdp 引擎能做到
+    needs_cdp = [option for option, used in (("--watch", args.watch), ("--asset-cache", args.asset_cache)) if used]
+    if needs_cdp and args.engine == "cli":
+        parser.error(f"{' 与 '.join(needs_cdp)} 需要 cdp 引擎，不能与 --engine cli 同时使用")
+    if needs_cdp:
+        args.engine = "cdp"
+    elif args.engine is None:
+        args.engine = "cli"
+    if args.prune and not args.incremental:
+        parser.error("--prune 需要与 --incremental 同时使用")
+    if args.shard_by_size and not args.shard:
+        parser.error("--shard-by-size 需要与 --shard 同时使用")
+    if args.merge:
+        # 合并后只有一个输出: 按单个源文件记录的增量清单与隔离名单无从对应
+        conflicts = [option for option, used in (("--incremental", args.incremental), ("--quarantine", args.quarantine))
+                     if used]
+        if conflicts:
+            parser.error(f"--merge 不能与 {' / '.join(conflicts)} 同时使用")
+    if args.asset_cache:
+        args.offline = True
+    # 命令行引擎只能整体屏蔽远程请求；cdp 回退到命令行模式时同样生效
+    browser_args = OFFLINE_BROWSER_ARGS if args.offline else None
 
     browser = find_browser_executable(args.browser_path, args.edge)
-    files_to_process = collect_files(args.input, args.recursive)
-    
-    if not files_to_process:
+    files_iter = iter(collect_files(args.input, args.recursive, args.exclude, args.symlinks))
+    if args.shard:
+        files_iter = shard_files(files_iter, args.input, args.shard[0], args.shard[1], args.shard_by_size)
+        if args.report:
+            args.report = args.report.replace("{shard}", str(args.shard[0]))
+
+    # 只预读前两个文件判断是否为多文件输入，其余边遍历边提交
+    head = list(itertools.islice(files_iter, 2))
+    if not head:
         print("未找到 HTML 文件。")
         return
 
+    if args.merge:
+        # 合并模式需要完整的文件列表来确定顺序
+        timeout = args.timeout or None
+        output_dir = args.output_dir or (args.input if os.path.isdir(args.input) else os.path.dirname(head[0]))
+        output_file = args.output or os.path.join(output_dir, MERGED_NAME)
+        devtools = None
+        if args.engine == "cdp":
+            devtools = DevToolsPool(browser, page_timeout=timeout, offline=args.offline, asset_cache=args.asset_cache)
+        report = RunReport(args.shard) if args.report else None
+        metrics = None
+        if report:
+            metrics = {"submitted_at": time.perf_counter()}
+            report.add(metrics)
+        try:
+            status = merge_and_convert(browser, list(itertools.chain(head, files_iter)), output_file,
+                                       args.force, devtools, timeout, browser_args, args.retries, metrics)
+        finally:
+            if devtools:
+                devtools.close()
+        if report:
+            report.write(args.report)
+            print(f"📊 运行报告已写入 {args.report}")
+        if status == "skipped":
+            print(f"\n⏭️  合并已跳过 (文件已存在，添加 -f 覆盖): {output_file}")
+        else:
+            print(f"\n✨ 合并{'完成' if status == 'generated' else '失败'}: {output_file}")
+        return
+
     effective_output_name = args.output
-    if len(files_to_process) > 1 and args.output:
+    if len(head) > 1 and args.output:
         print("⚠️  [警告] 检测到多文件输入，已忽略 -o/--output 参数 (请使用 -d 指定输出目录)。")
         effective_output_name = None
 
-    print(f"🚀 开始处理 {len(files_to_process)} 个文件 (覆盖模式: {'开启' if args.force else '关闭'})...")
+    limiter = None
+    if args.adaptive:
+        limiter = AdaptiveLimiter(args.min_jobs, args.max_jobs, args.mem_reserve * MB, args.render_rss * MB)
+        jobs = limiter.ceiling
+        jobs_text = f"自适应 {limiter.floor}~{limiter.ceiling}"
+        if args.engine == "cdp" and process_tree_rss(os.getpid()) is None:
+            print("⚠️  [警告] 无法测量常驻浏览器的内存 (需要 psutil 或 /proc)，自适应并发只按系统可用内存调整。")
+    else:
+        jobs = max(1, args.jobs)
+        jobs_text = str(jobs)
+    print(f"🚀 开始处理 (覆盖模式: {'开启' if args.force else '关闭'}, 并发: {jobs_text})...")
 
     count = 0
     skipped = 0
-    
-    for f in files_to_process:
-        target = calculate_output_path(f, effective_output_name, args.output_dir)
-        
-        abs_target = os.path.abspath(target)
-        is_existing = os.path.exists(abs_target)
-        
-        result = run_conversion(browser, f, target, args.force)
-        
-        if result:
-            if is_existing and not args.force:
-                skipped += 1
-            else:
-                count += 1
+    quarantined = 0
+    failures = []
+
+    def tally(future, f):
+        nonlocal count, skipped, quarantined
+        try:
+            status = future.result()
+        except Exception as e:
+            log(f"❌ [异常] {os.path.basename(f)}: {e}")
+            status = "failed"
+
+        if status == "generated":
+            count += 1
+        elif status == "skipped":
+            skipped += 1
+        elif status == "quarantined":
+            quarantined += 1
+        else:
+            failures.append(f)
+
+    policy = RetryPolicy(args.timeout, args.retries, args.quarantine)
+    devtools = None
+    if args.engine == "cdp":
+        devtools = DevToolsPool(browser, max(1, args.recycle_after), policy.timeout, args.offline, args.asset_cache)
+
+    report = RunReport(args.shard) if args.report else None
+
+    manifest = None
+    if args.incremental:
+        first_target = calculate_output_path(head[0], effective_output_name, args.output_dir)
+        manifest = BuildManifest(manifest_directory(args.input, args.output_dir, first_target),
+                                 render_options(args, browser))
+
+    # 清理流水线: 单独的线程提前清理后续文件，渲染线程取用结果，两段重叠进行
+    selector = ", ".join(args.clean)
+    cleaning = ThreadPoolExecutor(max_workers=1) if selector else None
+
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            # 限制排队中的任务数，避免海量文件时一次性占满内存 (同时限制了已清理、待渲染的内容数量)
+            pending = {}
+            for f in itertools.chain(head, files_iter):
+                if len(pending) >= jobs * 2:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        tally(future, pending.pop(future))
+                target = calculate_output_path(f, effective_output_name, args.output_dir)
+                metrics = None
+                if report:
+                    metrics = {"submitted_at": time.perf_counter()}
+                    report.add(metrics)
+                load_html = None
+                if selector:
+                    if manifest is None and not policy.is_quarantined(f) and (args.force or not os.path.exists(target)):
+                        # 确定要渲染的文件才提前清理
+                        load_html = cleaning.submit(clean_for_render, f, selector).result
+                    else:
+                        # 可能被跳过的文件 (增量清单、已存在、已隔离) 在跳过判断之后再清理
+                        load_html = functools.partial(clean_for_render, f, selector)
+                pending[executor.submit(convert_one, browser, f, target, args.force, devtools, manifest, policy,
+                                        metrics, limiter, browser_args, load_html)] = f
+
+            for future in list(pending):
+                tally(future, pending.pop(future))
+
+            if args.watch:
+                def build_one(f):
+                    target = calculate_output_path(f, effective_output_name, args.output_dir)
+                    load_html = (lambda: clean_for_render(f, selector)) if selector else None
+                    return convert_one(browser, f, target, True, devtools, manifest, policy, None, limiter,
+                                       browser_args, load_html)
+                watch_and_rebuild(executor, args.input, args.recursive, args.exclude, build_one,
+                                  args.debounce, args.poll, args.symlinks)
+    finally:
+        if cleaning:
+            cleaning.shutdown(cancel_futures=True)
+        if devtools:
+            devtools.close()
+        if manifest:
+            if args.prune:
+                for removed in manifest.prune():
+                    log(f"🗑️  [清理] 源文件已删除: {removed}")
+            manifest.save()
+        policy.save()
+
+    if report:
+        summary = report.write(args.report)
+        pages_per_sec = summary["pages_per_sec"] or 0
+        latency = summary["latency"]
+        print(f"📊 运行报告已写入 {args.report}: {pages_per_sec:.2f} 页/秒, "
+              f"p50 {latency['p50'] or 0:.2f}s / p95 {latency['p95'] or 0:.2f}s / p99 {latency['p99'] or 0:.2f}s")
 
-    print(f"\n✨ 全部结束: 实际处理 {count} 个, 跳过 {skipped} 个")
+    print(f"\n✨ 全部结束: 实际处理 {count} 个, 跳过 {skipped} 个, 失败 {len(failures)} 个")
     if skipped > 0:
         print("   (提示: 若需重新生成已跳过的文件，请添加 -f 参数)")
+    if quarantined:
+        print(f"🚫 已隔离跳过 {quarantined} 个 (隔离名单: {args.quarantine})")
+    if failures:
+        print("❌ 以下文件转换失败:")
+        for f in sorted(failures):
+            print(f"   - {f}")
+    if policy.newly_quarantined:
+        print(f"🚫 新增隔离 {len(policy.newly_quarantined)} 个，已写入 {args.quarantine}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,32 @@
+import argparse
+
+from html2pdf import merge_reports, write_report
+
+# ================= 配置文档 =================
+USAGE_EXAMPLES = """
+使用示例 (Examples):
+
+  合并各分片 (html2pdf.py --shard i/N --report ...) 的报告, 重新计算总吞吐量与延迟分位数:
+     python merge_reports.py run-0.json run-1.json run-2.json run-3.json -o run.json
+"""
+# ===========================================
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="合并 html2pdf 分片运行报告",
+        epilog=USAGE_EXAMPLES,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("reports", nargs="+", help="各分片的报告文件 (.json 或 .jsonl)")
+    parser.add_argument("-o", "--output", required=True, help="合并后的报告路径 (.jsonl 时逐行输出)")
+    args = parser.parse_args()
+
+    records, summary = merge_reports(args.reports)
+    write_report(args.output, records, summary)
+
+    print(f"📊 已合并 {len(args.reports)} 份报告, 共 {summary['files']} 个文件 -> {args.output}")
+    if summary.get("missing_shards"):
+        print(f"⚠️  [警告] 缺少分片: {', '.join(map(str, summary['missing_shards']))}")
+
+if __name__ == "__main__":
+    main()
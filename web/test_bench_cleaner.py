@@ -0,0 +1,94 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+import bench_cleaner
+
+class TestBenchHarness(unittest.TestCase):
+    """测试基准工具本身 (小规模)"""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_generate_corpus(self):
+        """测试合成语料的文件数、大小范围、编码比例与命中比例"""
+        root = os.path.join(self.test_dir, "corpus")
+        corpus = bench_cleaner.generate_corpus(root, files=20, depth=2, fanout=2, min_kb=1, max_kb=64,
+                                               gbk_ratio=0.25, match_rate=0.5)
+        self.assertEqual((corpus["files"], corpus["gbk"], corpus["matched"]), (20, 5, 10))
+        paths = [os.path.join(d, f) for d, _, files in os.walk(root) for f in files]
+        self.assertEqual(len(paths), 20)
+        self.assertEqual(sum(os.path.getsize(p) for p in paths), corpus["bytes"])
+        gbk = matched = 0
+        for path in paths:
+            with open(path, 'rb') as f:
+                raw = f.read()
+            self.assertLess(len(raw), 65 * 1024)
+            if b'charset="gbk"' in raw:
+                gbk += 1
+                raw.decode('gbk')
+            else:
+                raw.decode('utf-8')
+            if b'class="ad-banner"' in raw:
+                matched += 1
+                self.assertEqual(raw.count(b'class="ad-banner"'), bench_cleaner.ADS_PER_FILE)
+        self.assertEqual((gbk, matched), (5, 10))
+
+    def test_generate_corpus_deterministic(self):
+        """测试相同种子生成相同语料"""
+        a = bench_cleaner.generate_corpus(os.path.join(self.test_dir, "a"), files=5, max_kb=8, seed=3)
+        b = bench_cleaner.generate_corpus(os.path.join(self.test_dir, "b"), files=5, max_kb=8, seed=3)
+        self.assertEqual(a, b)
+
+    def test_run_benchmarks(self):
+        """测试完整跑一遍小规模基准，结果结构完整"""
+        results = bench_cleaner.run_benchmarks(files=6, depth=2, max_kb=8, parsers=("html.parser",),
+                                               jobs_levels=(1, 2))
+        self.assertEqual([(r["parser"], r["jobs"]) for r in results["end_to_end"]],
+                         [("html.parser", 1), ("html.parser", 2)])
+        row = results["end_to_end"][0]
+        self.assertEqual(row["statuses"], {"cleaned": 3, "skipped": 3})
+        self.assertGreater(row["files_per_sec"], 0)
+        self.assertGreater(row["mb_per_sec"], 0)
+        self.assertIn("parse", row["timings"])
+        if os.name == "posix":
+            self.assertGreater(row["peak_rss"], 0)
+
+    def test_compare_detects_regression(self):
+        """测试与基线对比时识别吞吐量下降与内存上升"""
+        row = {"parser": "lxml", "jobs": 1, "files_per_sec": 100, "mb_per_sec": 10, "peak_rss": 1000}
+        baseline = {"end_to_end": [row, dict(row, jobs=4)]}
+        current = {"end_to_end": [dict(row, files_per_sec=95), dict(row, jobs=4, mb_per_sec=5, peak_rss=2000),
+                                  dict(row, parser="direct", files_per_sec=1)]}
+        regressions = bench_cleaner.compare(current, baseline, tolerance=0.1)
+        self.assertEqual([r["metric"] for r in regressions],
+                         ["end_to_end[lxml, jobs=4].mb_per_sec", "end_to_end[lxml, jobs=4].peak_rss"])
+
+    def test_compare_refuses_different_corpus(self):
+        """测试语料参数不同的基线拒绝对比"""
+        row = {"parser": "lxml", "jobs": 1, "files_per_sec": 100, "mb_per_sec": 10, "peak_rss": 1000}
+        baseline = {"params": {"files": 200, "seed": 0}, "end_to_end": [row]}
+        current = {"params": {"files": 2000, "seed": 0}, "end_to_end": [dict(row, files_per_sec=10)]}
+        with self.assertRaises(ValueError) as cm:
+            bench_cleaner.compare(current, baseline)
+        self.assertIn("files=200 -> 2000", str(cm.exception))
+        self.assertEqual(bench_cleaner.differences({"environment": {"python": "3.12"}},
+                                                   {"environment": {"python": "3.11"}}, "environment"), ["python"])
+
+    def test_compare_different_parsers_and_jobs(self):
+        """测试解析器与并发级别不同的基线仍可对比，只对比两次都有的条目"""
+        lxml = {"parser": "lxml", "jobs": 1, "files_per_sec": 100, "mb_per_sec": 10, "peak_rss": 1000}
+        parser = dict(lxml, parser="html.parser")
+        baseline = {"params": {"files": 200, "seed": 0, "parsers": ["html.parser", "lxml"], "jobs": [1, 4]},
+                    "end_to_end": [parser, lxml, dict(lxml, jobs=4)]}
+        current = {"params": {"files": 200, "seed": 0, "parsers": ["lxml"], "jobs": [1, 8]},
+                   "end_to_end": [dict(lxml, files_per_sec=50), dict(lxml, jobs=8, files_per_sec=1)]}
+        regressions = bench_cleaner.compare(current, baseline)
+        self.assertEqual([r["metric"] for r in regressions], ["end_to_end[lxml, jobs=1].files_per_sec"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+import os
+import shutil
+import subprocess
+import tempfile
+
+import bench_html2pdf
+
+class TestBenchHarness(unittest.TestCase):
+    """测试基准工具本身 (小规模)"""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_generate_tree(self):
+        """测试合成目录树的文件数与层数"""
+        root = bench_html2pdf.generate_tree(os.path.join(self.test_dir, "tree"), files=30, depth=3, fanout=2)
+        paths = [os.path.join(d, f) for d, _, files in os.walk(root) for f in files]
+        self.assertEqual(len(paths), 30)
+        self.assertTrue(any(os.path.relpath(p, root).count(os.sep) == 2 for p in paths))
+
+    @unittest.skipUnless(os.name == "posix", "浏览器桩依赖 shebang")
+    def test_stub_browser_writes_pdf(self):
+        """测试浏览器桩按 --print-to-pdf 写出 PDF"""
+        browser = bench_html2pdf.write_stub_browser(self.test_dir, latency=0)
+        out = os.path.join(self.test_dir, "out.pdf")
+        subprocess.run([browser, "--headless", f"--print-to-pdf={out}", "file:///x.html"], check=True)
+        with open(out, 'rb') as f:
+            self.assertTrue(f.read().startswith(b"%PDF"))
+
+    @unittest.skipUnless(os.name == "posix", "浏览器桩依赖 shebang")
+    def test_run_benchmarks(self):
+        """测试完整跑一遍小规模基准，结果结构完整"""
+        results = bench_html2pdf.run_benchmarks(files=8, depth=2, latency=0, jobs_levels=(1, 2))
+        self.assertEqual(results["discovery"]["files"], 8)
+        self.assertEqual([r["jobs"] for r in results["scheduling"]], [1, 2])
+        self.assertEqual(len(results["end_to_end"]), 2)
+        self.assertGreater(results["end_to_end"][0]["files_per_sec"], 0)
+
+    def test_compare_detects_regression(self):
+        """测试与基线对比时识别吞吐量下降"""
+        baseline = {"discovery": {"files_per_sec": 1000}, "scheduling": [{"jobs": 4, "files_per_sec": 100}]}
+        current = {"discovery": {"files_per_sec": 990}, "scheduling": [{"jobs": 4, "files_per_sec": 50}]}
+        regressions = bench_html2pdf.compare(current, baseline, tolerance=0.1)
+        self.assertEqual([r["metric"] for r in regressions], ["scheduling[jobs=4].files_per_sec"])
+
+    def test_compare_refuses_different_workload(self):
+        """测试负载参数不同的基线拒绝对比，并发档位不同则只对比共有的档位"""
+        row = {"jobs": 4, "files_per_sec": 100}
+        params = {"files": 500, "depth": 3, "latency": 0.02, "size_kb": 4, "jobs": [1, 4]}
+        baseline = {"params": params, "discovery": {"files_per_sec": 1000}, "scheduling": [row]}
+        current = {"params": dict(params, latency=0.2), "discovery": {"files_per_sec": 1000},
+                   "scheduling": [dict(row, files_per_sec=10)]}
+        with self.assertRaises(ValueError) as cm:
+            bench_html2pdf.compare(current, baseline)
+        self.assertIn("latency=0.02 -> 0.2", str(cm.exception))
+
+        current["params"] = dict(params, jobs=[4, 16])
+        regressions = bench_html2pdf.compare(current, baseline)
+        self.assertEqual([r["metric"] for r in regressions], ["scheduling[jobs=4].files_per_sec"])
+
+if __name__ == '__main__':
+    unittest.main()
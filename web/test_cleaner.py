@@ -3,13 +3,19 @@ import os
 import sys
 import shutil
 import tempfile
-from unittest.mock import patch
+import codecs
+import json
+import io
+import contextlib
+import importlib.util
+from unittest.mock import patch, MagicMock
 from bs4 import BeautifulSoup
 
 # 导入我们要测试的模块
 import cleaner
 
 class TestHTMLCleaner(unittest.TestCase):
+    PARSER = "html.parser"
 
     def setUp(self):
         """每个测试运行前执行：创建临时目录和测试文件"""
@@ -53,7 +59,7 @@ class TestHTMLCleaner(unittest.TestCase):
         target_selector = "#remove-me"
         
         # 模拟命令行参数: cleaner.py -i [dir] -s "#remove-me"
-        test_args = ['cleaner.py', '-i', self.test_dir, '-s', target_selector]
+        test_args = ['cleaner.py', '--parser', self.PARSER, '-i', self.test_dir, '-s', target_selector]
         
         with patch.object(sys, 'argv', test_args):
             cleaner.main()
@@ -71,7 +77,7 @@ class TestHTMLCleaner(unittest.TestCase):
         output_dir = os.path.join(self.test_dir, "output")
         
         # 模拟命令行参数: cleaner.py -i [dir] -o [out_dir] -s ".ad-banner"
-        test_args = ['cleaner.py', '-i', self.test_dir, '-o', output_dir, '-s', target_selector]
+        test_args = ['cleaner.py', '--parser', self.PARSER, '-i', self.test_dir, '-o', output_dir, '-s', target_selector]
         
         with patch.object(sys, 'argv', test_args):
             cleaner.main()
@@ -97,7 +103,7 @@ class TestHTMLCleaner(unittest.TestCase):
         # 获取修改前的时间戳
         original_mtime = os.path.getmtime(self.html_utf8)
         
-        test_args = ['cleaner.py', '-i', self.test_dir, '-s', target_selector]
+        test_args = ['cleaner.py', '--parser', self.PARSER, '-i', self.test_dir, '-s', target_selector]
         
         with patch.object(sys, 'argv', test_args):
             cleaner.main()
@@ -112,7 +118,7 @@ class TestHTMLCleaner(unittest.TestCase):
     def test_input_dir_not_exist(self):
         """测试 4: 输入目录不存在的情况"""
         fake_dir = os.path.join(self.test_dir, "does_not_exist")
-        test_args = ['cleaner.py', '-i', fake_dir, '-s', 'div']
+        test_args = ['cleaner.py', '--parser', self.PARSER, '-i', fake_dir, '-s', 'div']
         
         # 我们捕获 stdout 来检查是否打印了错误信息，或者确保程序没有崩溃
         with patch.object(sys, 'argv', test_args):
@@ -133,7 +139,7 @@ class TestHTMLCleaner(unittest.TestCase):
             <p>Keep me</p>
             """)
             
-        test_args = ['cleaner.py', '-i', self.test_dir, '-s', 'div.wrapper > p', '-p', 'complex.html']
+        test_args = ['cleaner.py', '--parser', self.PARSER, '-i', self.test_dir, '-s', 'div.wrapper > p', '-p', 'complex.html']
         
         with patch.object(sys, 'argv', test_args):
             cleaner.main()
@@ -147,5 +153,724 @@ class TestHTMLCleaner(unittest.TestCase):
         # 检查外面的 p 还在
         self.assertIsNotNone(soup.find(string="Keep me"))
 
+    def test_recursive_keeps_structure(self):
+        """测试 6: 递归处理子目录，输出目录保持原有结构，且不会重复处理输出目录"""
+        sub_dir = os.path.join(self.test_dir, "sub")
+        os.mkdir(sub_dir)
+        nested = os.path.join(sub_dir, "nested.html")
+        with open(nested, 'w', encoding='utf-8') as f:
+            f.write('<div id="remove-me">x</div><p>keep</p>')
+        output_dir = os.path.join(self.test_dir, "output")
+
+        test_args = ['cleaner.py', '--parser', self.PARSER, '-i', self.test_dir, '-o', output_dir, '-r', '-s', '#remove-me']
+        with patch.object(sys, 'argv', test_args):
+            cleaner.main()
+
+        out_nested = os.path.join(output_dir, "sub", "nested.html")
+        self.assertTrue(os.path.exists(out_nested))
+        self.assertTrue(os.path.exists(os.path.join(output_dir, "test_utf8.html")))
+        self.assertFalse(os.path.exists(os.path.join(output_dir, "output")))
+        with open(out_nested, 'r', encoding='utf-8') as f:
+            self.assertNotIn("remove-me", f.read())
+
+    def test_clean_html_in_memory(self):
+        """测试 7: clean_html 在内存中清理，返回移除数量，未匹配时原样返回"""
+        html = '<div class="ad">x</div><div class="ad">y</div><p>keep</p>'
+        cleaned, count = cleaner.clean_html(html, ".ad", self.PARSER)
+        self.assertEqual(count, 2)
+        self.assertNotIn('class="ad"', cleaned)
+        self.assertIn("<p>keep</p>", cleaned)
+        if self.PARSER == "html.parser":
+            self.assertEqual(cleaned, "<p>keep</p>")
+        self.assertEqual(cleaner.clean_html(html, "#none", self.PARSER), (html, 0))
+
+    def test_parallel_jobs_in_order(self):
+        """测试 8: -j 多进程处理，结果与单进程一致且按文件顺序输出，汇总计数"""
+        for i in range(40):
+            with open(os.path.join(self.test_dir, f"bulk_{i:02d}.html"), 'w', encoding='utf-8') as f:
+                f.write(f'<div id="remove-me">{i}</div><p>{i}</p>' if i % 2 else f'<p>{i}</p>')
+        output_dir = os.path.join(self.test_dir, "output")
+
+        def run(jobs):
+            shutil.rmtree(output_dir, ignore_errors=True)
+            buf = io.StringIO()
+            test_args = ['cleaner.py', '--parser', self.PARSER, '-i', self.test_dir, '-o', output_dir, '-s', '#remove-me', '-j', str(jobs), '-v']
+            with patch.object(sys, 'argv', test_args), contextlib.redirect_stdout(buf):
+                cleaner.main()
+            return buf.getvalue(), sorted(os.listdir(output_dir))
+
+        serial_out, serial_files = run(1)
+        parallel_out, parallel_files = run(3)
+        self.assertEqual(parallel_out, serial_out)
+        self.assertEqual(parallel_files, serial_files)
+        # 20 个奇数文件 + test_utf8.html 被清理；其余 22 个跳过
+        self.assertIn("共 43 个文件: 清理 21 个, 跳过 22 个, 失败 0 个", parallel_out)
+
+    def test_multiple_selectors_and_rules_file(self):
+        """测试 9: 多个 -s 与规则文件在一次解析中全部应用，结束时按规则汇总"""
+        page = os.path.join(self.test_dir, "page.html")
+        with open(page, 'w', encoding='utf-8') as f:
+            f.write('<div class="ad">a</div><div class="share">s</div><div id="comments">c</div>'
+                    '<script>x()</script><p>body</p>')
+        rules = os.path.join(self.test_dir, "rules.json")
+        with open(rules, 'w', encoding='utf-8') as f:
+            json.dump({"widgets": [".share", "#comments"]}, f)
+
+        buf = io.StringIO()
+        test_args = ['cleaner.py', '--parser', self.PARSER, '-i', self.test_dir, '-p', 'page.html',
+                     '-s', '.ad', '-s', 'script', '--rules', rules, '-v']
+        with patch.object(sys, 'argv', test_args), contextlib.redirect_stdout(buf), \
+                patch('cleaner.BeautifulSoup', wraps=BeautifulSoup) as mock_soup:
+            cleaner.main()
+
+        if self.PARSER != "direct":
+            self.assertEqual(mock_soup.call_count, 1)
+        with open(page, encoding='utf-8') as f:
+            content = f.read()
+        for removed in ('class="ad"', 'class="share"', 'id="comments"', '<script'):
+            self.assertNotIn(removed, content)
+        self.assertIn("<p>body</p>", content)
+        output = buf.getvalue()
+        self.assertIn("移除 4 处", output)
+        self.assertIn("widgets: 移除 2 处, 涉及 1 个文件", output)
+        self.assertIn("script: 移除 1 处, 涉及 1 个文件", output)
+
+    def test_output_failures_only_by_default(self):
+        """测试 11: 默认只输出失败的文件与汇总；单个文档解析出错记为失败，不中断整批"""
+        for i in range(6):
+            with open(os.path.join(self.test_dir, f"bulk_{i}.html"), 'w', encoding='utf-8') as f:
+                f.write(f'<div id="remove-me">{i}</div>')
+        real_apply = cleaner.apply_rules
+
+        def flaky(content, *args):
+            if ">3<" in content:
+                raise RuntimeError("boom")
+            return real_apply(content, *args)
+
+        buf = io.StringIO()
+        test_args = ['cleaner.py', '--parser', self.PARSER, '-i', self.test_dir, '-p', 'bulk_*.html',
+                     '-s', '#remove-me']
+        with patch.object(sys, 'argv', test_args), contextlib.redirect_stdout(buf), \
+                patch('cleaner.apply_rules', side_effect=flaky):
+            cleaner.main()
+        output = buf.getvalue()
+        self.assertIn("[解析失败] bulk_3.html: boom", output)
+        self.assertNotIn("bulk_0.html", output)
+        self.assertIn("共 6 个文件: 清理 5 个, 跳过 0 个, 失败 1 个", output)
+
+    def test_missing_selector_and_rules(self):
+        """测试 10: 既没有 -s 也没有 --rules 时报错退出"""
+        with patch.object(sys, 'argv', ['cleaner.py', '-i', self.test_dir]), \
+                contextlib.redirect_stderr(io.StringIO()):
+            with self.assertRaises(SystemExit):
+                cleaner.main()
+
+
+# 同一组测试在其余解析器上各运行一遍
+@unittest.skipUnless(importlib.util.find_spec("lxml"), "未安装 lxml")
+class TestHTMLCleanerLxml(TestHTMLCleaner):
+    PARSER = "lxml"
+
+@unittest.skipUnless(importlib.util.find_spec("html5lib"), "未安装 html5lib")
+class TestHTMLCleanerHtml5lib(TestHTMLCleaner):
+    PARSER = "html5lib"
+
+@unittest.skipUnless(importlib.util.find_spec("lxml") and importlib.util.find_spec("cssselect"),
+                     "未安装 lxml / cssselect")
+class TestHTMLCleanerDirect(TestHTMLCleaner):
+    PARSER = "direct"
+
+    def test_direct_serialization(self):
+        """direct: 片段保持为片段，完整文档保留 DOCTYPE，删除元素后保留其后的文本"""
+        self.assertEqual(cleaner.clean_html('<p>a<span class="ad">x</span>tail</p>', ".ad", "direct"),
+                         ("<p>atail</p>", 1))
+        cleaned, _ = cleaner.clean_html('<!DOCTYPE html><html><body><i class="ad"></i><br></body></html>',
+                                        ".ad", "direct")
+        self.assertEqual(cleaned, "<!DOCTYPE html>\n<html><body><br></body></html>")
+
+    def test_doctype_without_html_tag_kept(self):
+        """direct: 有 DOCTYPE 但没有 <html> 标签 (合法的 HTML5) 时保留 DOCTYPE 及其前的注释，不退化为怪异模式"""
+        cleaned, _ = cleaner.clean_html('<!-- saved -->\n<!DOCTYPE html><div><p>keep</p></div><i class="ad"></i>',
+                                        ".ad", "direct")
+        self.assertEqual(cleaned, '<!-- saved -->\n<!DOCTYPE html><div><p>keep</p></div>')
+
+    def test_unsupported_selector_falls_back(self):
+        """direct: cssselect 不支持的选择器交给 BeautifulSoup 处理"""
+        cleaned, count = cleaner.clean_html('<p>ad</p><p>keep</p>', 'p:-soup-contains("ad")', "direct")
+        self.assertEqual(count, 1)
+        self.assertIn("keep", cleaned)
+
+class TestLoadRules(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    @unittest.skipUnless(importlib.util.find_spec("yaml"), "未安装 PyYAML")
+    def test_yaml_rules(self):
+        """YAML 规则: 单个选择器与选择器列表，列表合并为选择器组"""
+        path = os.path.join(self.test_dir, "rules.yaml")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('ads: [".ad", "#banner"]\nshare: ".share-bar"\n')
+        self.assertEqual(cleaner.load_rules(path), (("ads", ".ad, #banner"), ("share", ".share-bar")))
+
+    def test_invalid_rules(self):
+        """格式不正确的规则文件抛出 ValueError"""
+        path = os.path.join(self.test_dir, "rules.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump([".ad"], f)
+        with self.assertRaises(ValueError):
+            cleaner.load_rules(path)
+
+class TestPrefilter(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def write(self, name, content):
+        path = os.path.join(self.test_dir, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return path
+
+    def test_required_tokens(self):
+        """提取必需字面量；无法化简的选择器返回 None"""
+        self.assertEqual(cleaner.required_tokens("div.ad > p, #x"),
+                         [{("tag", "div"), ("class", "ad"), ("tag", "p")}, {("id", "x")}])
+        self.assertEqual(cleaner.required_tokens("div:not(.x) span[data-k=']']"),
+                         [{("tag", "div"), ("tag", "span"), ("attr", "data-k")}])
+        # 解析器会自动补全的 body 不作为必需标签
+        self.assertEqual(cleaner.required_tokens("body > .x"), [{("class", "x")}])
+        for selector in ("*", ":root", "svg|rect", "#a\\:b", ".广告", ".a, *"):
+            self.assertIsNone(cleaner.required_tokens(selector), selector)
+
+    def test_skips_parse_when_tokens_absent(self):
+        """字节中缺少必需字面量的文件不解码、不解析"""
+        path = self.write("plain.html", "<div class='content'><p>text</p></div>")
+        with patch('cleaner.read_html') as mock_read:
+            status, _, _ = cleaner.clean_file(path, None, ".ad-banner")
+        self.assertEqual(status, "skipped")
+        mock_read.assert_not_called()
+        self.assertTrue(cleaner.may_contain(path, "div.content p"))
+        self.assertFalse(cleaner.may_contain(path, "div.content span"))
+
+    def test_unreducible_and_char_refs_fall_back(self):
+        """无法化简的选择器、以字符引用书写的字面量都退回完整解析"""
+        path = self.write("ref.html", '<div id="a&#100;">x</div>')
+        self.assertTrue(cleaner.may_contain(path, "#ad"))
+        self.assertEqual(cleaner.clean_html(cleaner.read_html(path)[0], "#ad")[1], 1)
+        self.assertTrue(cleaner.may_contain(self.write("any.html", "<p>x</p>"), "*"))
+
+    def test_mmap_for_large_files(self):
+        """大文件通过 mmap 扫描"""
+        path = self.write("big.html", "<p>x</p>" * 100 + '<div class="ad"></div>')
+        with patch('cleaner.MMAP_THRESHOLD', 1), patch('mmap.mmap', wraps=cleaner.mmap.mmap) as mock_mmap:
+            self.assertTrue(cleaner.may_contain(path, ".ad"))
+            self.assertFalse(cleaner.may_contain(path, ".banner"))
+        self.assertEqual(mock_mmap.call_count, 2)
+
+    def test_never_skips_a_match(self):
+        """预筛选判定不可能命中的文件，完整解析也确实没有命中"""
+        docs = ['<table><td class="x">1</td></table>', '<p>a</p></p>', '<DIV CLASS="Ad">x</DIV>',
+                '<image src="a.png">', '<span data-k="1">s</span>', '<ul><li><a href="#">l</a></li></ul>']
+        selectors = ["tbody td.x", "p", "div.ad", "img", "[data-k]", "ul a", "li > span", "p.x", "#nope"]
+        for i, doc in enumerate(docs):
+            path = self.write(f"doc{i}.html", doc)
+            for selector in selectors:
+                if cleaner.may_contain(path, selector):
+                    continue
+                for parser in ("html.parser", "lxml", "html5lib"):
+                    if importlib.util.find_spec(parser.split(".")[0]) or parser == "html.parser":
+                        self.assertEqual(cleaner.clean_html(doc, selector, parser)[1], 0, (doc, selector, parser))
+
+class TestStreamCleaner(unittest.TestCase):
+
+    DOCS = [
+        '<div>a<span class="ad x">AD<b>q</b></span>\nb<br class=ad>c</div>',
+        '<p>a<p>b</P>c<div class="ad">x</div></p><p class=ad>t',
+        '<div><span class="ad">x</div>tail</span>',
+        '<div class=ad><div class=ad>in</div></div>rest',
+        '<!DOCTYPE html>\r\n<html><head><script>if (a<b) {}</script></head>'
+        '<body id=x>\n<input type=TEXT><i>k</i></body></html>',
+        '<ul><li data-k="a b">1</li><li>2</li></ul><!-- <div class=ad> -->',
+    ]
+    SELECTORS = [".ad", "p > .ad", "span.ad", "div.ad", "[type=text], script", "ul [data-k~=b]", "body i", "#x i"]
+
+    def run_stream(self, html, selector, chunk=5):
+        rules = cleaner.as_rules(selector)
+        out = io.StringIO()
+        stream = cleaner.StreamCleaner(rules, cleaner.compile_stream_rules(rules), out.write)
+        peak = 0
+        for i in range(0, len(html), chunk):
+            stream.feed(html[i:i + chunk])
+            peak = max(peak, len(stream.buf))
+        stream.close()
+        return out.getvalue(), stream.counts, peak
+
+    def test_matches_html_parser_results(self):
+        """流式结果与 html.parser 解析后删除的结果一致 (分块边界任意)"""
+        for html in self.DOCS:
+            for selector in self.SELECTORS:
+                for chunk in (1, 7, 4096):
+                    out, counts, _ = self.run_stream(html, selector, chunk)
+                    soup = BeautifulSoup(html, 'html.parser')
+                    targets = soup.select(selector)
+                    for el in targets:
+                        el.decompose()
+                    self.assertEqual(str(BeautifulSoup(out, 'html.parser')), str(soup), (html, selector, chunk))
+                    self.assertEqual(sum(counts.values()), len(targets), (html, selector))
+
+    def test_unchanged_text_kept_verbatim(self):
+        """未删除的部分按原文写出 (引号、大小写、换行都不变)"""
+        html = "<DIV Class='keep'>\r\n<P>x &amp; y<p class=ad>gone</P>\r\n</DIV>"
+        out, counts, _ = self.run_stream(html, ".ad")
+        self.assertEqual(out, "<DIV Class='keep'>\r\n<P>x &amp; y\r\n</DIV>")
+        self.assertEqual(counts, {".ad": 1})
+
+    def test_unsupported_selectors(self):
+        """超出流式子集的选择器不编译"""
+        for selector in ("p:first-child", "h1 + p", "h1 ~ p", "> p", "div >"):
+            self.assertIsNone(cleaner.compile_stream_rules(cleaner.as_rules(selector)), selector)
+        self.assertIsNotNone(cleaner.compile_stream_rules(cleaner.as_rules("div > p.a#b[x^='y' i] *")))
+
+    def test_constant_buffer(self):
+        """缓冲区大小与文件大小无关"""
+        html = "<html><body>" + '<div class="row"><p>text</p><div class="ad">x</div></div>\n' * 20000 + "</body></html>"
+        out, counts, peak = self.run_stream(html, ".ad", chunk=4096)
+        self.assertEqual(counts, {".ad": 20000})
+        self.assertLess(peak, 8192)
+        self.assertNotIn('class="ad"', out)
+
+    def test_clean_file_chooses_streaming(self):
+        """超过阈值且选择器可流式处理时自动使用流式引擎，保留原编码"""
+        test_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(test_dir, "big.html")
+            with open(path, 'w', encoding='gbk', newline='') as f:
+                f.write('<div class="ad">广告</div>\r\n<p>正文</p>')
+            with patch('cleaner.read_html') as mock_read:
+                status, message, counts = cleaner.clean_file(path, None, ".ad", stream_threshold=1)
+            mock_read.assert_not_called()
+            self.assertEqual((status, counts), ("cleaned", {".ad": 1}))
+            self.assertIn("流式", message)
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), '\r\n<p>正文</p>'.encode('gbk'))
+            self.assertEqual(os.listdir(test_dir), ["big.html"])
+
+            # 选择器超出子集时退回完整解析
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write('<p>a</p><p>b</p>')
+            status, message, _ = cleaner.clean_file(path, None, "p:first-child", stream_threshold=1)
+            self.assertEqual(status, "cleaned")
+            self.assertNotIn("流式", message)
+        finally:
+            shutil.rmtree(test_dir)
+
+class TestSpliceWrite(unittest.TestCase):
+
+    def test_only_removed_ranges_change(self):
+        """只剪掉命中元素的原文，其余字符 (引号、大小写、未闭合标签、换行) 不变"""
+        html = "<DIV Class='keep'>\r\n<p>one<p class=ad>two</P>\r\n<li>x<li>y</DIV>"
+        cleaned, counts = cleaner.splice_html(html, ".ad")
+        self.assertEqual(cleaned, "<DIV Class='keep'>\r\n<p>one\r\n<li>x<li>y</DIV>")
+        self.assertEqual(counts, {".ad": 1})
+
+    def test_full_selector_support_and_same_result(self):
+        """任意选择器都可使用，删除结果与完整序列化一致"""
+        docs = ['<ul><li>a</li><li>b</li></ul><p>x</p><p>y</p>',
+                '<div><span class=ad>x</div>tail', '<p>ad text</p><p>keep</p><br class="ad"/>']
+        rules = [("first", "li:first-child"), ("contains", 'p:-soup-contains("ad")'), ("ad", ".ad")]
+        for html in docs:
+            spliced, counts = cleaner.splice_html(html, rules)
+            rewritten, expected = cleaner.apply_rules(html, rules)
+            self.assertEqual(counts, expected, html)
+            self.assertEqual(str(BeautifulSoup(spliced, 'html.parser')), rewritten, html)
+
+    def test_no_match_returns_original(self):
+        html = "<p class=a>x</p>"
+        self.assertEqual(cleaner.splice_html(html, ".b"), (html, {".b": 0}))
+
+    def test_splice_bytes(self):
+        """传入原始字节时在原字节上剪切: UTF-8 按字节扫描，GBK / UTF-16 换算偏移，结果与按文本剪切一致"""
+        html = "<body><p title='中文'>正文</p>\r\n<div class=ad>广告<b>x</b></div><p>尾&nbsp;</p></body>"
+        expected = "<body><p title='中文'>正文</p>\r\n<p>尾&nbsp;</p></body>"
+        for encoding in ("utf-8", "gbk", "utf-16"):
+            raw = html.encode(encoding)
+            for rules in (".ad", "div:first-of-type", '[title="中文"] ~ .ad'):
+                spliced, counts = cleaner.splice_html(html, rules, raw=raw, encoding=encoding)
+                self.assertEqual(spliced, expected.encode(encoding), (encoding, rules))
+                self.assertEqual(sum(counts.values()), 1)
+
+    def test_main_splice_keeps_bytes(self):
+        """--write splice: 文件中未删除部分逐字节保持不变"""
+        test_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(test_dir, "page.html")
+            original = "<html>\r\n<body BGCOLOR=white>\r\n<div class='ad'>广告</div>正文&nbsp;<br>\r\n</body></html>"
+            with open(path, 'wb') as f:
+                f.write(original.encode('gbk'))
+            test_args = ['cleaner.py', '-i', test_dir, '-s', '.ad', '--write', 'splice']
+            with patch.object(sys, 'argv', test_args), contextlib.redirect_stdout(io.StringIO()):
+                cleaner.main()
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), original.replace("<div class='ad'>广告</div>", "").encode('gbk'))
+        finally:
+            shutil.rmtree(test_dir)
+
+class TestCharsetDetection(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_declared_charsets(self):
+        """BOM、<meta charset> 与 http-equiv 声明"""
+        self.assertEqual(cleaner.declared_charset(codecs.BOM_UTF8 + b"<p>x</p>"), ("utf-8-sig", "bom"))
+        self.assertEqual(cleaner.declared_charset(b'<meta charset="Big5"><p>x</p>'), ("big5hkscs", "meta"))
+        self.assertEqual(cleaner.declared_charset(
+            b'<meta http-equiv="Content-Type" content="text/html; charset=Shift_JIS">'), ("cp932", "http-equiv"))
+        self.assertEqual(cleaner.declared_charset(b"<meta charset=gb2312>"), ("gbk", "meta"))
+        self.assertEqual(cleaner.declared_charset(b"<meta charset=utf-16>"), ("utf-8", "meta"))
+        self.assertEqual(cleaner.declared_charset(b"<meta charset=bogus><p>x</p>"), (None, None))
+
+    def test_decode_once_with_fallbacks(self):
+        """没有声明时依次尝试 UTF-8、统计识别、GBK、latin-1"""
+        with patch('cleaner._guess_charset', return_value=None) as mock_guess:
+            self.assertEqual(cleaner.decode_html("中文".encode("utf-8"))[1:], ("utf-8", "utf-8"))
+            mock_guess.assert_not_called()
+            self.assertEqual(cleaner.decode_html("中文".encode("gbk"))[1:], ("gbk", "fallback"))
+            self.assertEqual(cleaner.decode_html(b"caf\xe9 \xff")[1:], ("latin-1", "fallback"))
+        with patch('cleaner._guess_charset', return_value="cp932"):
+            self.assertEqual(cleaner.decode_html("日本語".encode("cp932"))[1:], ("cp932", "detector"))
+
+    def test_optional_detector(self):
+        """charset_normalizer 缺失时使用 chardet，都缺失时返回 None"""
+        fake_chardet = MagicMock()
+        fake_chardet.detect.return_value = {"encoding": "Big5", "confidence": 0.9}
+        with patch.dict(sys.modules, {"charset_normalizer": None, "chardet": fake_chardet}):
+            self.assertEqual(cleaner._guess_charset(b"\xa4\xa4"), "big5hkscs")
+        with patch.dict(sys.modules, {"charset_normalizer": None, "chardet": None}):
+            self.assertIsNone(cleaner._guess_charset(b"\xa4\xa4"))
+
+    def test_keeps_encoding_and_reports_it(self):
+        """写回时保持原编码 (含 BOM)，单次读取，逐文件结果中给出编码"""
+        cases = {
+            "big5.html": ('<meta charset="big5"><div class="ad">廣告</div><p>繁體</p>', "big5"),
+            "bom.html": ('<div class="ad">x</div><p>正文</p>', "utf-8-sig"),
+            "sjis.html": ('<meta http-equiv="Content-Type" content="text/html; charset=shift_jis">'
+                          '<div class="ad">広告</div><p>日本語</p>', "cp932"),
+        }
+        for name, (html, encoding) in cases.items():
+            path = os.path.join(self.test_dir, name)
+            with open(path, 'wb') as f:
+                f.write(html.encode(encoding))
+            with patch('builtins.open', wraps=open) as mock_open:
+                status, message, _ = cleaner.clean_file(path, None, ".ad")
+            reads = [c for c in mock_open.call_args_list if c.args[1:2] == ('rb',)]
+            self.assertEqual(len(reads), 1, name)
+            self.assertEqual(status, "cleaned")
+            self.assertIn(cleaner._normalize_charset(encoding), message)
+            with open(path, 'rb') as f:
+                raw = f.read()
+            self.assertEqual(raw.startswith(codecs.BOM_UTF8), encoding == "utf-8-sig", name)
+            content = raw.decode(encoding)
+            self.assertNotIn('class="ad"', content)
+            self.assertIn(html[html.index('<p>'):], content)
+            # 原有的编码声明保持不变 (与写回的编码一致)
+            if "charset=" in html:
+                declared = html.split("charset=")[1].strip('"').split('"')[0].split(">")[0]
+                self.assertIn(f"charset={declared}".lower(), content.lower().replace('"', ''))
+
+    def test_utf16_and_utf32_not_prefiltered(self):
+        """UTF-16/32 (带 BOM) 文件不能按 ASCII 字面量预筛选，DOM 与流式路径都要清理"""
+        html = '<p>正文</p><div class="ad">广告</div>'
+        for encoding in ("utf-16", "utf-16-be", "utf-32"):
+            raw = html.encode(encoding)
+            if encoding == "utf-16-be":
+                raw = codecs.BOM_UTF16_BE + raw
+            self.assertTrue(cleaner.may_contain(None, ".ad", raw), encoding)
+            for threshold in (cleaner.STREAM_THRESHOLD, 1):
+                path = os.path.join(self.test_dir, "wide.html")
+                with open(path, 'wb') as f:
+                    f.write(raw)
+                status, message, counts = cleaner.clean_file(path, None, ".ad", stream_threshold=threshold)
+                self.assertEqual((status, counts), ("cleaned", {".ad": 1}), (encoding, threshold, message))
+                with open(path, 'rb') as f:
+                    content = f.read().decode("utf-16" if "16" in encoding else "utf-32")
+                self.assertEqual(content, '<p>正文</p>')
+
+class TestResolveParser(unittest.TestCase):
+
+    def test_fallback_when_missing(self):
+        """依赖缺失时回退到 html.parser"""
+        with patch('importlib.util.find_spec', return_value=None):
+            self.assertEqual(cleaner.resolve_parser("direct"), "html.parser")
+            self.assertEqual(cleaner.resolve_parser("lxml"), "html.parser")
+            self.assertEqual(cleaner.resolve_parser("html5lib"), "html.parser")
+        self.assertEqual(cleaner.resolve_parser("html.parser"), "html.parser")
+
+class TestCleanCache(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.input_dir = os.path.join(self.test_dir, "in")
+        self.output_dir = os.path.join(self.test_dir, "out")
+        os.makedirs(self.input_dir)
+        self.write("ad.html", '<p>正文</p><div class="ad">广告</div>')
+        self.write("plain.html", '<p>无广告</p>')
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def write(self, name, html):
+        with open(os.path.join(self.input_dir, name), 'w', encoding='utf-8') as f:
+            f.write(html)
+
+    def run_cleaner(self, *extra, selector=".ad"):
+        test_args = ['cleaner.py', '-i', self.input_dir, '-s', selector, '--cache'] + list(extra)
+        out = io.StringIO()
+        with patch.object(sys, 'argv', test_args), contextlib.redirect_stdout(out):
+            cleaner.main()
+        return out.getvalue()
+
+    def test_second_run_only_stats(self):
+        """第二次运行: 已知无需处理的文件只做 stat，不读取内容"""
+        self.run_cleaner('-o', self.output_dir)
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, cleaner.CACHE_NAME)))
+        with patch('cleaner.clean_file') as mock_clean, patch('cleaner._hash_file') as mock_hash:
+            output = self.run_cleaner('-o', self.output_dir)
+        mock_clean.assert_not_called()
+        mock_hash.assert_not_called()
+        self.assertIn("缓存命中 2 个", output)
+
+    def test_in_place_cleaned_file_recorded_after_next_run(self):
+        """原地覆盖: 清理后的文件下次确认无命中后记为无需处理"""
+        self.run_cleaner()
+        output = self.run_cleaner()
+        self.assertIn("清理 0 个, 跳过 1 个", output)
+        self.assertIn("缓存命中 2 个", self.run_cleaner())
+        self.assertTrue(os.path.exists(os.path.join(self.input_dir, cleaner.CACHE_NAME)))
+
+    def test_modified_file_invalidated(self):
+        self.run_cleaner('-o', self.output_dir)
+        self.write("plain.html", '<p>新内容</p><div class="ad">新广告</div>')
+        output = self.run_cleaner('-o', self.output_dir)
+        self.assertIn("清理 1 个", output)
+        self.assertIn("缓存命中 1 个", output)
+
+    def test_output_changed_invalidated(self):
+        """另存模式下输出文件被删除或改动时重新处理"""
+        self.run_cleaner('-o', self.output_dir)
+        os.remove(os.path.join(self.output_dir, "ad.html"))
+        self.assertIn("清理 1 个", self.run_cleaner('-o', self.output_dir))
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, "ad.html")))
+
+    def test_rules_change_invalidates(self):
+        self.run_cleaner('-o', self.output_dir)
+        output = self.run_cleaner('-o', self.output_dir, selector="p")
+        self.assertIn("缓存命中 0 个", output)
+        self.assertIn("清理 2 个", output)
+
+    def test_touched_file_uses_hash(self):
+        """只改了修改时间、内容不变: 比较内容哈希后仍命中缓存，并更新记录的时间"""
+        self.run_cleaner('-o', self.output_dir)
+        path = os.path.join(self.input_dir, "plain.html")
+        os.utime(path, ns=(1, 1))
+        with patch('cleaner.clean_file') as mock_clean:
+            output = self.run_cleaner('-o', self.output_dir)
+        mock_clean.assert_not_called()
+        self.assertIn("缓存命中 2 个", output)
+        cache = cleaner.CleanCache(self.output_dir)
+        self.assertEqual(cache.get(path)["mtime_ns"], 1)
+
+    def test_deleted_file_pruned(self):
+        self.run_cleaner('-o', self.output_dir)
+        os.remove(os.path.join(self.input_dir, "plain.html"))
+        self.run_cleaner('-o', self.output_dir)
+        cache = cleaner.CleanCache(self.output_dir)
+        self.assertIsNone(cache.get(os.path.join(self.input_dir, "plain.html")))
+        self.assertIsNotNone(cache.get(os.path.join(self.input_dir, "ad.html")))
+
+    def test_parallel_updates_cache(self):
+        self.run_cleaner('-o', self.output_dir, '-j', '2')
+        self.assertIn("缓存命中 2 个", self.run_cleaner('-o', self.output_dir, '-j', '2'))
+
+class TestDryRunStats(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.files = {
+            "a.html": '<p>正文</p><div class="ad">广告</div><div class="ad">广告</div>',
+            "b.html": '<p>正文</p><span id="tip">提示</span>',
+            "c.html": '<p>无广告</p>',
+        }
+        for name, html in self.files.items():
+            with open(os.path.join(self.test_dir, name), 'w', encoding='utf-8') as f:
+                f.write(html)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def run_cleaner(self, *extra):
+        test_args = ['cleaner.py', '-i', self.test_dir, '-s', '.ad', '-s', '#tip', '-v'] + list(extra)
+        out = io.StringIO()
+        with patch.object(sys, 'argv', test_args), contextlib.redirect_stdout(out):
+            cleaner.main()
+        return out.getvalue()
+
+    def assertUnchanged(self):
+        for name, html in self.files.items():
+            with open(os.path.join(self.test_dir, name), encoding='utf-8') as f:
+                self.assertEqual(f.read(), html, name)
+
+    def test_dry_run_writes_nothing(self):
+        output_dir = os.path.join(self.test_dir, "out")
+        os.makedirs(os.path.join(self.test_dir, "sub"))
+        with open(os.path.join(self.test_dir, "sub", "d.html"), 'w', encoding='utf-8') as f:
+            f.write('<p>x</p>')
+        for extra in ([], ['-o', output_dir], ['-o', output_dir, '-r'], ['--stream-threshold', '0.000001'],
+                      ['--cache'], ['-j', '2']):
+            output = self.run_cleaner('--dry-run', *extra)
+            self.assertIn("清理 2 个, 跳过 %d 个" % (2 if '-r' in extra else 1), output, extra)
+            self.assertIn("[预演] 移除 2 处", output)
+            self.assertUnchanged()
+            self.assertFalse(os.path.exists(output_dir), extra)
+            self.assertFalse(os.path.exists(os.path.join(self.test_dir, cleaner.CACHE_NAME)))
+
+    def test_stats_file(self):
+        stats_path = os.path.join(self.test_dir, "stats.json")
+        self.run_cleaner('--dry-run', '--stats', stats_path, '--slowest', '2')
+        self.assertUnchanged()
+        with open(stats_path, encoding='utf-8') as f:
+            stats = json.load(f)
+        summary = stats["summary"]
+        self.assertEqual(summary["files"], 3)
+        self.assertEqual(summary["statuses"], {"cleaned": 2, "skipped": 1})
+        self.assertEqual(summary["removed"], {".ad": {"elements": 2, "files": 1}, "#tip": {"elements": 1, "files": 1}})
+        self.assertEqual(summary["bytes_in"], sum(len(h.encode('utf-8')) for h in self.files.values()))
+        self.assertGreater(summary["bytes_out"], 0)
+        self.assertLessEqual({"read", "decode", "parse", "select", "serialize", "write"}, set(summary["timings"]))
+        self.assertEqual(len(summary["slowest"]), 2)
+        by_name = {os.path.basename(r["file"]): r for r in stats["files"]}
+        self.assertEqual(by_name["a.html"]["removed"], {".ad": 2, "#tip": 0})
+        self.assertEqual(by_name["a.html"]["encoding"], "utf-8")
+        # 预筛选跳过的文件不经过解码与解析
+        self.assertNotIn("parse", by_name["c.html"]["timings"])
+
+    def test_stats_written_for_empty_run(self):
+        empty_dir = os.path.join(self.test_dir, "empty")
+        os.makedirs(empty_dir)
+        stats_path = os.path.join(self.test_dir, "stats.json")
+        test_args = ['cleaner.py', '-i', empty_dir, '-s', '.ad', '--stats', stats_path]
+        with patch.object(sys, 'argv', test_args), contextlib.redirect_stdout(io.StringIO()):
+            cleaner.main()
+        with open(stats_path, encoding='utf-8') as f:
+            self.assertEqual(json.load(f)["summary"]["files"], 0)
+
+    def test_stage_timings(self):
+        for parser in ("html.parser", "direct"):
+            timings = {}
+            cleaner.apply_rules('<p>x</p><div class="ad">y</div>', ".ad", parser, timings)
+            self.assertEqual(set(timings), {"parse", "select", "serialize"}, parser)
+        # splice: 流式子集内的选择器边扫描边匹配，没有单独的 select 阶段
+        timings = {}
+        cleaner.splice_html('<p>x</p><div class="ad">y</div>', ".ad", timings)
+        self.assertEqual(set(timings), {"parse", "serialize"})
+        timings = {}
+        cleaner.splice_html('<p>x</p><div class="ad">y</div>', "div:first-of-type", timings)
+        self.assertEqual(set(timings), {"parse", "select", "serialize"})
+
+class TestCleanerAPI(unittest.TestCase):
+
+    def test_clean_str(self):
+        c = cleaner.Cleaner(".ad")
+        result = c.clean('<p>正文</p><div class="ad">广告</div>')
+        self.assertIsInstance(result, cleaner.CleanResult)
+        self.assertEqual(result, ('<p>正文</p>', {".ad": 1}, None))
+
+    def test_clean_bytes_keeps_encoding(self):
+        """bytes 输入按识别出的编码解码，输出按同一编码编码"""
+        c = cleaner.Cleaner({"ads": [".ad", "#banner"]})
+        html = '<meta charset="gbk"><p>正文</p><div class="ad">广告</div><div id="banner">横幅</div>'
+        output, counts, encoding = c.clean(html.encode('gbk'))
+        self.assertEqual(encoding, "gbk")
+        self.assertEqual(counts, {"ads": 2})
+        self.assertIsInstance(output, bytes)
+        self.assertEqual(output.decode('gbk'), '<meta charset="gbk"/><p>正文</p>')
+
+    def test_unencodable_characters_become_references(self):
+        """&nbsp; 解析后为 U+00A0，GBK 无法表示，写成数字字符引用而不是抛出异常"""
+        html = '<meta charset="gbk"><p>中&nbsp;文</p><div class="ad">x</div>'
+        output, counts, encoding = cleaner.Cleaner('.ad').clean(html.encode('gbk'))
+        self.assertEqual((counts, encoding), ({".ad": 1}, "gbk"))
+        self.assertIn("<p>中&#160;文</p>", output.decode('gbk'))
+
+        path = os.path.join(tempfile.mkdtemp(), "page.html")
+        try:
+            with open(path, 'wb') as f:
+                f.write(html.encode('gbk'))
+            status, _, _ = cleaner.clean_file(path, None, ".ad")
+            self.assertEqual(status, "cleaned")
+            with open(path, 'rb') as f:
+                self.assertIn("中&#160;文", f.read().decode('gbk'))
+        finally:
+            shutil.rmtree(os.path.dirname(path))
+
+    def test_str_not_encoded_for_prefilter(self):
+        with patch('cleaner._may_match') as mock_match:
+            result = cleaner.Cleaner('.ad').clean('<p>x</p><div class="ad">y</div>')
+        mock_match.assert_not_called()
+        self.assertEqual(result.output, '<p>x</p>')
+
+    def test_utf16_bytes_cleaned(self):
+        raw = '<p>正文</p><div class="ad">广告</div>'.encode('utf-16')
+        output, counts, encoding = cleaner.Cleaner('.ad').clean(raw)
+        self.assertEqual((counts, encoding), ({".ad": 1}, "utf-16"))
+        self.assertEqual(output.decode('utf-16'), '<p>正文</p>')
+
+    def test_prefilter_skips_without_parsing(self):
+        c = cleaner.Cleaner([("ads", ".ad")])
+        raw = '<p>没有广告</p>'.encode('utf-8')
+        with patch('cleaner.decode_html') as mock_decode, patch('cleaner.apply_rules') as mock_apply:
+            result = c.clean(raw)
+        mock_decode.assert_not_called()
+        mock_apply.assert_not_called()
+        self.assertIs(result.output, raw)
+        self.assertEqual(result.counts, {"ads": 0})
+
+    def test_selectors_compiled_once(self):
+        c = cleaner.Cleaner(["div.ad", "p > span.x"])
+        with patch('soupsieve.compile') as mock_compile:
+            for i in range(5):
+                c.clean(f'<div class="ad">{i}</div><p><span class="x">x</span></p>')
+        mock_compile.assert_not_called()
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(Exception):
+            cleaner.Cleaner("div[")
+        with self.assertRaises(ValueError):
+            cleaner.Cleaner([])
+        with self.assertRaises(ValueError):
+            cleaner.Cleaner(".ad", write_mode="patch")
+
+    def test_splice_mode(self):
+        c = cleaner.Cleaner(".ad", write_mode="splice")
+        self.assertEqual(c.clean("<P CLASS='keep'>x<div class=ad>y</div></P>").output, "<P CLASS='keep'>x</P>")
+
+    def test_clean_many_in_order(self):
+        docs = [f'<p>{i}</p>' + '<i class="ad">x</i>' * (i % 3) for i in range(40)]
+        c = cleaner.Cleaner(".ad", parser="lxml")
+        expected = [c.clean(d) for d in docs]
+        self.assertEqual(list(c.clean_many(iter(docs))), expected)
+        self.assertEqual(list(c.clean_many(docs, jobs=2, chunk_size=7)), expected)
+        self.assertEqual([r.counts[".ad"] for r in expected], [i % 3 for i in range(40)])
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,107 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+import discovery
+
+class TestIterFiles(unittest.TestCase):
+    """测试基于 scandir 的惰性文件发现"""
+
+    def setUp(self):
+        # 目录结构: root/a.html, root/B.HTM, root/note.txt, root/sub/c.html, root/sub/deep/d.html, root/skip/e.html
+        self.root = tempfile.mkdtemp()
+        for rel in ["a.html", "B.HTM", "note.txt", "sub/c.html", "sub/deep/d.html", "skip/e.html"]:
+            path = os.path.join(self.root, rel)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write("x")
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def names(self, paths):
+        return sorted(os.path.relpath(p, self.root).replace(os.sep, "/") for p in paths)
+
+    def test_flat_is_case_insensitive(self):
+        """测试非递归只遍历当前层，扩展名不区分大小写"""
+        files = discovery.iter_files(self.root, ("*.html", "*.htm"))
+        self.assertEqual(self.names(files), ["B.HTM", "a.html"])
+
+    def test_recursive_with_exclude(self):
+        """测试递归遍历与排除目录/文件"""
+        files = discovery.iter_files(self.root, ("*.html",), exclude=("skip", "sub/deep/*"), recursive=True)
+        self.assertEqual(self.names(files), ["a.html", "sub/c.html"])
+
+    def test_hidden_entries_skipped(self):
+        """测试默认跳过以 . 开头的文件与目录 (与 glob 一致)"""
+        for rel in [".x.html", ".cache/f.html", "sub/.y.html"]:
+            path = os.path.join(self.root, rel)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write("x")
+        files = discovery.iter_files(self.root, ("*.html",), recursive=True)
+        self.assertEqual(self.names(files), ["a.html", "skip/e.html", "sub/c.html", "sub/deep/d.html"])
+        files = discovery.iter_files(self.root, ("*.html",), recursive=True, hidden=True)
+        self.assertIn(".cache/f.html", self.names(files))
+
+    def test_path_pattern(self):
+        """测试带路径的模式匹配相对路径，非递归时只进入模式指定的子目录"""
+        self.assertEqual(self.names(discovery.iter_files(self.root, ("sub/*.html",))), ["sub/c.html"])
+        self.assertEqual(self.names(discovery.iter_files(self.root, ("s*/*.html",))), ["skip/e.html", "sub/c.html"])
+        self.assertEqual(self.names(discovery.iter_files(self.root, ("sub/*/*.html",))), ["sub/deep/d.html"])
+        files = discovery.iter_files(self.root, ("sub/*.html",), recursive=True)
+        self.assertEqual(self.names(files), ["sub/c.html", "sub/deep/d.html"])
+
+    def test_is_lazy(self):
+        """测试返回生成器，不必遍历完整棵树就能拿到第一个文件"""
+        files = discovery.iter_files(self.root, ("*.html",), recursive=True)
+        self.assertTrue(next(files).endswith(".html"))
+        files.close()
+
+    @unittest.skipUnless(hasattr(os, "symlink"), "平台不支持符号链接")
+    def test_symlink_policies(self):
+        """测试符号链接策略以及目录环路保护"""
+        try:
+            os.symlink(os.path.join(self.root, "a.html"), os.path.join(self.root, "link.html"))
+            os.symlink(self.root, os.path.join(self.root, "sub", "loop"))
+        except OSError:
+            self.skipTest("无权限创建符号链接")
+
+        skip = self.names(discovery.iter_files(self.root, ("*.html",), recursive=True, symlinks="skip"))
+        self.assertNotIn("link.html", skip)
+
+        files = self.names(discovery.iter_files(self.root, ("*.html",), recursive=True, symlinks="files"))
+        self.assertIn("link.html", files)
+        self.assertFalse(any(p.startswith("sub/loop/") for p in files))
+
+        # 跟随目录链接时，指回根目录的环路只会被访问一次
+        followed = self.names(discovery.iter_files(self.root, ("*.html",), recursive=True, symlinks="all"))
+        self.assertEqual(followed, files)
+
+    def test_invalid_policy(self):
+        """测试未知的符号链接策略"""
+        with self.assertRaises(ValueError):
+            next(discovery.iter_files(self.root, symlinks="maybe"))
+
+    def test_accepts_matches_iter_files(self):
+        """测试 accepts 与 iter_files 对同一组参数给出相同的结论"""
+        for rel in [".x.html", "sub/.y.html"]:
+            with open(os.path.join(self.root, rel), 'w') as f:
+                f.write("x")
+        all_files = [os.path.join(d, f) for d, _, files in os.walk(self.root) for f in files]
+        for options in [{}, {"recursive": True}, {"recursive": True, "exclude": ("skip",)}, {"include": ("sub/*.html",)}]:
+            options.setdefault("include", ("*.html",))
+            expected = set(discovery.iter_files(self.root, **options))
+            self.assertEqual({p for p in all_files if discovery.accepts(p, self.root, **options)}, expected, options)
+        self.assertFalse(discovery.accepts(os.path.join(os.path.dirname(self.root), "a.html"), self.root))
+
+    def test_is_excluded(self):
+        """测试排除判断会检查所有上级目录"""
+        path = os.path.join(self.root, "skip", "e.html")
+        self.assertTrue(discovery.is_excluded(path, self.root, ["skip"]))
+        self.assertTrue(discovery.is_excluded(path, self.root, ["*.HTML"]))
+        self.assertFalse(discovery.is_excluded(path, self.root, ["sub"]))
+
+if __name__ == '__main__':
+    unittest.main()
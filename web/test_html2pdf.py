@@ -1,9 +1,21 @@
 import unittest
+import argparse
 import os
+import io
+import codecs
 import sys
 import shutil
 import tempfile
 import platform
+import base64
+import hashlib
+import json
+import socket
+import struct
+import threading
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import patch, MagicMock
 
 # 假设你的脚本名为 html2pdf.py
@@ -77,18 +89,18 @@ class TestFileOperations(unittest.TestCase):
     def test_collect_files_single_file(self):
         """测试指定单文件"""
         input_file = os.path.join(self.test_dir, "a.html")
-        files = html2pdf.collect_files(input_file)
+        files = list(html2pdf.collect_files(input_file))
         self.assertEqual(files, [input_file])
 
     def test_collect_files_directory_flat(self):
         """测试目录（非递归）"""
-        files = html2pdf.collect_files(self.test_dir, recursive=False)
+        files = list(html2pdf.collect_files(self.test_dir, recursive=False))
         self.assertEqual(len(files), 1)
         self.assertTrue(files[0].endswith("a.html"))
 
     def test_collect_files_directory_recursive(self):
         """测试目录（递归）"""
-        files = html2pdf.collect_files(self.test_dir, recursive=True)
+        files = list(html2pdf.collect_files(self.test_dir, recursive=True))
         self.assertEqual(len(files), 2)
         filenames = [os.path.basename(f) for f in files]
         self.assertIn("a.html", filenames)
@@ -114,7 +126,7 @@ class TestFileOperations(unittest.TestCase):
 class TestConversionLogic(unittest.TestCase):
     """测试 run_conversion 函数"""
 
-    @patch('subprocess.run')
+    @patch('html2pdf.run_browser')
     @patch('os.path.exists')
     @patch('os.makedirs')
     def test_conversion_success(self, mock_makedirs, mock_exists, mock_run):
@@ -136,7 +148,7 @@ class TestConversionLogic(unittest.TestCase):
         self.assertIn("--headless", cmd_list)
         self.assertIn("file:///", cmd_list[-1] if platform.system() == "Windows" else cmd_list[-1])
 
-    @patch('subprocess.run')
+    @patch('html2pdf.run_browser')
     @patch('os.path.exists')
     def test_skip_existing(self, mock_exists, mock_run):
         """测试跳过已存在文件"""
@@ -148,7 +160,7 @@ class TestConversionLogic(unittest.TestCase):
         self.assertTrue(result) # 函数返回 True 表示处理（或跳过）成功
         mock_run.assert_not_called() # 关键：不应调用浏览器
 
-    @patch('subprocess.run')
+    @patch('html2pdf.run_browser')
     @patch('os.path.exists')
     @patch('os.makedirs')
     def test_force_overwrite(self, mock_makedirs, mock_exists, mock_run):
@@ -241,5 +253,1242 @@ class TestMainFlow(unittest.TestCase):
         # 验证输出路径包含 output_dir
         self.assertTrue("pdfs" in args[2])
 
+class TestParallelFlow(unittest.TestCase):
+    """测试 --jobs 并发模式"""
+
+    @patch('html2pdf.convert_one')
+    @patch('html2pdf.collect_files')
+    @patch('html2pdf.find_browser_executable')
+    def test_counts_and_failures(self, mock_find, mock_collect, mock_convert):
+        """测试并发时的计数与失败汇总"""
+        mock_find.return_value = "dummy_browser"
+        mock_collect.return_value = ["a.html", "b.html", "c.html", "d.html"]
+        status = {"a.html": "generated", "b.html": "skipped", "c.html": "failed"}
+
+        def fake_convert(browser, f, target, force, *rest):
+            if f == "d.html":
+                raise RuntimeError("boom")
+            return status[f]
+        mock_convert.side_effect = fake_convert
+
+        from io import StringIO
+        with patch.object(sys, 'argv', ['html2pdf.py', '.', '-j', '3']), \
+             patch('sys.stdout', new_callable=StringIO) as out:
+            html2pdf.main()
+
+        output = out.getvalue()
+        self.assertEqual(mock_convert.call_count, 4)
+        self.assertIn("实际处理 1 个, 跳过 1 个, 失败 2 个", output)
+        self.assertIn("   - c.html", output)
+        self.assertIn("   - d.html", output)
+
+    @patch('html2pdf.run_conversion')
+    @patch('os.path.exists')
+    def test_convert_one_status(self, mock_exists, mock_run):
+        """测试单文件状态判定"""
+        mock_exists.return_value = True
+        mock_run.return_value = True
+        self.assertEqual(html2pdf.convert_one("chrome", "in.html", "out.pdf"), "skipped")
+        self.assertEqual(html2pdf.convert_one("chrome", "in.html", "out.pdf", True), "generated")
+        mock_run.return_value = False
+        self.assertEqual(html2pdf.convert_one("chrome", "in.html", "out.pdf"), "failed")
+
+
+class FakeDevToolsServer:
+    """本地假 DevTools WebSocket 服务，按 CDP 协议回应导航与打印指令"""
+
+    PDF_BYTES = b"%PDF-1.4 fake"
+
+    def __init__(self, fail_navigation=False, paused_urls=(), print_delay=0):
+        self.fail_navigation = fail_navigation
+        self.print_delay = print_delay
+        self.paused_urls = list(paused_urls)
+        self.methods = []
+        self.messages = []
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen(5)
+        self.url = f"ws://127.0.0.1:{self.server.getsockname()[1]}/devtools/browser/fake"
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.close()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _recv_exact(self, conn, n):
+        data = b""
+        while len(data) < n:
+            chunk = conn.recv(n - len(data))
+            if not chunk:
+                raise ConnectionError
+            data += chunk
+        return data
+
+    def _send(self, conn, obj):
+        payload = json.dumps(obj).encode()
+        if len(payload) < 126:
+            header = bytes([0x81, len(payload)])
+        else:
+            header = bytes([0x81, 127]) + struct.pack("!Q", len(payload))
+        conn.sendall(header + payload)
+
+    def _handle(self, conn):
+        request = b""
+        while b"\r\n\r\n" not in request:
+            request += conn.recv(1024)
+        key = [l.split(":", 1)[1].strip() for l in request.decode().split("\r\n")
+               if l.lower().startswith("sec-websocket-key")][0]
+        accept = base64.b64encode(hashlib.sha1((key + "258EAFA5-E914-47DA-95CA-C5AB0DC85B11").encode()).digest())
+        conn.sendall(b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                     b"Sec-WebSocket-Accept: " + accept + b"\r\n\r\n")
+        try:
+            while True:
+                b1, b2 = self._recv_exact(conn, 2)
+                if b1 & 0x0F == 0x8:
+                    break
+                length = b2 & 0x7F
+                if length == 126:
+                    length = struct.unpack("!H", self._recv_exact(conn, 2))[0]
+                elif length == 127:
+                    length = struct.unpack("!Q", self._recv_exact(conn, 8))[0]
+                mask = self._recv_exact(conn, 4)
+                data = bytes(b ^ mask[i % 4] for i, b in enumerate(self._recv_exact(conn, length)))
+                self._reply(conn, json.loads(data))
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            conn.close()
+
+    def _reply(self, conn, msg):
+        method = msg["method"]
+        self.methods.append(method)
+        self.messages.append(msg)
+        result = {}
+        if method == "Target.createTarget":
+            result = {"targetId": "T1"}
+        elif method == "Target.attachToTarget":
+            result = {"sessionId": "S1"}
+        elif method == "Page.navigate":
+            if self.fail_navigation:
+                result = {"frameId": "F1", "errorText": "net::ERR_FILE_NOT_FOUND"}
+            else:
+                # 模拟请求拦截: 页面加载期间发出的子资源请求
+                for i, url in enumerate(self.paused_urls):
+                    self._send(conn, {"method": "Fetch.requestPaused", "sessionId": "S1",
+                                      "params": {"requestId": f"R{i}", "request": {"url": url}}})
+                # 先推送事件再回应结果，检验客户端的事件缓存
+                self._send(conn, {"method": "Page.loadEventFired", "params": {}, "sessionId": "S1"})
+                result = {"frameId": "F1"}
+        elif method == "Page.printToPDF":
+            # 模拟渲染耗时较长的页面
+            time.sleep(self.print_delay)
+            if msg.get("params", {}).get("transferMode") == "ReturnAsStream":
+                self.chunks = [self.PDF_BYTES[:5], self.PDF_BYTES[5:]]
+                result = {"stream": "H1"}
+            else:
+                result = {"data": base64.b64encode(self.PDF_BYTES).decode()}
+        elif method == "IO.read":
+            # 分块返回，检验客户端按 eof 拼接
+            chunk = self.chunks.pop(0)
+            result = {"data": base64.b64encode(chunk).decode(), "base64Encoded": True, "eof": not self.chunks}
+        self._send(conn, {"id": msg["id"], "result": result, "sessionId": msg.get("sessionId")})
+
+class TestDevToolsEngine(unittest.TestCase):
+    """测试 cdp 引擎 (使用本地假 DevTools 服务)"""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.server = FakeDevToolsServer()
+        self.launch = patch('html2pdf.launch_devtools_browser',
+                            side_effect=lambda *a, **k: (None, self.server.url, None))
+        self.mock_launch = self.launch.start()
+
+    def tearDown(self):
+        self.launch.stop()
+        self.server.close()
+        shutil.rmtree(self.test_dir)
+
+    def test_print_reuses_browser_and_recycles(self):
+        """测试复用同一浏览器，并在达到页数后重启"""
+        session = html2pdf.DevToolsSession("chrome", recycle_after=2)
+        try:
+            for i in range(3):
+                out = os.path.join(self.test_dir, f"{i}.pdf")
+                session.print_to_pdf(f"file:///tmp/{i}.html", out)
+                with open(out, 'rb') as f:
+                    self.assertEqual(f.read(), FakeDevToolsServer.PDF_BYTES)
+        finally:
+            session.close()
+        self.assertEqual(self.mock_launch.call_count, 2)
+        self.assertEqual(self.server.methods.count("Page.printToPDF"), 3)
+
+    @patch('html2pdf.run_browser')
+    def test_run_conversion_with_pool(self, mock_run):
+        """测试 run_conversion 走 DevTools 路径，不再启动命令行浏览器"""
+        pool = html2pdf.DevToolsPool("chrome")
+        out = os.path.join(self.test_dir, "out.pdf")
+        try:
+            self.assertTrue(html2pdf.run_conversion("chrome", "in.html", out, pool=pool))
+        finally:
+            pool.close()
+        mock_run.assert_not_called()
+        self.assertTrue(os.path.exists(out))
+
+    @patch('html2pdf.run_browser')
+    def test_fallback_to_cli(self, mock_run):
+        """测试 DevTools 失败时回退到命令行模式"""
+        self.server.fail_navigation = True
+        mock_res = MagicMock()
+        mock_res.returncode = 0
+        mock_run.return_value = mock_res
+
+        pool = html2pdf.DevToolsPool("chrome")
+        try:
+            result = html2pdf.run_conversion("chrome", "in.html", os.path.join(self.test_dir, "out.pdf"), pool=pool)
+        finally:
+            pool.close()
+        self.assertTrue(result)
+        mock_run.assert_called_once()
+
+
+class TestInMemoryAPI(unittest.TestCase):
+    """测试内存中的 HTML -> PDF 编程接口"""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.server = FakeDevToolsServer()
+        self.launch = patch('html2pdf.launch_devtools_browser',
+                            side_effect=lambda *a, **k: (None, self.server.url, None))
+        self.mock_launch = self.launch.start()
+        self.find = patch('html2pdf.locate_browser', return_value="chrome")
+        self.find.start()
+
+    def tearDown(self):
+        self.find.stop()
+        self.launch.stop()
+        self.server.close()
+        shutil.rmtree(self.test_dir)
+
+    def test_convert_many_shares_one_browser(self):
+        """测试批量转换只启动一次浏览器，按顺序返回 PDF 字节，且不写临时文件"""
+        docs = ["<p>a</p>", b"<p>b</p>", ("<p>c</p>", "https://example.com/x/")]
+        with patch('tempfile.mkstemp') as mock_tmp:
+            pdfs = list(html2pdf.convert_many(docs))
+        mock_tmp.assert_not_called()
+        self.assertEqual(pdfs, [FakeDevToolsServer.PDF_BYTES] * 3)
+        self.assertEqual(self.mock_launch.call_count, 1)
+        self.assertEqual(self.server.methods.count("Page.setDocumentContent"), 3)
+        self.assertIn("IO.close", self.server.methods)
+
+    def test_file_base_url_navigates_to_directory(self):
+        """测试 file:// 基准地址: 先打开其目录，再注入 <base> 写入文档"""
+        html2pdf.convert_html("<html><head></head><body>x</body></html>", "file:///data/site/page.html")
+        navigate = [m for m in self.server.messages if m["method"] == "Page.navigate"]
+        self.assertEqual(navigate[0]["params"]["url"], "file:///data/site/")
+        content = [m for m in self.server.messages if m["method"] == "Page.setDocumentContent"][0]["params"]
+        self.assertEqual(content["frameId"], "F1")
+        self.assertIn('<head><base href="file:///data/site/page.html">', content["html"])
+
+    def test_missing_browser_raises(self):
+        """测试库接口找不到浏览器时抛出异常而不是退出进程"""
+        with patch('html2pdf.locate_browser', return_value=None), self.assertRaises(FileNotFoundError):
+            html2pdf.convert_html("<p>x</p>")
+
+    def test_return_exceptions_continues_batch(self):
+        """测试 return_exceptions=True 时单个文档失败不影响后续文档，且会话被重启"""
+        original = html2pdf.DevToolsSession.print_html
+        calls = []
+
+        def flaky(session, html, *args, **kwargs):
+            calls.append(html)
+            if "bad" in html:
+                raise RuntimeError("render failed")
+            return original(session, html, *args, **kwargs)
+
+        with patch.object(html2pdf.DevToolsSession, 'print_html', flaky):
+            results = list(html2pdf.convert_many(["<p>a</p>", "<p>bad</p>", "<p>c</p>"], return_exceptions=True))
+            self.assertIsInstance(results[1], RuntimeError)
+            self.assertEqual([results[0], results[2]], [FakeDevToolsServer.PDF_BYTES] * 2)
+            with self.assertRaises(RuntimeError):
+                list(html2pdf.convert_many(["<p>bad</p>", "<p>c</p>"]))
+        self.assertEqual(len(calls), 4)
+
+    def test_stream_to_file_object(self):
+        """测试指定 out 时流式写入文件对象"""
+        out_path = os.path.join(self.test_dir, "out.pdf")
+        with open(out_path, "wb") as out:
+            self.assertIsNone(html2pdf.convert_html("<p>x</p>", out=out))
+        with open(out_path, "rb") as f:
+            self.assertEqual(f.read(), FakeDevToolsServer.PDF_BYTES)
+
+    @patch('html2pdf.run_browser')
+    def test_cli_engine_uses_base_url(self, mock_run):
+        """测试 cli 引擎把临时 HTML 写在基准目录之外 (靠 <base> 解析相对资源)，并读回 PDF 字节"""
+        seen = {}
+
+        def fake_run(cmd, *rest):
+            html_path = html2pdf.urllib.request.url2pathname(html2pdf.urllib.parse.urlparse(cmd[-1]).path)
+            seen["dir"] = os.path.dirname(html_path)
+            with open(html_path, encoding='utf-8-sig') as f:
+                seen["html"] = f.read()
+            pdf_path = [c for c in cmd if c.startswith("--print-to-pdf=")][0].split("=", 1)[1]
+            with open(pdf_path, "wb") as f:
+                f.write(b"%PDF cli")
+            return subprocess.CompletedProcess(cmd, 0, b"", b"")
+
+        mock_run.side_effect = fake_run
+        base = html2pdf.file_url_for(os.path.join(self.test_dir, "page.html"))
+        pdfs = list(html2pdf.convert_many(["<p>x</p>"], base_url=base, engine="cli"))
+        self.assertEqual(pdfs, [b"%PDF cli"])
+        self.assertNotEqual(seen["dir"], self.test_dir)
+        self.assertIn(f'<base href="{base}">', seen["html"])
+        self.assertEqual(os.listdir(self.test_dir), [])
+
+class TestBuildManifest(unittest.TestCase):
+    """测试 --incremental 增量构建清单"""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.out_dir = os.path.join(self.test_dir, "pdfs")
+        self.html = os.path.join(self.test_dir, "a.html")
+        self.css = os.path.join(self.test_dir, "style.css")
+        self.img = os.path.join(self.test_dir, "bg.png")
+        with open(self.html, 'w') as f:
+            f.write('<link rel="stylesheet" href="style.css"><img src="https://example.com/x.png">')
+        with open(self.css, 'w') as f:
+            f.write('body { background: url("bg.png"); }')
+        with open(self.img, 'wb') as f:
+            f.write(b"PNG1")
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def _write(self, path, content):
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def test_find_local_assets(self):
+        """测试递归收集本地资源，忽略远程地址"""
+        assets = html2pdf.find_local_assets(self.html)
+        self.assertEqual(assets, {os.path.abspath(self.css), os.path.abspath(self.img)})
+
+    def test_links_are_not_assets(self):
+        """测试 <a href> 链接的页面不算资源，srcset、@import 与 <source> 算资源"""
+        for name in ("c.html", "small.png", "large.png", "print.css", "clip.webp"):
+            self._write(os.path.join(self.test_dir, name), name)
+        self._write(self.html, '<a href="c.html">c</a><a href="a.html">self</a><link rel="next" href="c.html">'
+                               '<img srcset="small.png 1x, large.png 2x"><style>@import "print.css";</style>'
+                               '<picture><source srcset=clip.webp></picture>')
+        assets = {os.path.basename(p) for p in html2pdf.find_local_assets(self.html)}
+        self.assertEqual(assets, {"small.png", "large.png", "print.css", "clip.webp"})
+
+        manifest = html2pdf.BuildManifest(self.out_dir)
+        base = manifest.digest(self.html)
+        self._write(os.path.join(self.test_dir, "c.html"), "changed")
+        self.assertEqual(base, manifest.digest(self.html))
+
+    def test_digest_tracks_html_assets_and_options(self):
+        """测试 HTML、间接资源和渲染选项变化都会改变哈希"""
+        manifest = html2pdf.BuildManifest(self.out_dir, {"engine": "cli"})
+        base = manifest.digest(self.html)
+        self.assertEqual(base, manifest.digest(self.html))
+
+        with open(self.img, 'wb') as f:
+            f.write(b"PNG2")
+        changed_asset = manifest.digest(self.html)
+        self.assertNotEqual(base, changed_asset)
+
+        self._write(self.html, '<link rel="stylesheet" href="style.css"><p>new</p>')
+        self.assertNotEqual(changed_asset, manifest.digest(self.html))
+
+        other = html2pdf.BuildManifest(self.out_dir, {"engine": "cdp"})
+        self.assertNotEqual(manifest.digest(self.html), other.digest(self.html))
+
+    @patch('html2pdf.run_conversion')
+    def test_incremental_rerender_and_prune(self, mock_run):
+        """测试重复运行只渲染变化的文件，并清理孤儿输出"""
+        def fake_run(browser, input_file, output_file, *args):
+            os.makedirs(os.path.dirname(output_file), exist_ok=True)
+            self._write(output_file, "pdf")
+            return True
+        mock_run.side_effect = fake_run
+
+        manifest = html2pdf.BuildManifest(self.out_dir)
+        target = os.path.join(self.out_dir, "a.pdf")
+        self.assertEqual(html2pdf.convert_one("chrome", self.html, target, manifest=manifest), "generated")
+        manifest.save()
+
+        manifest = html2pdf.BuildManifest(self.out_dir)
+        self.assertEqual(html2pdf.convert_one("chrome", self.html, target, manifest=manifest), "skipped")
+        self.assertEqual(mock_run.call_count, 1)
+
+        self._write(self.css, "body { color: red; }")
+        self.assertEqual(html2pdf.convert_one("chrome", self.html, target, manifest=manifest), "generated")
+        # 内容变化时即使输出已存在也要覆盖
+        self.assertTrue(mock_run.call_args[0][3])
+
+        os.remove(self.html)
+        self.assertEqual(manifest.prune(), [target])
+        self.assertFalse(os.path.exists(target))
+        manifest.save()
+        self.assertEqual(html2pdf.BuildManifest(self.out_dir).entries, {})
+
+    def test_prune_requires_incremental(self):
+        """测试未开启 --incremental 时 --prune 报错，而不是悄悄不生效"""
+        argv = ['html2pdf.py', self.test_dir, '--prune']
+        with patch.object(sys, 'argv', argv), patch('sys.stderr', new_callable=io.StringIO) as err, \
+                self.assertRaises(SystemExit) as cm:
+            html2pdf.main()
+        self.assertEqual(cm.exception.code, 2)
+        self.assertIn("--incremental", err.getvalue())
+
+
+class TestTimeoutAndRetry(unittest.TestCase):
+    """测试单页超时、重试退避与隔离名单"""
+
+    @unittest.skipUnless(os.name == "posix", "进程组清理仅在 POSIX 上验证")
+    def test_watchdog_kills_process_group(self):
+        """测试超时后整个进程组 (包括派生的子进程) 都被杀掉"""
+        pid_file = tempfile.mktemp()
+        script = ("import subprocess, sys, time; "
+                  "child = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)']); "
+                  f"open({pid_file!r}, 'w').write(str(child.pid)); time.sleep(60)")
+        start = time.monotonic()
+        with self.assertRaises(subprocess.TimeoutExpired):
+            html2pdf.run_browser([sys.executable, "-c", script], timeout=1)
+        self.assertLess(time.monotonic() - start, 30)
+
+        with open(pid_file) as f:
+            child_pid = int(f.read())
+        os.remove(pid_file)
+        # 子进程已被杀掉 (可能短暂处于僵尸状态，等其被回收)
+        for _ in range(50):
+            try:
+                os.kill(child_pid, 0)
+                with open(f"/proc/{child_pid}/stat") as f:
+                    if f.read().split(")")[-1].split()[0] == "Z":
+                        break
+            except (ProcessLookupError, FileNotFoundError):
+                break
+            time.sleep(0.1)
+        else:
+            self.fail("子进程在超时后仍然存活")
+
+    def test_run_browser_success(self):
+        """测试正常退出时返回 CompletedProcess"""
+        res = html2pdf.run_browser([sys.executable, "-c", "import sys; sys.stderr.write('warn')"], timeout=30)
+        self.assertEqual(res.returncode, 0)
+        self.assertEqual(res.stderr, b"warn")
+
+    @patch('html2pdf.run_browser')
+    @patch('os.makedirs')
+    def test_timeout_reports_failure(self, mock_makedirs, mock_run):
+        """测试超时被当作失败处理"""
+        mock_run.side_effect = subprocess.TimeoutExpired("chrome", 5)
+        self.assertFalse(html2pdf.run_conversion("chrome", "in.html", "/nonexistent/out.pdf", timeout=5))
+        self.assertEqual(mock_run.call_args[0][1], 5)
+
+    @patch('html2pdf.run_browser')
+    @patch('os.makedirs')
+    def test_cdp_timeout_does_not_fall_back_to_cli(self, mock_makedirs, mock_run):
+        """测试 cdp 单页超时直接按失败处理，不再用命令行模式重跑一遍"""
+        pool = MagicMock()
+        pool.session.return_value.print_to_pdf.side_effect = TimeoutError("页面渲染超时")
+        self.assertFalse(html2pdf.run_conversion("chrome", "in.html", "/nonexistent/out.pdf", pool=pool, timeout=5))
+        pool.session.return_value.close.assert_called_once()
+        mock_run.assert_not_called()
+
+    @patch('time.sleep')
+    def test_failed_attempt_leaves_no_partial_pdf(self, mock_sleep):
+        """测试 cdp 中途超时不留下残缺的 PDF，重试会重新渲染而不是把它当作已存在跳过"""
+        out_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, out_dir)
+        output = os.path.join(out_dir, "a.pdf")
+        attempts = []
+
+        def print_to_pdf(url, path, stats=None):
+            attempts.append(path)
+            with open(path, "wb") as f:
+                f.write(b"%PDF" if len(attempts) == 1 else b"%PDF complete")
+            if len(attempts) == 1:
+                raise TimeoutError("页面渲染超时")
+
+        pool = MagicMock()
+        pool.session.return_value.print_to_pdf.side_effect = print_to_pdf
+        self.assertFalse(html2pdf.run_conversion("chrome", "a.html", output, pool=pool, timeout=5))
+        self.assertEqual(os.listdir(out_dir), [])
+
+        attempts.clear()
+        policy = html2pdf.RetryPolicy(timeout=5, retries=1)
+        self.assertEqual(html2pdf.convert_one("chrome", "a.html", output, pool=pool, policy=policy), "generated")
+        self.assertEqual(len(attempts), 2)
+        with open(output, "rb") as f:
+            self.assertEqual(f.read(), b"%PDF complete")
+        self.assertEqual(os.listdir(out_dir), ["a.pdf"])
+
+    @patch('time.sleep')
+    @patch('html2pdf.run_conversion')
+    def test_retry_then_quarantine(self, mock_run, mock_sleep):
+        """测试重试耗尽后写入隔离名单，下次运行直接跳过"""
+        mock_run.return_value = False
+        quarantine_file = tempfile.mktemp()
+        try:
+            policy = html2pdf.RetryPolicy(timeout=10, retries=2, quarantine_file=quarantine_file)
+            self.assertEqual(html2pdf.convert_one("chrome", "bad.html", "bad.pdf", policy=policy), "failed")
+            self.assertEqual(mock_run.call_count, 3)
+            self.assertEqual(mock_sleep.call_count, 2)
+            policy.save()
+
+            policy = html2pdf.RetryPolicy(timeout=10, retries=2, quarantine_file=quarantine_file)
+            self.assertEqual(html2pdf.convert_one("chrome", "bad.html", "bad.pdf", policy=policy), "quarantined")
+            self.assertEqual(mock_run.call_count, 3)
+        finally:
+            if os.path.exists(quarantine_file):
+                os.remove(quarantine_file)
+
+    @patch('time.sleep')
+    @patch('html2pdf.run_conversion')
+    def test_retry_recovers(self, mock_run, mock_sleep):
+        """测试重试成功后不进入隔离名单"""
+        mock_run.side_effect = [False, True]
+        policy = html2pdf.RetryPolicy(retries=3, quarantine_file="unused.txt")
+        self.assertEqual(html2pdf.convert_one("chrome", "flaky.html", "flaky.pdf", policy=policy), "generated")
+        self.assertEqual(policy.newly_quarantined, [])
+
+    def test_backoff_is_bounded(self):
+        """测试退避时间有上限"""
+        policy = html2pdf.RetryPolicy(retries=20)
+        self.assertLessEqual(policy.backoff(1), policy.BACKOFF_BASE)
+        self.assertLessEqual(policy.backoff(20), policy.BACKOFF_MAX)
+
+
+class TestMergeMode(unittest.TestCase):
+    """测试 --merge 合并模式"""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.test_dir, "sub"))
+        with open(os.path.join(self.test_dir, "ch10.html"), 'w', encoding='utf-8') as f:
+            f.write('<html><head><link rel="stylesheet" href="style.css"><title>t</title></head>'
+                    '<body><img src="img/a.png"><a href="#top">top</a><p>第十章</p></body></html>')
+        with open(os.path.join(self.test_dir, "ch2.html"), 'w', encoding='utf-8') as f:
+            f.write('<p style="background: url(\'sub/bg.png\')">第二章</p>')
+        with open(os.path.join(self.test_dir, "sub", "ch1.html"), 'w', encoding='gbk') as f:
+            f.write('<body><img src="../logo.png"><p>第一章</p></body>')
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_build_merged_html(self):
+        """测试样式保留、相对地址改写与分页"""
+        files = [os.path.join(self.test_dir, "ch2.html"), os.path.join(self.test_dir, "sub", "ch1.html")]
+        merged = html2pdf.build_merged_html(files)
+        base_url = html2pdf.file_url_for(self.test_dir)
+
+        self.assertIn(f'<img src="{base_url}/logo.png">', merged)
+        self.assertIn(f"url('{base_url}/sub/bg.png')", merged)
+        self.assertIn("第一章", merged)
+        self.assertEqual(merged.count("page-break-before: always"), len(files) - 1)
+
+        merged = html2pdf.build_merged_html([os.path.join(self.test_dir, "ch10.html")])
+        self.assertIn(f'<link rel="stylesheet" href="{base_url}/style.css">', merged)
+        self.assertIn('<a href="#top">', merged)
+        self.assertNotIn("<title>", merged)
+
+    def test_decode_honours_bom_and_declared_charset(self):
+        """测试按 BOM 与 <meta charset> 解码 (Shift_JIS、Big5、UTF-16)，而不是按 GBK/latin-1 猜出乱码"""
+        for text, encoding in [('<meta charset="shift_jis"><p>日本語</p>', 'shift_jis'),
+                               ('<meta charset="big5"><p>繁體中文</p>', 'big5'),
+                               ('<p>中文</p>', 'utf-16')]:
+            self.assertEqual(html2pdf.decode_html(text.encode(encoding)), text)
+        path = os.path.join(self.test_dir, "sjis.html")
+        with open(path, 'wb') as f:
+            f.write('<meta charset="shift_jis"><body><p>日本語</p></body>'.encode('shift_jis'))
+        self.assertIn("<p>日本語</p>", html2pdf.build_merged_html([path]))
+
+    def test_merged_source_name_escaped(self):
+        """测试文件名中的引号与 & 在 data-source 属性中被转义"""
+        path = os.path.join(self.test_dir, 'a"b&c.html')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('<body><p>正文</p></body>')
+        merged = html2pdf.build_merged_html([path])
+        self.assertIn('data-source="a&quot;b&amp;c.html"', merged)
+
+    @patch('html2pdf.run_conversion')
+    @patch('html2pdf.find_browser_executable')
+    def test_main_merge_single_render(self, mock_find, mock_run):
+        """测试合并模式只调用一次渲染，并按自然顺序合并"""
+        mock_find.return_value = "dummy_browser"
+        seen = {}
+
+        def fake_run(browser, input_file, output_file, *args):
+            with open(input_file, encoding='utf-8') as f:
+                seen["html"] = f.read()
+            return True
+        mock_run.side_effect = fake_run
+
+        test_args = ['html2pdf.py', self.test_dir, '-r', '--merge', '-o', 'book.pdf']
+        with patch.object(sys, 'argv', test_args):
+            html2pdf.main()
+
+        mock_run.assert_called_once()
+        self.assertEqual(mock_run.call_args[0][2], "book.pdf")
+        html = seen["html"]
+        self.assertLess(html.index("第二章"), html.index("第十章"))
+        self.assertLess(html.index("第十章"), html.index("第一章"))
+        # 临时合并文件用完即删
+        self.assertFalse(os.path.exists(mock_run.call_args[0][1]))
+
+    def test_srcset_and_import_absolutized(self):
+        """测试 srcset 的每个候选地址与 @import "x.css" 也改写为绝对地址"""
+        base_url = html2pdf.file_url_for(self.test_dir) + "/"
+        merged = html2pdf.absolutize_urls('<img srcset="a.png 1x, b/c.png 2x"><style>@import "print.css";</style>',
+                                          base_url)
+        self.assertIn(f'srcset="{base_url}a.png 1x, {base_url}b/c.png 2x"', merged)
+        self.assertIn(f'@import "{base_url}print.css"', merged)
+
+    @patch('time.sleep')
+    @patch('html2pdf.run_conversion')
+    @patch('html2pdf.find_browser_executable', return_value="dummy_browser")
+    def test_main_merge_retries_and_report(self, mock_find, mock_run, mock_sleep):
+        """测试合并模式按 --retries 重试并写出 --report"""
+        mock_run.side_effect = [False, True]
+        report = os.path.join(self.test_dir, "run.json")
+        output = os.path.join(self.test_dir, "book.pdf")
+        test_args = ['html2pdf.py', self.test_dir, '-r', '--merge', '-o', output, '--retries', '2', '--report', report]
+        with patch.object(sys, 'argv', test_args), patch('builtins.print'):
+            html2pdf.main()
+        self.assertEqual(mock_run.call_count, 2)
+        records, summary = html2pdf.read_report(report)
+        self.assertEqual(summary["statuses"], {"generated": 1})
+        self.assertEqual(len(records[0]["input"]), 3)
+
+    @patch('html2pdf.run_conversion')
+    @patch('html2pdf.find_browser_executable', return_value="dummy_browser")
+    def test_main_merge_existing_output_reported_as_skip(self, mock_find, mock_run):
+        """测试输出已存在时合并报告为跳过，而不是“合并完成”"""
+        output = os.path.join(self.test_dir, "book.pdf")
+        with open(output, 'wb') as f:
+            f.write(b"%PDF old")
+        with patch.object(sys, 'argv', ['html2pdf.py', self.test_dir, '--merge', '-o', output]), \
+                patch('builtins.print') as mock_print:
+            html2pdf.main()
+        mock_run.assert_not_called()
+        printed = " ".join(str(c[0][0]) for c in mock_print.call_args_list if c[0])
+        self.assertIn("合并已跳过", printed)
+        self.assertNotIn("合并完成", printed)
+
+    def test_merge_rejects_per_file_options(self):
+        """测试 --merge 与 --incremental / --quarantine 同时使用时报错"""
+        for extra in (['--incremental'], ['--quarantine', 'q.txt']):
+            argv = ['html2pdf.py', self.test_dir, '--merge'] + extra
+            with patch.object(sys, 'argv', argv), patch('sys.stderr', new_callable=io.StringIO) as err, \
+                    self.assertRaises(SystemExit) as cm:
+                html2pdf.main()
+            self.assertEqual(cm.exception.code, 2)
+            self.assertIn(extra[0], err.getvalue())
+
+
+class TestRunReport(unittest.TestCase):
+    """测试 --report 运行报告"""
+
+    def test_percentile(self):
+        """测试最近秩百分位数"""
+        values = list(range(1, 101))
+        self.assertEqual(html2pdf.percentile(values, 50), 50)
+        self.assertEqual(html2pdf.percentile(values, 95), 95)
+        self.assertEqual(html2pdf.percentile(values, 99), 99)
+        self.assertEqual(html2pdf.percentile([3.0], 99), 3.0)
+        self.assertIsNone(html2pdf.percentile([], 50))
+
+    def test_run_browser_stats(self):
+        """测试子进程耗时、返回码与资源占用的采集"""
+        stats = {}
+        html2pdf.run_browser([sys.executable, "-c", "pass"], None, stats)
+        self.assertEqual(stats["returncode"], 0)
+        self.assertGreaterEqual(stats["render_time"], 0)
+        if hasattr(os, "wait4"):
+            self.assertGreater(stats["max_rss"], 0)
+            self.assertGreaterEqual(stats["cpu_user"] + stats["cpu_system"], 0)
+
+    @patch('html2pdf.run_conversion')
+    @patch('html2pdf.collect_files')
+    @patch('html2pdf.find_browser_executable')
+    def test_main_writes_report(self, mock_find, mock_collect, mock_run):
+        """测试 main 写出 JSON 与 JSONL 报告"""
+        mock_find.return_value = "dummy_browser"
+        mock_collect.return_value = ["a.html", "b.html"]
+
+        def fake_run(browser, input_file, output_file, force, pool, timeout, metrics, *rest):
+            metrics.update(engine="cli", spawn_time=0.01, render_time=0.1, returncode=0, output_size=10)
+            return input_file == "a.html"
+        mock_run.side_effect = fake_run
+
+        test_dir = tempfile.mkdtemp()
+        try:
+            for name in ("run.json", "run.jsonl"):
+                path = os.path.join(test_dir, name)
+                with patch.object(sys, 'argv', ['html2pdf.py', '.', '-f', '--retries', '0', '--report', path]):
+                    html2pdf.main()
+                with open(path, encoding='utf-8') as f:
+                    if name.endswith(".jsonl"):
+                        lines = [json.loads(l) for l in f]
+                        records, summary = lines[:-1], lines[-1]["summary"]
+                    else:
+                        data = json.load(f)
+                        records, summary = data["files"], data["summary"]
+
+                self.assertEqual(summary["files"], 2)
+                self.assertEqual(summary["statuses"], {"generated": 1, "failed": 1})
+                self.assertIsNotNone(summary["latency"]["p99"])
+                by_input = {r["input"]: r for r in records}
+                self.assertEqual(by_input["a.html"]["output_size"], 10)
+                self.assertEqual(by_input["b.html"]["status"], "failed")
+                self.assertIn("queue_wait", by_input["a.html"])
+                self.assertNotIn("submitted_at", by_input["a.html"])
+        finally:
+            shutil.rmtree(test_dir)
+
+
+class TestAdaptiveLimiter(unittest.TestCase):
+    """测试内存自适应并发调度"""
+
+    MB = 1024 * 1024
+
+    def make(self, memory, **kwargs):
+        self.memory = memory
+        return html2pdf.AdaptiveLimiter(memory_probe=lambda: self.memory, **kwargs)
+
+    @patch('builtins.print')
+    def test_ramp_up_and_back_off(self, mock_print):
+        """测试内存充足时逐步增加并发，内存紧张时立即回落"""
+        limiter = self.make(10000 * self.MB, floor=1, ceiling=4, reserve=1000 * self.MB, initial_rss=100 * self.MB)
+        limiter.acquire()
+        self.assertEqual(limiter.limit, 1)
+        for expected in (2, 3, 4, 4):
+            limiter.release(100 * self.MB)
+            limiter.acquire()
+            self.assertEqual(limiter.limit, expected)
+
+        # 可用内存只够再容纳 1 个渲染 (当前已有 1 个在途)
+        self.memory = 1150 * self.MB
+        limiter.release(100 * self.MB)
+        self.assertEqual(limiter.limit, 1)
+
+    def test_heavy_pages_reduce_target(self):
+        """测试实测 RSS 变大后可容纳的并发随之减少"""
+        limiter = self.make(3000 * self.MB, floor=1, ceiling=16, reserve=1000 * self.MB, initial_rss=100 * self.MB)
+        self.assertEqual(limiter._memory_target(), 16)
+        limiter.avg_rss = 1000 * self.MB
+        self.assertEqual(limiter._memory_target(), 2)
+
+    def test_floor_is_honored_under_pressure(self):
+        """测试内存不足时仍保持下限并发，不会卡死"""
+        limiter = self.make(10 * self.MB, floor=2, ceiling=8, reserve=1000 * self.MB)
+        limiter.acquire()
+        limiter.acquire()
+        self.assertEqual(limiter.active, 2)
+
+    def test_no_probe_uses_ceiling(self):
+        """测试无法获取内存信息时使用上限"""
+        limiter = html2pdf.AdaptiveLimiter(floor=1, ceiling=5, memory_probe=lambda: None)
+        self.assertEqual(limiter._memory_target(), 5)
+
+    def test_blocks_until_release(self):
+        """测试超过上限的请求会等待其他渲染结束"""
+        limiter = self.make(10 * self.MB, floor=1, ceiling=4, reserve=1000 * self.MB)
+        limiter.acquire()
+        acquired = threading.Event()
+        waiter = threading.Thread(target=lambda: (limiter.acquire(), acquired.set()))
+        waiter.start()
+        self.assertFalse(acquired.wait(0.2))
+        limiter.release()
+        self.assertTrue(acquired.wait(2))
+        waiter.join()
+
+    @patch('html2pdf.run_conversion')
+    def test_convert_one_feeds_rss(self, mock_run):
+        """测试渲染结束后把实测 RSS 反馈给调度器"""
+        def fake_run(browser, input_file, output_file, force, pool, timeout, stats, *rest):
+            stats["max_rss"] = 500 * self.MB
+            return True
+        mock_run.side_effect = fake_run
+        limiter = self.make(None, initial_rss=100 * self.MB)
+        self.assertEqual(html2pdf.convert_one("chrome", "a.html", "a.pdf", True, limiter=limiter), "generated")
+        self.assertEqual(limiter.active, 0)
+        self.assertEqual(limiter.avg_rss, 0.7 * 100 * self.MB + 0.3 * 500 * self.MB)
+
+    @patch('html2pdf.DevToolsSession.close')
+    def test_pool_trims_idle_sessions(self, mock_close):
+        """测试会话池关闭超出上限的空闲浏览器，借出中的会话不受影响"""
+        pool = html2pdf.DevToolsPool("chrome")
+        sessions = [pool.session() for _ in range(3)]
+        self.assertEqual(len({id(s) for s in sessions}), 3)
+        pool.release(sessions[0])
+        pool.release(sessions[1])
+        self.assertEqual(pool.trim(1), 2)
+        self.assertEqual(mock_close.call_count, 2)
+        pool.release(sessions[2])
+        self.assertIs(pool.session(), sessions[2])
+
+    @patch('html2pdf.run_conversion', return_value=True)
+    def test_convert_one_trims_pool_to_limit(self, mock_run):
+        """测试并发上限降低后，渲染结束时会话池收缩到新的上限"""
+        limiter = self.make(10 * self.MB, floor=1, ceiling=8, reserve=1000 * self.MB)
+        pool = MagicMock()
+        pool.trim.return_value = 0
+        self.assertEqual(html2pdf.convert_one("chrome", "a.html", "a.pdf", True, pool, limiter=limiter), "generated")
+        pool.trim.assert_called_once_with(1)
+
+    def test_process_tree_rss(self):
+        """测试进程组 RSS 的测量 (psutil 与 /proc 两种方式)"""
+        if not os.path.exists("/proc/self/stat"):
+            self.skipTest("需要 /proc")
+        with patch.dict(sys.modules, {"psutil": None}):
+            self.assertGreater(html2pdf.process_tree_rss(os.getpid()), 0)
+
+    def test_cdp_session_reports_rss(self):
+        """测试 cdp 会话在打印后记录浏览器进程组的 RSS，自适应调度在 cdp 下也能得到实测值"""
+        server = FakeDevToolsServer()
+        proc = MagicMock(pid=4242)
+        session = html2pdf.DevToolsSession("chrome")
+        try:
+            with patch('html2pdf.launch_devtools_browser', return_value=(proc, server.url, None)), \
+                    patch('html2pdf.process_tree_rss', return_value=321 * self.MB) as mock_rss, \
+                    patch('html2pdf.kill_process_tree'):
+                stats = {}
+                session.print_html("<p>x</p>", stats=stats)
+                session.close()
+        finally:
+            server.close()
+        mock_rss.assert_called_with(4242)
+        self.assertEqual(stats["max_rss"], 321 * self.MB)
+
+    def test_cdp_no_page_timeout_waits_past_session_timeout(self):
+        """测试 --timeout 0 时渲染不受会话超时限制，设定单页时间时按单页时间超时"""
+        server = FakeDevToolsServer(print_delay=0.5)
+        try:
+            with patch('html2pdf.launch_devtools_browser', return_value=(None, server.url, None)):
+                session = html2pdf.DevToolsSession("chrome", timeout=0.2, page_timeout=None)
+                try:
+                    self.assertEqual(session.print_html("<p>x</p>"), FakeDevToolsServer.PDF_BYTES)
+                finally:
+                    session.close()
+                session = html2pdf.DevToolsSession("chrome", timeout=5, page_timeout=0.2)
+                try:
+                    with self.assertRaises(TimeoutError):
+                        session.print_html("<p>x</p>")
+                finally:
+                    session.close()
+        finally:
+            server.close()
+
+
+class TestWatchMode(unittest.TestCase):
+    """测试 --watch 监听模式"""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.page = os.path.join(self.test_dir, "page.html")
+        self.other = os.path.join(self.test_dir, "other.html")
+        self.css = os.path.join(self.test_dir, "style.css")
+        self._write(self.page, '<link rel="stylesheet" href="style.css"><p>page</p>')
+        self._write(self.other, '<p>other</p>')
+        self._write(self.css, 'p { color: red; }')
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def _write(self, path, content):
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def test_explicit_cli_engine_rejected(self):
+        """测试 --watch / --asset-cache 与显式的 --engine cli 冲突时报错，而不是悄悄改用 cdp"""
+        for extra in (['--watch'], ['--asset-cache', self.test_dir]):
+            argv = ['html2pdf.py', self.test_dir, '--engine', 'cli'] + extra
+            with patch.object(sys, 'argv', argv), patch('sys.stderr', new_callable=io.StringIO) as err, \
+                    self.assertRaises(SystemExit) as cm:
+                html2pdf.main()
+            self.assertEqual(cm.exception.code, 2)
+            self.assertIn("cdp", err.getvalue())
+
+    def test_next_batch_coalesces_bursts(self):
+        """测试去抖: 连续的变化合并为一批"""
+        watcher = MagicMock()
+        watcher.changes.side_effect = [{"a.html"}, {"a.html", "b.css"}, set(), {"c.html"}, set()]
+        self.assertEqual(html2pdf.next_batch(watcher, 0.1), {"a.html", "b.css"})
+        # 第一次调用一直等待，之后按去抖时间等待
+        self.assertEqual([c[0][0] for c in watcher.changes.call_args_list], [None, 0.1, 0.1])
+        self.assertEqual(html2pdf.next_batch(watcher, 0.1), {"c.html"})
+
+    def test_dependency_index(self):
+        """测试资源变化映射到引用它的页面，删除的页面不再渲染"""
+        index = html2pdf.DependencyIndex()
+        index.update(self.page)
+        index.update(self.other)
+        self.assertEqual(index.affected([self.css]), {os.path.abspath(self.page)})
+        self.assertEqual(index.affected([self.other]), {os.path.abspath(self.other)})
+
+        os.remove(self.page)
+        self.assertEqual(index.affected([self.page, self.css]), set())
+
+    def test_polling_watcher(self):
+        """测试轮询监听能发现修改、新增与删除"""
+        watcher = html2pdf.PollingWatcher([(self.test_dir, True)], interval=0.05)
+        self.assertEqual(watcher.changes(0.1), set())
+        self._write(self.css, 'p { color: blue; } /* longer */')
+        new_file = os.path.join(self.test_dir, "new.html")
+        self._write(new_file, 'x')
+        os.remove(self.other)
+        self.assertEqual(watcher.changes(1), {self.css, new_file, self.other})
+
+    @unittest.skipUnless(platform.system() == "Linux", "inotify 仅在 Linux 上可用")
+    def test_inotify_watcher(self):
+        """测试 inotify 监听，包括递归时新建的子目录"""
+        watcher = html2pdf.InotifyWatcher([(self.test_dir, True)])
+        try:
+            self._write(self.css, 'p { color: blue; }')
+            self.assertIn(self.css, html2pdf.next_batch(watcher, 0.1))
+
+            sub = os.path.join(self.test_dir, "sub")
+            os.mkdir(sub)
+            watcher.changes(0.5)
+            nested = os.path.join(sub, "nested.html")
+            self._write(nested, 'x')
+            self.assertIn(nested, html2pdf.next_batch(watcher, 0.1))
+        finally:
+            watcher.close()
+
+    def test_watch_rebuilds_dependents(self):
+        """测试监听循环: 修改样式表后只重新渲染引用它的页面"""
+        built = []
+
+        def build_one(f):
+            built.append(f)
+            # 记录到一次重建后退出监听循环
+            raise KeyboardInterrupt
+
+        def edit_later():
+            time.sleep(0.3)
+            self._write(self.css, 'p { color: green; } /* edited */')
+
+        editor = threading.Thread(target=edit_later)
+        editor.start()
+        with ThreadPoolExecutor(max_workers=1) as executor, patch('builtins.print'):
+            html2pdf.watch_and_rebuild(executor, self.test_dir, False, [], build_one, debounce=0.1, polling=True)
+        editor.join()
+        self.assertEqual(built, [os.path.abspath(self.page)])
+
+    def test_watch_ignores_pages_outside_input_set(self):
+        """测试资源目录中的 HTML 与非递归时的子目录页面不会被当作重建目标"""
+        shared = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, shared)
+        shared_css = os.path.join(shared, "style.css")
+        template = os.path.join(shared, "template.html")
+        nested = os.path.join(self.test_dir, "sub", "nested.html")
+        os.makedirs(os.path.dirname(nested))
+        self._write(shared_css, 'p {}')
+        self._write(template, '<link rel="stylesheet" href="style.css">')
+        self._write(nested, '<link rel="stylesheet" href="../style.css">')
+        self._write(self.page, f'<link rel="stylesheet" href="{html2pdf.file_url_for(shared_css)}"><p>page</p>')
+        built = []
+
+        def build_one(f):
+            built.append(f)
+            raise KeyboardInterrupt
+
+        def edit_later():
+            time.sleep(0.3)
+            self._write(shared_css, 'p { color: green; }')
+            self._write(template, '<p>edited</p>')
+            self._write(nested, '<p>edited</p>')
+
+        editor = threading.Thread(target=edit_later)
+        editor.start()
+        with ThreadPoolExecutor(max_workers=1) as executor, patch('builtins.print'):
+            html2pdf.watch_and_rebuild(executor, self.test_dir, False, [], build_one, debounce=0.3, polling=True)
+        editor.join()
+        self.assertEqual(built, [os.path.abspath(self.page)])
+
+
+class TestSharding(unittest.TestCase):
+    """测试 --shard 分片与报告合并"""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.files = []
+        for i in range(40):
+            path = os.path.join(self.test_dir, f"d{i % 3}", f"f{i}.html")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write("x" * (1000 if i < 4 else 10))
+            self.files.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_parse_shard(self):
+        """测试分片参数解析与校验"""
+        self.assertEqual(html2pdf.parse_shard("1/4"), (1, 4))
+        for bad in ("4/4", "-1/4", "a/b", "1"):
+            with self.assertRaises(argparse.ArgumentTypeError):
+                html2pdf.parse_shard(bad)
+
+    def test_shards_partition_files(self):
+        """测试各分片互不重叠且覆盖全部文件，两种模式均是"""
+        for by_size in (False, True):
+            parts = [list(html2pdf.shard_files(iter(self.files), self.test_dir, i, 4, by_size)) for i in range(4)]
+            merged = sorted(f for part in parts for f in part)
+            self.assertEqual(merged, sorted(self.files))
+            self.assertTrue(all(parts))
+
+    def test_shard_is_stable_across_mount_points(self):
+        """测试分配只依赖相对路径，不依赖挂载位置与文件顺序"""
+        moved = tempfile.mkdtemp()
+        try:
+            copied = os.path.join(moved, "tree")
+            shutil.copytree(self.test_dir, copied)
+            copied_files = [os.path.join(copied, os.path.relpath(f, self.test_dir)) for f in reversed(self.files)]
+            for by_size in (False, True):
+                a = html2pdf.shard_files(iter(self.files), self.test_dir, 1, 3, by_size)
+                b = html2pdf.shard_files(iter(copied_files), copied, 1, 3, by_size)
+                self.assertEqual(sorted(os.path.relpath(f, self.test_dir) for f in a),
+                                 sorted(os.path.relpath(f, copied) for f in b))
+        finally:
+            shutil.rmtree(moved)
+
+    def test_shard_by_size_balances_bytes(self):
+        """测试按大小分片时，4 个大文件落在不同分片"""
+        big = set(self.files[:4])
+        for i in range(4):
+            part = set(html2pdf.shard_files(iter(self.files), self.test_dir, i, 4, by_size=True))
+            self.assertEqual(len(part & big), 1)
+
+    def test_merge_reports(self):
+        """测试合并分片报告并重新计算汇总"""
+        paths = []
+        for index, ext in ((0, ".json"), (2, ".jsonl")):
+            report = html2pdf.RunReport(shard=(index, 3))
+            report.add({"input": f"{index}.html", "status": "generated", "total_time": 1.0 + index})
+            path = os.path.join(self.test_dir, f"run-{index}{ext}")
+            report.write(path)
+            paths.append(path)
+
+        records, summary = html2pdf.merge_reports(paths)
+        self.assertEqual(sorted(r["input"] for r in records), ["0.html", "2.html"])
+        self.assertEqual(summary["files"], 2)
+        self.assertEqual(summary["missing_shards"], [1])
+        self.assertEqual(summary["latency"]["p99"], 3.0)
+
+    @patch('html2pdf.run_conversion')
+    @patch('html2pdf.find_browser_executable')
+    def test_main_with_shard(self, mock_find, mock_run):
+        """测试 main 只处理本分片，并把分片序号写入报告文件名"""
+        mock_find.return_value = "dummy_browser"
+        mock_run.return_value = True
+        report = os.path.join(self.test_dir, "run-{shard}.json")
+        with patch.object(sys, 'argv', ['html2pdf.py', self.test_dir, '-r', '-f', '--shard', '2/4',
+                                        '--report', report]), patch('builtins.print'):
+            html2pdf.main()
+
+        expected = list(html2pdf.shard_files(iter(self.files), self.test_dir, 2, 4))
+        self.assertEqual(sorted(c[0][1] for c in mock_run.call_args_list), sorted(expected))
+        records, summary = html2pdf.read_report(os.path.join(self.test_dir, "run-2.json"))
+        self.assertEqual(summary["shard"], {"index": 2, "count": 4})
+        self.assertEqual(len(records), len(expected))
+
+    def test_shard_by_size_requires_shard(self):
+        """测试未指定 --shard 时 --shard-by-size 报错，而不是悄悄被忽略"""
+        argv = ['html2pdf.py', self.test_dir, '--shard-by-size']
+        with patch.object(sys, 'argv', argv), patch('sys.stderr', new_callable=io.StringIO) as err, \
+                self.assertRaises(SystemExit) as cm:
+            html2pdf.main()
+        self.assertEqual(cm.exception.code, 2)
+        self.assertIn("--shard", err.getvalue())
+
+
+class TestOfflineMode(unittest.TestCase):
+    """测试 --offline / --asset-cache 离线渲染"""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.cache = os.path.join(self.test_dir, "cache")
+        os.makedirs(os.path.join(self.cache, "cdn.example.com", "fonts"))
+        with open(os.path.join(self.cache, "cdn.example.com", "fonts", "a.css"), 'w') as f:
+            f.write("body {}")
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_asset_cache_path(self):
+        """测试远程地址到缓存路径的映射，以及防止跳出缓存目录"""
+        expected = os.path.join(self.cache, "cdn.example.com", "fonts", "a.css")
+        self.assertEqual(html2pdf.asset_cache_path(self.cache, "https://cdn.example.com/fonts/a.css?v=3"), expected)
+        self.assertIsNone(html2pdf.asset_cache_path(self.cache, "https://cdn.example.com/missing.js"))
+        self.assertIsNone(html2pdf.asset_cache_path(self.cache, "https://cdn.example.com/../../etc/passwd"))
+
+    @patch('html2pdf.run_browser')
+    @patch('os.makedirs')
+    def test_cli_offline_args(self, mock_makedirs, mock_run):
+        """测试命令行引擎附加屏蔽远程请求的参数"""
+        mock_run.return_value = MagicMock(returncode=0)
+        html2pdf.run_conversion("chrome", "in.html", os.path.join(self.test_dir, "out.pdf"), True,
+                                browser_args=html2pdf.OFFLINE_BROWSER_ARGS)
+        cmd = mock_run.call_args[0][0]
+        self.assertIn("--host-resolver-rules=MAP * ~NOTFOUND", cmd)
+        self.assertTrue(cmd[-1].startswith("file://"))
+
+    def test_cdp_intercepts_requests(self):
+        """测试 cdp 引擎放行本地请求、用缓存响应命中的远程请求、屏蔽其余请求"""
+        server = FakeDevToolsServer(paused_urls=["file:///tmp/a.html", "https://tracker.example.com/t.js",
+                                                 "https://cdn.example.com/fonts/a.css"])
+        session = html2pdf.DevToolsSession("chrome", offline=True, asset_cache=self.cache)
+        try:
+            with patch('html2pdf.launch_devtools_browser', return_value=(None, server.url, None)):
+                session.print_to_pdf("file:///tmp/a.html", os.path.join(self.test_dir, "a.pdf"))
+        finally:
+            session.close()
+            server.close()
+
+        replies = {m["params"].get("requestId"): m for m in server.messages if m["method"].startswith("Fetch.")}
+        self.assertIn("Fetch.enable", server.methods)
+        self.assertEqual(replies["R0"]["method"], "Fetch.continueRequest")
+        self.assertEqual(replies["R1"]["method"], "Fetch.failRequest")
+        self.assertEqual(replies["R2"]["method"], "Fetch.fulfillRequest")
+        self.assertEqual(base64.b64decode(replies["R2"]["params"]["body"]), b"body {}")
+
+
+class TestCleanPipeline(unittest.TestCase):
+    """测试 --clean: 内存中清理后直接渲染"""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.src = os.path.join(self.test_dir, "src")
+        os.makedirs(self.src)
+        with open(os.path.join(self.src, "a.html"), 'w', encoding='utf-8') as f:
+            f.write('<html><head></head><body><div class="ad">AD</div><img src="img/a.png"></body></html>')
+        with open(os.path.join(self.src, "b.html"), 'w', encoding='utf-8') as f:
+            f.write('<html><body><p>clean already</p></body></html>')
+        self.out = os.path.join(self.test_dir, "out")
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    @patch('html2pdf.run_browser')
+    def test_cli_pipeline_renders_cleaned_html_with_base(self, mock_run):
+        """测试清理后的内容在源目录之外渲染、带原位置的 <base>，未命中的文件直接渲染源文件"""
+        rendered = {}
+
+        def fake_run(cmd, *rest):
+            url = cmd[-1]
+            path = html2pdf.urllib.request.url2pathname(html2pdf.urllib.parse.urlparse(url).path)
+            with open(path, encoding='utf-8-sig') as f:
+                rendered[os.path.dirname(path)] = rendered.get(os.path.dirname(path), []) + [f.read()]
+            pdf_path = [c for c in cmd if c.startswith("--print-to-pdf=")][0].split("=", 1)[1]
+            with open(pdf_path, "wb") as f:
+                f.write(b"%PDF")
+            return subprocess.CompletedProcess(cmd, 0, b"", b"")
+
+        mock_run.side_effect = fake_run
+        with patch.object(sys, 'argv', ['html2pdf.py', self.src, '-d', self.out, '--browser-path', sys.executable,
+                                        '--clean', '.ad', '--clean', '#nothing', '-j', '2']):
+            html2pdf.main()
+
+        pages = sum(rendered.values(), [])
+        cleaned = [p for p in pages if 'img/a.png' in p][0]
+        self.assertNotIn(cleaned, rendered[self.src])
+        self.assertNotIn("AD", cleaned)
+        self.assertIn(f'<base href="{html2pdf.file_url_for(os.path.join(self.src, "a.html"))}">', cleaned)
+        self.assertIn("clean already", " ".join(pages))
+        self.assertEqual(sorted(os.listdir(self.out)), ["a.pdf", "b.pdf"])
+        # 临时文件已删除，源文件未被修改
+        self.assertEqual(sorted(os.listdir(self.src)), ["a.html", "b.html"])
+        with open(os.path.join(self.src, "a.html"), encoding='utf-8') as f:
+            self.assertIn("AD", f.read())
+
+    def test_clean_for_render(self):
+        """测试未命中选择器时返回 None (直接渲染源文件)"""
+        self.assertIsNone(html2pdf.clean_for_render(os.path.join(self.src, "b.html"), ".ad"))
+        self.assertNotIn("AD", html2pdf.clean_for_render(os.path.join(self.src, "a.html"), ".ad"))
+
+    @patch('html2pdf.run_browser')
+    def test_cli_non_utf8_source_written_with_bom(self, mock_run):
+        """测试 GBK 页面清理后以带 BOM 的 UTF-8 写出 (BOM 优先于保留的 <meta charset="gbk">)"""
+        with open(os.path.join(self.src, "a.html"), 'wb') as f:
+            f.write('<html><head><meta charset="gbk"></head><body><div class="ad">广告</div><p>中文</p></body></html>'
+                    .encode('gbk'))
+        raw = {}
+
+        def fake_run(cmd, *rest):
+            path = html2pdf.urllib.request.url2pathname(html2pdf.urllib.parse.urlparse(cmd[-1]).path)
+            with open(path, 'rb') as f:
+                raw[os.path.basename(path)] = f.read()
+            with open([c for c in cmd if c.startswith("--print-to-pdf=")][0].split("=", 1)[1], "wb") as f:
+                f.write(b"%PDF")
+            return subprocess.CompletedProcess(cmd, 0, b"", b"")
+
+        mock_run.side_effect = fake_run
+        with patch.object(sys, 'argv', ['html2pdf.py', os.path.join(self.src, "a.html"), '-d', self.out,
+                                        '--browser-path', sys.executable, '--clean', '.ad']):
+            html2pdf.main()
+        page = [v for k, v in raw.items() if k != "a.html"][0]
+        self.assertTrue(page.startswith(codecs.BOM_UTF8))
+        self.assertIn("<p>中文</p>", page.decode('utf-8-sig'))
+        self.assertNotIn("广告", page.decode('utf-8-sig'))
+
+    @patch('html2pdf.run_browser')
+    def test_skipped_files_not_cleaned(self, mock_run):
+        """测试已存在 (未加 -f) 或增量清单判定未变化的文件不做清理"""
+        os.makedirs(self.out)
+        for name in ("a.pdf", "b.pdf"):
+            with open(os.path.join(self.out, name), 'wb') as f:
+                f.write(b"%PDF")
+        with patch('html2pdf.clean_for_render') as mock_clean, \
+                patch.object(sys, 'argv', ['html2pdf.py', self.src, '-d', self.out, '--browser-path', sys.executable,
+                                           '--clean', '.ad']):
+            html2pdf.main()
+        mock_clean.assert_not_called()
+        mock_run.assert_not_called()
+
+        mock_run.side_effect = lambda cmd, *rest: (open([c for c in cmd if c.startswith("--print-to-pdf=")][0]
+                                                         .split("=", 1)[1], "wb").close()
+                                                   or subprocess.CompletedProcess(cmd, 0, b"", b""))
+        argv = ['html2pdf.py', self.src, '-d', self.out, '--browser-path', sys.executable, '--clean', '.ad',
+                '--incremental']
+        with patch.object(sys, 'argv', argv):
+            html2pdf.main()
+        with patch('html2pdf.clean_for_render') as mock_clean, patch.object(sys, 'argv', argv):
+            html2pdf.main()
+        mock_clean.assert_not_called()
+
+    def test_cdp_renders_in_memory(self):
+        """测试 cdp 引擎把清理后的内容写入页面，且页面位于源文件目录下"""
+        server = FakeDevToolsServer()
+        pool = html2pdf.DevToolsPool("chrome")
+        out = os.path.join(self.out, "a.pdf")
+        try:
+            with patch('html2pdf.launch_devtools_browser', return_value=(None, server.url, None)):
+                self.assertTrue(html2pdf.run_conversion("chrome", os.path.join(self.src, "a.html"), out,
+                                                        pool=pool, html="<p>cleaned</p>"))
+        finally:
+            pool.close()
+            server.close()
+        navigate = [m for m in server.messages if m["method"] == "Page.navigate"][0]["params"]["url"]
+        self.assertEqual(navigate, html2pdf.file_url_for(self.src) + "/")
+        content = [m for m in server.messages if m["method"] == "Page.setDocumentContent"][0]["params"]["html"]
+        self.assertIn("<p>cleaned</p>", content)
+        with open(out, 'rb') as f:
+            self.assertEqual(f.read(), FakeDevToolsServer.PDF_BYTES)
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file